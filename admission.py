@@ -0,0 +1,129 @@
+import queue
+import threading
+import time
+from collections import deque
+
+from outbox import TokenBucket
+
+# Сколько ведер помнить, прежде чем удалять полные (неактивных пользователей)
+MAX_BUCKETS = 10000
+
+
+class AdmissionQueue:
+    """Очередь входящих обновлений перед рабочими потоками.
+    
+    Обновления делятся на две полосы (`classify(update)` возвращает
+    (пользователь, ключ чтения или None)):
+    * изменения и команды админа (ключ None) - ограничены только `maxsize`
+      и всегда выдаются первыми;
+    * чтение (ключ - например (чат, "👥 Список")) идет после них, и его
+      можно отбросить:
+      - повтор того же запроса, пока первый еще ждет в очереди, -
+        склеивается с ним: ответ будет один;
+      - у каждого пользователя ведро токенов (`rate` в секунду, не
+        больше `burst`) - лишние нажатия отбрасываются;
+      - полоса чтения не больше `max_reads`, при переполнении новые
+        запросы отбрасываются.
+    
+    Отброшенное передается в `on_drop(update)` (например, отметить
+    обновление обработанным). Интерфейс как у queue.Queue (put, put_nowait,
+    get), None - сигнал рабочему потоку остановиться: выдается, когда
+    очередь опустеет.
+    """
+    
+    def __init__(self, classify, maxsize=1000, rate=1.0, burst=5, max_reads=200,
+                 on_drop=None, clock=time.monotonic):
+        self.classify = classify
+        self.maxsize = maxsize
+        self.rate = rate
+        self.burst = burst
+        self.max_reads = max_reads
+        self.on_drop = on_drop
+        self.clock = clock
+        self._cond = threading.Condition()
+        self._writes = deque()
+        self._reads = deque()
+        self._pending = set()
+        self._buckets = {}
+        self._stops = 0
+        self.stats = {'writes': 0, 'reads': 0, 'coalesced': 0, 'limited': 0, 'shed': 0}
+    
+    def qsize(self):
+        with self._cond:
+            return len(self._writes) + len(self._reads)
+    
+    # ===== ПРИЕМ =====
+    def put(self, update, block=True):
+        if update is None:
+            with self._cond:
+                self._stops += 1
+                self._cond.notify_all()
+            return
+        user_id, read_key = self.classify(update)
+        if read_key is None:
+            self._put_write(update, block)
+            return
+        reason = self._put_read(update, user_id, read_key)
+        if reason:
+            self.stats[reason] += 1
+            if self.on_drop:
+                self.on_drop(update)
+    
+    def put_nowait(self, update):
+        self.put(update, block=False)
+    
+    def _put_write(self, update, block):
+        with self._cond:
+            while len(self._writes) >= self.maxsize:
+                if not block:
+                    raise queue.Full
+                self._cond.wait()
+            self._writes.append(update)
+            self.stats['writes'] += 1
+            self._cond.notify_all()
+    
+    def _put_read(self, update, user_id, read_key):
+        """Поставить чтение в очередь; причина отказа или None"""
+        key = (user_id, read_key)
+        now = self.clock()
+        with self._cond:
+            if key in self._pending:
+                return 'coalesced'
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                if len(self._buckets) >= MAX_BUCKETS:
+                    self._forget_idle(now)
+                bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst, now)
+            if bucket.wait_time(now) > 0:
+                return 'limited'
+            if len(self._reads) >= self.max_reads:
+                return 'shed'
+            bucket.take(now)
+            self._pending.add(key)
+            self._reads.append((key, update))
+            self.stats['reads'] += 1
+            self._cond.notify_all()
+        return None
+    
+    def _forget_idle(self, now):
+        # Полное ведро ничем не отличается от нового
+        for user_id, bucket in list(self._buckets.items()):
+            if bucket.wait_time(now) == 0 and bucket.tokens >= bucket.capacity:
+                del self._buckets[user_id]
+    
+    # ===== ВЫДАЧА =====
+    def get(self):
+        with self._cond:
+            while True:
+                if self._writes:
+                    update = self._writes.popleft()
+                    self._cond.notify_all()
+                    return update
+                if self._reads:
+                    key, update = self._reads.popleft()
+                    self._pending.discard(key)
+                    return update
+                if self._stops:
+                    self._stops -= 1
+                    return None
+                self._cond.wait()
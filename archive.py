@@ -0,0 +1,332 @@
+import json
+import logging
+import os
+import threading
+from bisect import bisect_left, insort
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+try:
+    import fcntl
+except ImportError:  # Windows: архив пишет только один процесс
+    fcntl = None
+
+from journal import write_atomic
+from roster import MAIN, MANUAL, RESERVE, name_key
+
+logger = logging.getLogger(__name__)
+
+# Отмена позже чем за столько часов до начала считается поздней
+LATE_CANCEL_HOURS = 24
+# Сколько последних тренировок помнить для скорости заполнения по дням недели
+FILL_HISTORY = 10
+
+
+def user_key(user):
+    """Ключ участника в статистике: Telegram id или имя (ручные записи)"""
+    if user.get('id') is not None:
+        return str(user['id'])
+    return 'name:' + name_key(user['display_name'])
+
+
+def training_start(record):
+    try:
+        return datetime.strptime(f"{record['date']} {record['time']}", '%Y-%m-%d %H:%M')
+    except (KeyError, ValueError):
+        return None
+
+
+def signed_at(user, start):
+    """Когда участник записался (без часового пояса).
+    
+    Новые записи хранят полное время в 'signed_at'. У старых есть только
+    'time' (ЧЧ:ММ) - считаем, что это последний такой момент до начала.
+    """
+    if user.get('signed_at'):
+        return datetime.fromisoformat(user['signed_at']).replace(tzinfo=None)
+    try:
+        clock = datetime.strptime(user.get('time', ''), '%H:%M').time()
+    except ValueError:
+        return None
+    moment = datetime.combine(start.date(), clock)
+    if moment > start:
+        moment -= timedelta(days=1)
+    return moment
+
+
+class AttendanceStats:
+    """Агрегаты по истории, обновляются по одной записи архива.
+    
+    На участника: сколько раз был в основном списке к концу тренировки,
+    сколько раз остался в резерве, отмены (и поздние), переводы из
+    резерва, суммарное время от записи до начала. Рейтинги посещений и
+    риска неявки хранятся отсортированными (bisect), поэтому топ-N
+    отдается без прохода по всей истории.
+    """
+    
+    def __init__(self):
+        self.users = {}
+        self.fill = {}
+        self.trainings = 0
+        self._top = []
+        self._risk = []
+    
+    # ===== ОБНОВЛЕНИЕ =====
+    def _user(self, key, name):
+        user = self.users.get(key)
+        if user is None:
+            user = self.users[key] = {
+                'name': name, 'attended': 0, 'reserve': 0, 'cancels': 0,
+                'late_cancels': 0, 'promotions': 0, 'lead_hours': 0.0, 'leads': 0,
+            }
+            self._index(key, user)
+        user['name'] = name
+        return user
+    
+    def _rank(self, key, user):
+        return (-user['attended'], key), (-self.risk(user), key)
+    
+    def _index(self, key, user):
+        top, risk = self._rank(key, user)
+        insort(self._top, top)
+        insort(self._risk, risk)
+    
+    def _unindex(self, key, user):
+        top, risk = self._rank(key, user)
+        del self._top[bisect_left(self._top, top)]
+        del self._risk[bisect_left(self._risk, risk)]
+    
+    def _update(self, key, name, **changes):
+        user = self._user(key, name)
+        self._unindex(key, user)
+        for field, value in changes.items():
+            user[field] += value
+        self._index(key, user)
+    
+    def add(self, record):
+        kind = record.get('kind', 'training')
+        if kind == 'training':
+            self._add_training(record)
+        elif kind == 'cancel':
+            late = record.get('hours_left') is not None and record['hours_left'] < LATE_CANCEL_HOURS
+            self._update(record['user'], record['name'], cancels=1, late_cancels=int(late))
+        elif kind == 'promote':
+            self._update(record['user'], record['name'], promotions=1)
+    
+    def _add_training(self, record):
+        self.trainings += 1
+        start = training_start(record)
+        main = record.get(MAIN, []) + record.get(MANUAL, [])
+        for user in main:
+            changes = {'attended': 1}
+            moment = signed_at(user, start) if start else None
+            if moment is not None:
+                # Дописанных задним числом считаем записавшимися к началу
+                changes['lead_hours'] = max(0.0, (start - moment).total_seconds() / 3600)
+                changes['leads'] = 1
+            self._update(user_key(user), user['display_name'], **changes)
+        for user in record.get(RESERVE, []):
+            self._update(user_key(user), user['display_name'], reserve=1)
+        if start is not None:
+            self._add_fill(record, start, main)
+    
+    def _add_fill(self, record, start, main):
+        """За сколько минут от первой записи заполнился основной список"""
+        limit = record.get('max_main')
+        moments = sorted(m for m in (signed_at(user, start) for user in main) if m)
+        minutes = None
+        if limit and len(moments) >= limit:
+            minutes = round((moments[limit - 1] - moments[0]).total_seconds() / 60)
+        history = self.fill.setdefault(str(start.weekday()), [])
+        history.append({'date': record['date'], 'minutes': minutes,
+                        'main': len(main), 'limit': limit})
+        del history[:-FILL_HISTORY]
+    
+    # ===== ЗАПРОСЫ =====
+    @staticmethod
+    def signups(user):
+        return user['attended'] + user['reserve'] + user['cancels']
+    
+    @classmethod
+    def risk(cls, user):
+        """Риск неявки: доля отмен, поздние считаются дважды (+1 сглаживает новичков)"""
+        return (user['cancels'] + user['late_cancels']) / (cls.signups(user) + 1)
+    
+    def _first(self, ranking, n):
+        result = []
+        for rank, key in ranking:
+            if len(result) >= n or rank == 0:
+                break
+            result.append((key, self.users[key]))
+        return result
+    
+    def top(self, n=10):
+        return self._first(self._top, n)
+    
+    def risky(self, n=10):
+        return self._first(self._risk, n)
+    
+    def fill_history(self, weekday):
+        return self.fill.get(str(weekday), [])
+    
+    # ===== СОХРАНЕНИЕ =====
+    def to_json(self):
+        return {'users': self.users, 'fill': self.fill, 'trainings': self.trainings}
+    
+    @classmethod
+    def from_json(cls, data):
+        stats = cls()
+        stats.fill = data.get('fill', {})
+        stats.trainings = data.get('trainings', 0)
+        for key, user in data.get('users', {}).items():
+            stats.users[key] = user
+            stats._index(key, user)
+        return stats
+
+
+class Archive:
+    """История: по одной JSON-строке на событие, файл только дописывается.
+    
+    События:
+    * тренировка (kind 'training' или без kind) - в формате файла данных
+      (списки участников, дата, время, место) плюс время архивации и
+      причина;
+    * 'cancel' / 'promote' - отмена записи и перевод из резерва.
+    
+    Агрегаты (AttendanceStats) сохраняются рядом в `stats_path` вместе с
+    позицией в архиве, до которой они посчитаны; при запуске дочитывается
+    только хвост архива после этой позиции. Запись события - только
+    строка в архив, агрегаты сохраняются раз в `checkpoint` событий и в
+    close(): после сбоя несохраненный хвост будет просто дочитан.
+    
+    В архив могут писать несколько процессов бота: запись идет под
+    файловой блокировкой после дочитывания чужих строк, sync() перед
+    запросами статистики подхватывает то, что дописали другие.
+    """
+    
+    def __init__(self, path, stats_path=None, checkpoint=100):
+        self.path = path
+        self.stats_path = stats_path or f"{path}.stats"
+        self.checkpoint = checkpoint
+        self.lock = threading.Lock()
+        self.stats = AttendanceStats()
+        self.count = 0
+        self._offset = 0
+        self._occurrences = set()
+        # Учтено событий после последнего сохранения агрегатов
+        self._unsaved = 0
+    
+    def open(self):
+        saved = {}
+        if os.path.exists(self.stats_path):
+            try:
+                with open(self.stats_path, 'r', encoding='utf-8') as f:
+                    saved = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error(f"Статистика архива повреждена, пересчитываем: {e}")
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if saved and saved.get('offset', 0) <= size:
+            self.stats = AttendanceStats.from_json(saved)
+            self.count = saved.get('count', 0)
+            self._occurrences = set(saved.get('occurrences', []))
+            self._offset = saved['offset']
+        
+        with self._file_lock(shared=True):
+            replayed = self._catch_up()
+        if replayed:
+            self._save_stats()
+        if self.count:
+            logger.info(f"🗄 В архиве записей: {self.count} (дочитано {replayed})")
+    
+    @contextmanager
+    def _file_lock(self, shared=False):
+        if fcntl is None:
+            yield
+            return
+        with open(f"{self.path}.lock", 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+    
+    def _catch_up(self):
+        """Учесть записи после self._offset (свои уже учтены)"""
+        replayed = 0
+        for record, offset in self._read_from(self._offset):
+            self._index(record)
+            self._offset = offset
+            replayed += 1
+        return replayed
+    
+    def close(self):
+        """Сохранить агрегаты, если есть несохраненные события"""
+        with self.lock:
+            if self._unsaved:
+                self._save_stats()
+    
+    def sync(self):
+        """Подхватить записи других процессов"""
+        if os.path.exists(self.path) and os.path.getsize(self.path) == self._offset:
+            return 0
+        with self.lock, self._file_lock(shared=True):
+            return self._catch_up()
+    
+    def _index(self, record):
+        self.count += 1
+        self._unsaved += 1
+        if record.get('occurrence'):
+            self._occurrences.add(record['occurrence'])
+        self.stats.add(record)
+    
+    def _save_stats(self):
+        payload = dict(self.stats.to_json(), offset=self._offset, count=self.count,
+                       occurrences=sorted(self._occurrences))
+        write_atomic(self.stats_path, json.dumps(payload, ensure_ascii=False))
+        self._unsaved = 0
+    
+    def append(self, record):
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self.lock, self._file_lock():
+            self._catch_up()
+            if os.path.exists(self.path) and os.path.getsize(self.path) > self._offset:
+                # Оборванная строка после падения (пишем только под этой
+                # блокировкой - ее никто не дописывает): иначе новая запись
+                # склеится с ней и тоже пропадет
+                logger.warning(f"Отрезана оборванная строка архива {self.path}")
+                os.truncate(self.path, self._offset)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+                self._offset = f.tell()
+            self._index(record)
+            if self._unsaved >= self.checkpoint:
+                self._save_stats()
+    
+    def has_occurrence(self, occurrence):
+        self.sync()
+        with self.lock:
+            return occurrence in self._occurrences
+    
+    def _read_from(self, offset):
+        """Записи после позиции `offset`: (запись, позиция после нее).
+        Оборванная последняя строка пропускается"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                offset += len(line)
+                if not line.endswith(b'\n'):
+                    logger.warning(f"Пропущена оборванная строка архива {self.path}")
+                    return
+                try:
+                    yield json.loads(line), offset
+                except ValueError:
+                    logger.warning(f"Пропущена поврежденная строка архива {self.path}")
+    
+    def records(self):
+        """Все записи по порядку"""
+        for record, _ in self._read_from(0):
+            yield record
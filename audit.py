@@ -0,0 +1,199 @@
+import glob
+import json
+import logging
+import os
+import queue
+import re
+import threading
+from collections import deque
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from roster import name_key
+
+logger = logging.getLogger(__name__)
+
+# Старые файлы после ротации: audit.1, audit.2 ...
+ROTATED = re.compile(r'\.\d+$')
+
+
+def op_events(op, result, training=None):
+    """События журнала по примененной операции хранилища и ее результату"""
+    kind = op['op']
+    training = op.get('training', training)
+    if kind == 'batch':
+        for sub, sub_result in zip(op['ops'], result):
+            yield from op_events(sub, sub_result, training)
+        return
+    
+    event = {'event': kind, 'training': training}
+    if kind in ('join', 'manual_add'):
+        user = op['user']
+        event.update(event='join' if kind == 'join' else 'add', list=op['list'],
+                     user=user.get('id'), name=user['display_name'],
+                     signed_at=user.get('signed_at'))
+    elif kind in ('cancel', 'promote', 'remove', 'move', 'rename'):
+        if result is None:
+            return
+        event.update(user=result.id, name=result.display_name)
+        if kind == 'move':
+            event['list'] = op['list']
+    elif kind == 'settings':
+        event['values'] = op['values']
+    elif kind == 'create':
+        event.update(date=op['data'].get('date'), time=op['data'].get('time'))
+    yield event
+
+
+class AuditLog:
+    """Журнал изменений списков: одна JSON-строка на событие (кто, что,
+    когда по Москве, кем сделано).
+    
+    Запись не задерживает обработчик: строка уходит в очередь
+    (QueueHandler), в файл ее пишет поток QueueListener через
+    RotatingFileHandler - файл не больше `max_bytes`, старых хранится
+    `backups`.
+    
+    Для /history события индексируются в памяти: по участнику (последние
+    `per_name`) и по дню (последние `days` дней). Файлы читаются один раз
+    при запуске, запросы их не перебирают.
+    
+    Если процессов несколько, каждый пишет в свой файл `path`, а
+    `siblings` - шаблон (glob) файлов остальных: перед запросом sync()
+    дочитывает их новые строки.
+    """
+    
+    def __init__(self, path, now, siblings=None, max_bytes=5 * 1024 * 1024, backups=5,
+                 per_name=50, days=31):
+        self.path = path
+        self.now = now
+        self.siblings = siblings
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.per_name = per_name
+        self.days = days
+        self.lock = threading.Lock()
+        # Один sync() за раз: позиции в чужих файлах читаются и сдвигаются вместе
+        self._sync_lock = threading.Lock()
+        self.events = 0
+        self._by_name = {}
+        self._by_day = {}
+        self._offsets = {}
+        self._listener = None
+        self._log = logging.getLogger(f'audit.{path}')
+        self._log.propagate = False
+        self._log.setLevel(logging.INFO)
+    
+    def start(self):
+        own = glob.escape(self.path)
+        paths = set(glob.glob(own))
+        paths.update(path for path in glob.glob(f"{own}.*") if ROTATED.search(path))
+        if self.siblings:
+            paths.update(glob.glob(self.siblings))
+        # От старых файлов к новым
+        for path in sorted(paths, key=os.path.getmtime):
+            offset = self._read(path)
+            if path != self.path and not ROTATED.search(path):
+                self._offsets[path] = offset
+        if self.events:
+            logger.info(f"📜 В журнале изменений событий: {self.events}")
+        
+        handler = RotatingFileHandler(self.path, maxBytes=self.max_bytes,
+                                      backupCount=self.backups, encoding='utf-8', delay=True)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        records = queue.Queue()
+        self._listener = QueueListener(records, handler)
+        self._log.addHandler(QueueHandler(records))
+        self._listener.start()
+    
+    def stop(self):
+        """Дописать очередь в файл"""
+        if self._listener is None:
+            return
+        self._listener.stop()
+        for handler in self._listener.handlers:
+            handler.close()
+        self._log.handlers.clear()
+        self._listener = None
+    
+    # ===== ЗАПИСЬ =====
+    def record(self, event):
+        """Записать событие (словарь из op_events плюс chat и by)"""
+        entry = dict(event, ts=self.now().isoformat(timespec='seconds'))
+        self._log.info(json.dumps(entry, ensure_ascii=False))
+        with self.lock:
+            self._index(entry)
+    
+    def _index(self, entry):
+        self.events += 1
+        chat = entry.get('chat')
+        if entry.get('name'):
+            key = (chat, name_key(entry['name']))
+            if key not in self._by_name:
+                self._by_name[key] = deque(maxlen=self.per_name)
+            self._by_name[key].append(entry)
+        day = entry['ts'][:10]
+        if day not in self._by_day:
+            self._by_day[day] = []
+            # Файлы процессов дочитываются вперемешку, дни приходят не по
+            # порядку - удаляем самые ранние
+            while len(self._by_day) > self.days:
+                del self._by_day[min(self._by_day)]
+            if day not in self._by_day:
+                return
+        self._by_day[day].append(entry)
+    
+    def _read(self, path, offset=0):
+        """Проиндексировать строки файла после `offset`, вернуть новую позицию"""
+        try:
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        # Строку еще дописывают - дочитаем в следующий раз
+                        break
+                    offset += len(line)
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        logger.warning(f"Пропущена поврежденная строка журнала {path}")
+                        continue
+                    with self.lock:
+                        self._index(entry)
+        except OSError as e:
+            logger.error(f"Не удалось прочитать {path}: {e}")
+        return offset
+    
+    def sync(self):
+        """Подхватить события других процессов"""
+        if not self.siblings:
+            return
+        with self._sync_lock:
+            for path in glob.glob(self.siblings):
+                if path == self.path or ROTATED.search(path):
+                    continue
+                offset = self._offsets.get(path, 0)
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    # Файл переименован при ротации - новый прочитаем с начала
+                    self._offsets.pop(path, None)
+                    continue
+                if size < offset:
+                    # Файл сменился при ротации
+                    offset = 0
+                if size != offset:
+                    self._offsets[path] = self._read(path, offset)
+    
+    # ===== ЗАПРОСЫ =====
+    def for_name(self, chat, name, limit=20):
+        """Последние события участника с этим именем"""
+        self.sync()
+        with self.lock:
+            return list(self._by_name.get((chat, name_key(name)), ()))[-limit:]
+    
+    def for_day(self, chat, day, limit=50):
+        """События за день ('ГГГГ-ММ-ДД' по Москве)"""
+        self.sync()
+        with self.lock:
+            entries = [e for e in self._by_day.get(day, ()) if e.get('chat') == chat]
+        return entries[-limit:]
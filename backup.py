@@ -0,0 +1,210 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from journal import write_atomic
+from roster import MAIN, MANUAL, RESERVE
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'manifest.json'
+
+
+def state_counts(state):
+    """Сколько тренировок и участников в состоянии (формат файла)"""
+    trainings = state.get('trainings', [state])
+    return {
+        'trainings': len(trainings),
+        'main': sum(len(t.get(MAIN, [])) for t in trainings),
+        'manual': sum(len(t.get(MANUAL, [])) for t in trainings),
+        'reserve': sum(len(t.get(RESERVE, [])) for t in trainings),
+    }
+
+
+class BackupManager(threading.Thread):
+    """Резервные копии состояния в отдельной папке.
+    
+    Копия делается в фоне, если с прошлой прошло `interval` секунд и
+    данные менялись, или сразу после `every_changes` изменений (по
+    store.version). Хранятся последние `keep_last` копий и последняя
+    копия каждого из `keep_daily` последних дней, остальные удаляются.
+    
+    Рядом лежит manifest.json - список копий с временем, числом
+    участников и sha256, поэтому поиск и восстановление не читают
+    ничего, кроме одного нужного файла.
+    """
+    
+    # Как часто проверять, не пора ли сделать копию, сек
+    POLL = 5.0
+    
+    def __init__(self, store, directory, interval=3600.0, every_changes=50,
+                 keep_last=10, keep_daily=7, tz=None):
+        super().__init__(name='backups', daemon=True)
+        self.store = store
+        self.directory = directory
+        self.interval = interval
+        self.every_changes = every_changes
+        self.keep_last = keep_last
+        self.keep_daily = keep_daily
+        self.tz = tz
+        self.lock = threading.Lock()
+        self._entries = []
+        self._by_name = {}
+        self._version = None
+        self._last_time = time.monotonic()
+        self._cond = threading.Condition()
+        self._stopped = False
+    
+    # ===== МАНИФЕСТ =====
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, MANIFEST)
+    
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            entries = []
+        except ValueError as e:
+            logger.error(f"Манифест копий поврежден, пересобираем: {e}")
+            entries = self._scan()
+        with self.lock:
+            self._entries = [e for e in entries
+                             if os.path.exists(os.path.join(self.directory, e['name']))]
+            self._by_name = {e['name']: e for e in self._entries}
+        # Изменения считаем от состояния при старте
+        self._version = self.store.version
+        if not self._entries:
+            self.snapshot('start')
+    
+    def _scan(self):
+        """Пересобрать манифест по файлам папки копий (только если он испорчен)"""
+        entries = []
+        for name in sorted(os.listdir(self.directory)):
+            if not (name.startswith('backup-') and name.endswith('.json')):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, 'rb') as f:
+                    payload = f.read()
+                state = json.loads(payload)
+            except (OSError, ValueError):
+                continue
+            entries.append(dict(
+                name=name,
+                time=datetime.fromtimestamp(os.path.getmtime(path), self.tz).isoformat(timespec='seconds'),
+                reason='scan',
+                sha256=hashlib.sha256(payload).hexdigest(),
+                size=len(payload),
+                **state_counts(state)
+            ))
+        return entries
+    
+    def _save_manifest(self):
+        write_atomic(self.manifest_path, json.dumps(self._entries, ensure_ascii=False, indent=2))
+    
+    # ===== КОПИИ =====
+    def snapshot(self, reason='manual'):
+        """Сделать копию текущего состояния, вернуть запись манифеста"""
+        with self.store.lock:
+            state = self.store.encode(self.store.data)
+            version = self.store.version
+        payload = json.dumps(state, ensure_ascii=False, indent=2)
+        
+        now = datetime.now(self.tz)
+        name = f"backup-{now.strftime('%Y%m%d-%H%M%S')}-v{version}.json"
+        entry = dict(
+            name=name,
+            time=now.isoformat(timespec='seconds'),
+            reason=reason,
+            sha256=hashlib.sha256(payload.encode('utf-8')).hexdigest(),
+            size=len(payload.encode('utf-8')),
+            **state_counts(state)
+        )
+        
+        with self.lock:
+            write_atomic(os.path.join(self.directory, name), payload)
+            if name in self._by_name:
+                self._entries.remove(self._by_name[name])
+            self._entries.append(entry)
+            self._by_name[name] = entry
+            self._prune()
+            self._save_manifest()
+            self._version = version
+            self._last_time = time.monotonic()
+        logger.info(f"💾 Резервная копия {name} ({reason})")
+        return entry
+    
+    def _prune(self):
+        keep = {e['name'] for e in self._entries[-self.keep_last:]}
+        # Последняя копия каждого дня (время в манифесте начинается с даты)
+        daily = {}
+        for e in self._entries:
+            daily[e['time'][:10]] = e['name']
+        for day in sorted(daily)[-self.keep_daily:]:
+            keep.add(daily[day])
+        
+        for e in [e for e in self._entries if e['name'] not in keep]:
+            self._entries.remove(e)
+            del self._by_name[e['name']]
+            try:
+                os.remove(os.path.join(self.directory, e['name']))
+            except OSError as error:
+                logger.warning(f"Не удалось удалить копию {e['name']}: {error}")
+    
+    def entries(self):
+        """Копии из манифеста, новые первыми"""
+        with self.lock:
+            return list(reversed(self._entries))
+    
+    def find(self, name):
+        with self.lock:
+            return self._by_name.get(name)
+    
+    def read(self, name):
+        """Прочитать копию по имени (с проверкой sha256)"""
+        entry = self.find(name)
+        if entry is None:
+            raise KeyError(name)
+        with open(os.path.join(self.directory, name), 'rb') as f:
+            payload = f.read()
+        if hashlib.sha256(payload).hexdigest() != entry['sha256']:
+            raise ValueError(f"Контрольная сумма копии {name} не совпадает")
+        return json.loads(payload)
+    
+    # ===== ФОН =====
+    def run(self):
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                self._cond.wait(self.POLL)
+                if self._stopped:
+                    return
+            try:
+                self._tick()
+            except Exception as e:
+                logger.error(f"Ошибка резервного копирования: {e}")
+    
+    def _tick(self):
+        version = self.store.version
+        if version == self._version:
+            return
+        changes = version - (self._version or 0)
+        if changes >= self.every_changes:
+            self.snapshot('changes')
+        elif time.monotonic() - self._last_time >= self.interval:
+            self.snapshot('timer')
+    
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self.is_alive():
+            self.join()
@@ -0,0 +1,606 @@
+"""Нагрузочный стенд: бот против локальной заглушки Telegram Bot API.
+
+Бот запускается в этом же процессе, telebot.apihelper.API_URL указывает
+на FakeTelegramApi, виртуальные пользователи шлют обновления через
+getUpdates и ждут ответа бота в своем чате.
+
+Сценарии:
+    stampede - открытие записи: все записываются в одну секунду
+    churn    - отмены и повторные записи (перевод из резерва)
+    admin    - админ меняет время/дату/место, пока идет нагрузка
+    storm    - все разом смотрят список
+
+Запуск:
+    python bench.py                          # все сценарии
+    python bench.py -s stampede -s storm --users 60
+    python bench.py --storage sqlite --json results.json
+    python bench.py --json new.json --compare old.json
+    python bench.py --instances 3            # 3 процесса бота с общей базой
+
+С --instances N бот запускается N отдельными процессами (MULTI_INSTANCE,
+SQLite, прием по вебхуку), заглушка раздает обновления процессам по кругу.
+В конце проверяется, что списки в базе не нарушают лимиты и в них нет
+повторов, и выводится, какой процесс был лидером.
+
+Лимиты исходящих сообщений такие же, как в боте (SEND_RATE и т.д.),
+их можно поднять переменными окружения.
+"""
+import argparse
+import itertools
+import json
+import os
+import queue
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+BENCH_TOKEN = '123456:bench'
+ADMIN = 1
+FIRST_USER = 1000
+
+SCENARIOS = ('stampede', 'churn', 'admin', 'storm')
+
+
+# ===== ЗАГЛУШКА TELEGRAM BOT API =====
+class FakeTelegramApi:
+    """Локальный HTTP-сервер с методами Bot API, которые использует бот.
+    
+    getUpdates отдает обновления, добавленные через push(), с long polling.
+    Если заданы `webhooks` (адреса процессов бота), обновления вместо этого
+    отправляются им POST-запросом по кругу.
+    Отправленные ботом сообщения попадают в почтовые ящики чатов (inbox).
+    """
+    
+    def __init__(self, host='127.0.0.1', port=0):
+        self.webhooks = []
+        self._next_webhook = itertools.count()
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._cond = threading.Condition()
+        self._inboxes = {}
+        self.calls = {}
+        self.lock = threading.Lock()
+        api = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self._dispatch()
+            
+            def do_POST(self):
+                self._dispatch()
+            
+            def _dispatch(self):
+                url = urlparse(self.path)
+                method = url.path.rsplit('/', 1)[-1]
+                params = dict(parse_qsl(url.query))
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    body = self.rfile.read(length).decode('utf-8')
+                    if self.headers.get('Content-Type', '').startswith('application/json'):
+                        params.update(json.loads(body))
+                    else:
+                        params.update(parse_qsl(body))
+                result = api.call(method, params)
+                payload = json.dumps({'ok': True, 'result': result}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+    
+    @property
+    def api_url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/bot{{0}}/{{1}}"
+    
+    def start(self):
+        self._thread.start()
+    
+    def stop(self):
+        with self._cond:
+            self._cond.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+    
+    # ----- Входящие для бота -----
+    def push(self, update):
+        with self._cond:
+            update['update_id'] = next(self._update_ids)
+            if not self.webhooks:
+                self._updates.append(update)
+                self._cond.notify_all()
+                return
+            url = self.webhooks[next(self._next_webhook) % len(self.webhooks)]
+        request = urllib.request.Request(
+            url, data=json.dumps(update).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}
+        )
+        urllib.request.urlopen(request, timeout=10).close()
+    
+    def _get_updates(self, params):
+        offset = int(params.get('offset', 0))
+        timeout = float(params.get('timeout', 0))
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            if offset < 0:
+                return self._updates[offset:]
+            # Подтвержденные обновления больше не нужны
+            self._updates = [u for u in self._updates if u['update_id'] >= offset]
+            while not self._updates:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                self._cond.wait(left)
+            return list(self._updates[:int(params.get('limit', 100))])
+    
+    # ----- Исходящие от бота -----
+    def inbox(self, chat_id):
+        with self.lock:
+            box = self._inboxes.get(chat_id)
+            if box is None:
+                box = self._inboxes[chat_id] = queue.Queue()
+            return box
+    
+    def _message(self, chat_id, text):
+        return {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': 1, 'is_bot': True, 'first_name': 'bench'},
+            'text': text,
+        }
+    
+    def call(self, method, params):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        
+        if method == 'getUpdates':
+            return self._get_updates(params)
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}
+        if method in ('sendMessage', 'editMessageText'):
+            chat_id = int(params['chat_id'])
+            message = self._message(chat_id, params.get('text', ''))
+            if method == 'sendMessage':
+                self.inbox(chat_id).put((time.perf_counter(), message['text']))
+            return message
+        # answerCallbackQuery, pinChatMessage, deleteWebhook и прочее
+        return True
+    
+    def calls_snapshot(self):
+        with self.lock:
+            return dict(self.calls)
+
+
+# ===== ВИРТУАЛЬНЫЕ ПОЛЬЗОВАТЕЛИ =====
+class Recorder:
+    """Задержки действий пользователей (от отправки обновления до ответа)"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.timeouts = 0
+    
+    def add(self, seconds):
+        with self.lock:
+            if seconds is None:
+                self.timeouts += 1
+            else:
+                self.latencies.append(seconds)
+
+
+class VirtualUser:
+    def __init__(self, api, user_id, recorder, reply_timeout, think=0.0):
+        self.api = api
+        self.id = user_id
+        self.recorder = recorder
+        self.reply_timeout = reply_timeout
+        # Пауза перед ответом на вопрос бота (человек отвечает не сразу)
+        self.think = think
+        self.inbox = api.inbox(user_id)
+    
+    def _user(self):
+        return {'id': self.id, 'is_bot': False, 'first_name': f'User{self.id}',
+                'username': f'user{self.id}'}
+    
+    def _wait(self, started, expect):
+        """Дождаться ответа, подходящего под expect (строки-признаки)"""
+        deadline = time.monotonic() + self.reply_timeout
+        while True:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                self.recorder.add(None)
+                return None
+            try:
+                received, text = self.inbox.get(timeout=left)
+            except queue.Empty:
+                continue
+            # Сообщения от прошлых действий (например, о переводе из
+            # резерва) пропускаем
+            if received >= started and any(mark in text for mark in expect):
+                self.recorder.add(received - started)
+                return text
+    
+    def say(self, text, expect):
+        started = time.perf_counter()
+        self.api.push({'message': {
+            'message_id': 1,
+            'date': int(time.time()),
+            'chat': {'id': self.id, 'type': 'private'},
+            'from': self._user(),
+            'text': text,
+        }})
+        return self._wait(started, expect)
+    
+    def press(self, data, expect):
+        started = time.perf_counter()
+        self.api.push({'callback_query': {
+            'id': str(started),
+            'from': self._user(),
+            'chat_instance': str(self.id),
+            'data': data,
+            'message': {
+                'message_id': 1,
+                'date': int(time.time()),
+                'chat': {'id': self.id, 'type': 'private'},
+                'text': '👑 АДМИН-ПАНЕЛЬ',
+            },
+        }})
+        return self._wait(started, expect)
+    
+    # ----- Действия -----
+    def sign_up(self):
+        # Со второй записи имя уже сохранено - бот записывает сразу
+        prompt = self.say("📝 Записаться", ("Введите имя", "✅", "⏳", "❌"))
+        if prompt and "Введите имя" in prompt:
+            time.sleep(self.think)
+            self.say(f"Игрок {self.id}", ("✅", "⏳", "❌"))
+    
+    def cancel(self):
+        self.say("🚫 Отменить", ("отменена", "не записаны", "Выберите"))
+    
+    def view_list(self):
+        self.say("👥 Список", ("ТРЕНИРОВКА", "Тренировок пока нет"))
+    
+    def admin_edit(self, field, value):
+        prompt = self.press(f'admin_{field}', ("Введите",))
+        if prompt:
+            time.sleep(self.think)
+            self.say(value, ("✅", "❌"))
+
+
+# ===== СЦЕНАРИИ =====
+def run_parallel(users, action):
+    start = threading.Barrier(len(users))
+    
+    def worker(user):
+        start.wait()
+        action(user)
+    
+    threads = [threading.Thread(target=worker, args=(user,)) for user in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def scenario_stampede(users, admin, args):
+    run_parallel(users, VirtualUser.sign_up)
+
+
+def scenario_churn(users, admin, args):
+    def churn(user):
+        for _ in range(args.rounds):
+            user.cancel()
+            user.sign_up()
+    # Отменяют и возвращаются первые участники основного списка
+    run_parallel(users[:max(1, len(users) // 3)], churn)
+
+
+def scenario_admin(users, admin, args):
+    edits = [('time', '20:30'), ('place', 'Пехорка, вторник'), ('date', '2030-01-01'),
+             ('time', '20:45')]
+    
+    def act(user):
+        if user is admin:
+            for field, value in edits * args.rounds:
+                user.admin_edit(field, value)
+        else:
+            for _ in range(args.rounds):
+                user.view_list()
+    run_parallel([admin] + users, act)
+
+
+def scenario_storm(users, admin, args):
+    def storm(user):
+        for _ in range(args.rounds):
+            user.view_list()
+    run_parallel(users, storm)
+
+
+RUNNERS = {
+    'stampede': scenario_stampede,
+    'churn': scenario_churn,
+    'admin': scenario_admin,
+    'storm': scenario_storm,
+}
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(q * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+# ===== ЗАПУСК БОТА =====
+def start_bot(api, args, workdir, admin=ADMIN):
+    os.environ.setdefault('BOT_TOKEN', BENCH_TOKEN)
+    os.environ['ADMIN_ID'] = str(admin)
+    os.environ['STORAGE_MODE'] = args.storage
+    os.environ['BOT_MODE'] = 'polling'
+    os.environ['POLL_TIMEOUT'] = '1'
+    os.environ['BACKUP_DIR'] = os.path.join(workdir, 'backups')
+    # DATA_FILE в боте - путь относительно текущей папки
+    os.chdir(workdir)
+    
+    import telebot.apihelper
+    telebot.apihelper.API_URL = api.api_url
+    import bot_railway
+    
+    bot_railway.store.load()
+    bot_railway.store.start()
+    bot_railway.audit.start()
+    bot_railway.outbox.start()
+    bot_railway.signup_burst.start()
+    bot_railway.broadcaster.start()
+    polling = threading.Thread(target=bot_railway.poller.serve_forever, daemon=True)
+    polling.start()
+    return bot_railway
+
+
+def stop_bot(bot_railway):
+    bot_railway.poller.stop()
+    bot_railway.poller.join()
+    bot_railway.signup_burst.stop()
+    bot_railway.broadcaster.stop()
+    bot_railway.outbox.stop()
+    bot_railway.store.close()
+    bot_railway.audit.stop()
+
+
+# ===== НЕСКОЛЬКО ПРОЦЕССОВ =====
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_port(port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Процесс бота не открыл порт {port}")
+
+
+def start_instances(api, args, workdir):
+    """Запустить args.instances процессов бота с общей базой в workdir"""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot_railway.py')
+    processes = []
+    for i in range(args.instances):
+        port = free_port()
+        env = dict(
+            os.environ,
+            BOT_TOKEN=os.environ.get('BOT_TOKEN', BENCH_TOKEN),
+            ADMIN_ID=str(ADMIN),
+            STORAGE_MODE='sqlite',
+            BOT_MODE='webhook',
+            WEBHOOK_URL='',
+            PORT=str(port),
+            MULTI_INSTANCE='true',
+            INSTANCE_ID=f'bench-{i}',
+            TELEGRAM_API_URL=api.api_url,
+        )
+        log = open(os.path.join(workdir, f'bench-{i}.log'), 'w')
+        processes.append(subprocess.Popen([sys.executable, script], cwd=workdir, env=env,
+                                          stdout=log, stderr=subprocess.STDOUT))
+        # Первый процесс создает базу, остальные запускаем после него
+        wait_port(port)
+        api.webhooks.append(f'http://127.0.0.1:{port}/telegram')
+    return processes
+
+
+def stop_instances(processes):
+    for process in processes:
+        process.send_signal(signal.SIGTERM)
+    for process in processes:
+        try:
+            process.wait(15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def check_database(db_path, max_main=20, max_reserve=10):
+    """Проверка общей базы после нагрузки: лимиты, повторы, лидер"""
+    conn = sqlite3.connect(db_path)
+    problems = []
+    for training_id, in conn.execute("SELECT id FROM trainings"):
+        counts = dict(conn.execute(
+            "SELECT list, COUNT(*) FROM participants WHERE training_id = ? GROUP BY list",
+            (training_id,)
+        ))
+        if counts.get('main', 0) + counts.get('manual_entries', 0) > max_main:
+            problems.append(f"тренировка {training_id}: основной список больше {max_main}")
+        if counts.get('reserve', 0) > max_reserve:
+            problems.append(f"тренировка {training_id}: резерв больше {max_reserve}")
+        for user_id, count in conn.execute(
+                "SELECT user_id, COUNT(*) FROM participants WHERE training_id = ? "
+                "AND user_id IS NOT NULL GROUP BY user_id HAVING COUNT(*) > 1", (training_id,)):
+            problems.append(f"тренировка {training_id}: {user_id} записан {count} раз")
+    leader = conn.execute("SELECT holder FROM leases").fetchone()
+    conn.close()
+    return problems, leader[0] if leader else None
+
+
+def db_writes(db_path):
+    """Число записанных операций (счетчик revision в базе)"""
+    conn = sqlite3.connect(db_path)
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()
+    except sqlite3.Error:
+        row = None
+    conn.close()
+    return int(row[0]) if row else 0
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='sportbot-bench-')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    api = FakeTelegramApi()
+    api.start()
+    processes = bot_railway = None
+    db_path = os.path.join(workdir, 'training_data.db')
+    if args.instances > 1:
+        args.storage = 'sqlite'
+        processes = start_instances(api, args, workdir)
+        writes = lambda: db_writes(db_path)
+        flush = lambda: None
+    else:
+        bot_railway = start_bot(api, args, workdir)
+        writes = lambda: bot_railway.store.writes
+        flush = bot_railway.store.flush
+    
+    results = {
+        'storage': args.storage,
+        'users': args.users,
+        'rounds': args.rounds,
+        'instances': args.instances,
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'scenarios': {},
+    }
+    try:
+        for name in args.scenario or SCENARIOS:
+            recorder = Recorder()
+            users = [VirtualUser(api, FIRST_USER + i, recorder, args.reply_timeout, args.think)
+                     for i in range(args.users)]
+            admin = VirtualUser(api, ADMIN, recorder, args.reply_timeout, args.think)
+            writes_before = writes()
+            calls_before = api.calls_snapshot()
+            
+            started = time.perf_counter()
+            RUNNERS[name](users, admin, args)
+            elapsed = time.perf_counter() - started
+            
+            # Отложенная запись могла еще не случиться - дожидаемся
+            flush()
+            calls = api.calls_snapshot()
+            latencies = recorder.latencies
+            results['scenarios'][name] = {
+                'actions': len(latencies) + recorder.timeouts,
+                'timeouts': recorder.timeouts,
+                'seconds': round(elapsed, 3),
+                'throughput': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+                'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+                'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+                'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+                'storage_writes': writes() - writes_before,
+                'api_calls': {k: v - calls_before.get(k, 0) for k, v in calls.items()
+                              if k != 'getUpdates' and v - calls_before.get(k, 0)},
+            }
+        if processes:
+            results['problems'], results['leader'] = check_database(db_path)
+    finally:
+        if processes:
+            stop_instances(processes)
+        else:
+            stop_bot(bot_railway)
+        api.stop()
+    return results
+
+
+# ===== ОТЧЕТ =====
+def report(results, baseline=None):
+    lines = [f"Хранилище: {results['storage']}, пользователей: {results['users']}, "
+             f"повторов: {results['rounds']}, процессов: {results.get('instances', 1)}", ""]
+    header = f"{'сценарий':<10} {'действий':>8} {'таймаут':>7} {'в сек':>8} " \
+             f"{'p50 мс':>8} {'p95 мс':>8} {'p99 мс':>8} {'записей':>8}"
+    lines.append(header)
+    for name, r in results['scenarios'].items():
+        lines.append(
+            f"{name:<10} {r['actions']:>8} {r['timeouts']:>7} {r['throughput']:>8} "
+            f"{r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8} {r['storage_writes']:>8}"
+        )
+        if baseline and name in baseline.get('scenarios', {}):
+            old = baseline['scenarios'][name]
+            diff = ' '.join(
+                f"{key} {old[key]}→{r[key]}"
+                for key in ('throughput', 'p95_ms', 'p99_ms', 'storage_writes')
+                if old.get(key) != r[key]
+            )
+            if diff:
+                lines.append(f"{'':<10} было: {diff}")
+    if 'problems' in results:
+        lines.append("")
+        lines.append(f"Лидер: {results['leader']}")
+        lines.extend(f"❌ {problem}" for problem in results['problems'])
+        if not results['problems']:
+            lines.append("✅ Списки в базе согласованы: лимиты соблюдены, повторов нет")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный стенд бота")
+    parser.add_argument('-s', '--scenario', action='append', choices=SCENARIOS,
+                        help="сценарий (можно несколько раз), по умолчанию все")
+    parser.add_argument('--users', type=int, default=30)
+    parser.add_argument('--rounds', type=int, default=3,
+                        help="повторов действий в churn/admin/storm")
+    parser.add_argument('--storage', choices=('snapshot', 'journal', 'sqlite'),
+                        default=os.environ.get('STORAGE_MODE', 'snapshot'))
+    parser.add_argument('--reply-timeout', type=float, default=30.0)
+    parser.add_argument('--think', type=float, default=0.2,
+                        help="пауза пользователя перед ответом на вопрос бота, сек")
+    parser.add_argument('--instances', type=int, default=1,
+                        help="процессов бота с общей базой (больше 1 - MULTI_INSTANCE)")
+    parser.add_argument('--json', help="сохранить результаты в JSON")
+    parser.add_argument('--compare', help="JSON прошлого запуска для сравнения")
+    args = parser.parse_args(argv)
+    # Бот работает в отдельной временной папке - пути делаем абсолютными
+    if args.json:
+        args.json = os.path.abspath(args.json)
+    
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    
+    results = run(args)
+    print(report(results, baseline))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
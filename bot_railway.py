@@ -5,13 +5,51 @@ import os
 import time
 from datetime import datetime, timedelta
 import logging
+import atexit
+import functools
+import signal
+import socket
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
 from pytz import timezone
 
+from state_store import StateStore
+from sqlite_store import SqliteStore
+from webhook import WebhookServer
+from outbox import Outbox, PROMOTION, REPLY
+from broadcast import Broadcaster
+from live_list import LiveList
+from burst import SignupBurst
+from backup import BackupManager
+from metrics import Metrics, MetricsServer, instrument_bot, instrument_conversations, instrument_store
+from conversation import ConversationStore, JsonFileBackend, SqliteBackend
+from profiles import ProfileStore
+import profiles
+from scheduler import Scheduler
+from schedule import WEEKDAYS, RecurringSchedule, load_slots
+from reminders import Reminders, reminder_stamp
+from archive import Archive, user_key
+from audit import AuditLog, op_events
+from traffic import Redactor, TrafficRecorder
+from leader import LeaderLease
+from updates import DEFERRED, UpdateLog, UpdatePoller
+from admission import AdmissionQueue
+from tenants import Tenant, TenantRegistry
+import commands
+from commands import CommandQueue
+from roster import state_from_json, state_to_json
+
 # ===== НАСТРОЙКА ЛОГИРОВАНИЯ =====
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
+# Вывод логов - в отдельном потоке: обработчики не ждут записи в stdout
+log_listener = QueueListener(queue.Queue(), *logging.getLogger().handlers)
+logging.getLogger().handlers = [QueueHandler(log_listener.queue)]
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
 # ===== КОНФИГУРАЦИЯ =====
@@ -30,14 +68,232 @@ else:
     MAX_RESERVE = 10
     MODE_TEXT = "РАБОЧИЙ РЕЖИМ"
 
-bot = telebot.TeleBot(TOKEN, skip_pending=True)
+# ===== ПРИЕМ ОБНОВЛЕНИЙ =====
+# polling - бот сам опрашивает Telegram (по умолчанию)
+# webhook - Telegram присылает обновления на наш HTTP-порт (Railway: PORT)
+BOT_MODE = os.environ.get('BOT_MODE', 'polling').lower()
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '')  # https://<app>.up.railway.app
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', '')
+WEBHOOK_PORT = int(os.environ.get('PORT', '8080'))
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', '4'))
+WEBHOOK_QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', '1000'))
+
+# Входящие просмотры (список, расписание, помощь, /start) - не чаще
+# INBOUND_RATE в секунду с запасом INBOUND_BURST на пользователя, в
+# очереди не больше INBOUND_MAX_READS; повторное нажатие, пока первое
+# ждет в очереди, отдельно не обрабатывается. Запись, отмена, ответы на
+# вопросы бота и команды админов идут вне этих ограничений и раньше
+INBOUND_RATE = float(os.environ.get('INBOUND_RATE', '1'))
+INBOUND_BURST = int(os.environ.get('INBOUND_BURST', '5'))
+INBOUND_MAX_READS = int(os.environ.get('INBOUND_MAX_READS', '200'))
+
+# Свой адрес Bot API: локальный сервер Bot API или заглушка из bench.py
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', '')
+if TELEGRAM_API_URL:
+    telebot.apihelper.API_URL = TELEGRAM_API_URL
+
+# Обработчики запускают рабочие потоки UpdatePoller или WebhookServer.
+# Накопившиеся за время остановки обновления не пропускаются: они
+# обрабатываются после запуска (см. ПОЛУЧЕННЫЕ ОБНОВЛЕНИЯ)
+bot = telebot.TeleBot(TOKEN, threaded=False)
+
+# ===== МЕТРИКИ =====
+# Время обработчиков, вызовов Telegram API и записи на диск.
+# METRICS_PORT > 0 - формат Prometheus на http://METRICS_HOST:METRICS_PORT/metrics,
+# админу кратко - команда /metrics
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '0'))
+METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1')
+
+metrics = Metrics()
+
+# ===== ИСХОДЯЩИЕ СООБЩЕНИЯ =====
+# Лимиты Telegram: ~30 сообщений/сек на бота, ~1/сек в личный чат,
+# ~20/мин в группу. Очередь держит скорость ниже лимитов и повторяет
+# отправку после 429 (retry_after) и сетевых ошибок
+SEND_RATE = float(os.environ.get('SEND_RATE', '30'))
+CHAT_SEND_RATE = float(os.environ.get('CHAT_SEND_RATE', '1'))
+CHAT_SEND_BURST = int(os.environ.get('CHAT_SEND_BURST', '3'))
+GROUP_SEND_RATE = float(os.environ.get('GROUP_SEND_RATE', str(20 / 60)))
+SEND_WORKERS = int(os.environ.get('SEND_WORKERS', '8'))
+SEND_ATTEMPTS = int(os.environ.get('SEND_ATTEMPTS', '5'))
+
+outbox = Outbox(
+    bot,
+    global_rate=SEND_RATE,
+    chat_rate=CHAT_SEND_RATE,
+    chat_burst=CHAT_SEND_BURST,
+    group_rate=GROUP_SEND_RATE,
+    senders=SEND_WORKERS,
+    max_attempts=SEND_ATTEMPTS
+)
+
+def send_message(chat_id, text, priority=REPLY, wait=False, **kwargs):
+    """Отправить сообщение через очередь outbox.
+    
+    wait=True - дождаться отправки и вернуть Message (нужен, например,
+    message_id), иначе возвращается Future.
+    """
+    future = outbox.submit(chat_id, 'send_message', chat_id, text, priority=priority, **kwargs)
+    return future.result() if wait else future
 
 # ===== ПРОСТОЙ ПУТЬ К ФАЙЛУ =====
 DATA_FILE = "training_data.json"  # Файл в текущей папке
 
+# ===== ОТЛОЖЕННАЯ ЗАПИСЬ =====
+# Пачка изменений подряд сохраняется одной записью: ждем FLUSH_DELAY секунд
+# тишины, но не дольше FLUSH_MAX_DELAY с первого несохраненного изменения
+FLUSH_DELAY = float(os.environ.get('FLUSH_DELAY', '0.5'))
+FLUSH_MAX_DELAY = float(os.environ.get('FLUSH_MAX_DELAY', '3'))
+
+# ===== РЕЖИМ ХРАНЕНИЯ =====
+# snapshot - весь файл перезаписывается (отложенно, см. выше)
+# journal  - каждая операция дописывается в журнал, файл данных
+#            периодически пересобирается из журнала в фоне
+# sqlite   - база SQLite (DB_FILE), при первом запуске данные
+#            переносятся из DATA_FILE
+STORAGE_MODE = os.environ.get('STORAGE_MODE', 'snapshot').lower()
+DB_FILE = os.environ.get('DB_FILE', 'training_data.db')
+JOURNAL_FILE = os.environ.get('JOURNAL_FILE', DATA_FILE + '.journal')
+COMPACT_RECORDS = int(os.environ.get('COMPACT_RECORDS', '500'))
+COMPACT_INTERVAL = float(os.environ.get('COMPACT_INTERVAL', '60'))
+
+# ===== ГРУППЫ =====
+# Группа, зарегистрированная командой /group, получает свои тренировки,
+# админов и лимиты - каталог TENANTS_DIR/<chat_id> с теми же файлами,
+# что и у основного чата. Остальные чаты работают с основными данными
+# (DATA_FILE, ADMIN_ID, MAX_MAIN/MAX_RESERVE). В памяти держится не
+# больше TENANTS_MAX_LOADED групп, давно неактивные выгружаются.
+# Пусто - только основной чат
+TENANTS_DIR = os.environ.get('TENANTS_DIR', '')
+TENANTS_MAX_LOADED = int(os.environ.get('TENANTS_MAX_LOADED', '100'))
+
+# ===== НЕСКОЛЬКО ПРОЦЕССОВ =====
+# MULTI_INSTANCE=true - несколько процессов бота с одной базой (только
+# STORAGE_MODE=sqlite и общий диск). Каждая команда над списком - одна
+# транзакция базы, поэтому лимиты соблюдаются для всех процессов сразу.
+# Разовые обязанности (расписание, напоминания, рассылки, копии, живой
+# список, getUpdates) выполняет только лидер - процесс, который держит
+# аренду в базе (LEASE_TTL сек, продление раз в LEASE_RENEW сек).
+# С вебхуком обновления принимают все процессы (numReplicas на Railway),
+# с polling остальные процессы - горячий резерв на случай падения лидера.
+# INSTANCE_ID - имя процесса, то же после перезапуска (по нему называются
+# его файлы журнала и трафика); несколько процессов на одной машине -
+# задайте каждому свое
+MULTI_INSTANCE = os.environ.get('MULTI_INSTANCE', 'False').lower() == 'true'
+INSTANCE_ID = (os.environ.get('INSTANCE_ID') or os.environ.get('RAILWAY_REPLICA_ID')
+               or socket.gethostname())
+LEASE_TTL = float(os.environ.get('LEASE_TTL', '15'))
+LEASE_RENEW = float(os.environ.get('LEASE_RENEW', '5'))
+# Как часто лидер проверяет, не поменяли ли данные другие процессы, сек
+SHARED_POLL = float(os.environ.get('SHARED_POLL', '1'))
+if MULTI_INSTANCE and STORAGE_MODE != 'sqlite':
+    raise SystemExit("MULTI_INSTANCE работает только с STORAGE_MODE=sqlite")
+
+# ===== РАССЫЛКИ =====
+# Прогресс рассылки сохраняется после каждой пачки получателей
+BROADCAST_FILE = os.environ.get('BROADCAST_FILE', DATA_FILE + '.broadcast')
+BROADCAST_BATCH = int(os.environ.get('BROADCAST_BATCH', '25'))
+
+broadcaster = Broadcaster(outbox, BROADCAST_FILE, batch_size=BROADCAST_BATCH,
+                          shared=MULTI_INSTANCE)
+
+# ===== ПОЛУЧЕННЫЕ ОБНОВЛЕНИЯ =====
+# Offset для getUpdates и id недавних обновлений хранятся в UPDATES_FILE:
+# обновление подтверждается Telegram только после обработки и записи
+# изменений на диск, повторная доставка не меняет списки второй раз.
+# POLL_WORKERS потоков обрабатывают обновления (как WEBHOOK_WORKERS)
+UPDATES_FILE = os.environ.get('UPDATES_FILE', DATA_FILE + '.updates')
+POLL_TIMEOUT = int(os.environ.get('POLL_TIMEOUT', '30'))
+POLL_WORKERS = int(os.environ.get('POLL_WORKERS', '4'))
+
+# С вебхуком offset не нужен (подтверждает ответ на запрос), а файл
+# писали бы все процессы - id недавних обновлений только в памяти
+update_log = UpdateLog(UPDATES_FILE if BOT_MODE != 'webhook' else None)
+
+# ===== ЖИВОЙ СПИСОК =====
+# В каждом чате один закрепленный список, который правится при изменениях
+# (не чаще раза в LIVE_LIST_DEBOUNCE секунд), вместо новых сообщений
+LIVE_LIST = os.environ.get('LIVE_LIST', 'False').lower() == 'true'
+LIVE_LIST_FILE = os.environ.get('LIVE_LIST_FILE', DATA_FILE + '.live')
+LIVE_LIST_DEBOUNCE = float(os.environ.get('LIVE_LIST_DEBOUNCE', '2'))
+
+# ===== ОТКРЫТИЕ ЗАПИСИ =====
+# BURST_DURATION секунд после открытия записи заявки копятся по
+# BURST_WINDOW секунд и записываются пачкой в порядке отправки
+# (по времени сообщения), 0 - записывать сразу, как раньше. Время
+# открытия хранится в тренировке - окно открывается в каждом процессе
+BURST_WINDOW = float(os.environ.get('BURST_WINDOW', '1'))
+BURST_DURATION = float(os.environ.get('BURST_DURATION', '60'))
+
+# ===== ДИАЛОГИ =====
+# Ожидаемые ответы (имя, время, номер для удаления...) хранятся на диске
+# и переживают перезапуск. Брошенный вопрос забывается через
+# CONVERSATION_TTL секунд, в памяти не больше CONVERSATION_MAX диалогов
+CONVERSATIONS_FILE = os.environ.get('CONVERSATIONS_FILE', DATA_FILE + '.conversations')
+CONVERSATION_TTL = float(os.environ.get('CONVERSATION_TTL', '900'))
+CONVERSATION_MAX = int(os.environ.get('CONVERSATION_MAX', '10000'))
+
+# ===== ПРОФИЛИ =====
+# Последнее имя каждого пользователя: "📝 Записаться" записывает сразу,
+# без вопроса об имени (в режиме sqlite - таблица в DB_FILE)
+PROFILES_FILE = os.environ.get('PROFILES_FILE', DATA_FILE + '.profiles')
+
 # ===== ТАЙМЗОНА =====
 MOSCOW_TZ = timezone('Europe/Moscow')
 
+# ===== РЕЗЕРВНЫЕ КОПИИ =====
+# Копия делается раз в BACKUP_INTERVAL секунд (если были изменения) и
+# после каждых BACKUP_EVERY_CHANGES изменений. Хранятся последние
+# BACKUP_KEEP_LAST копий и по одной за BACKUP_KEEP_DAILY последних дней
+BACKUP_DIR = os.environ.get('BACKUP_DIR', 'backups')
+BACKUP_INTERVAL = float(os.environ.get('BACKUP_INTERVAL', '3600'))
+BACKUP_EVERY_CHANGES = int(os.environ.get('BACKUP_EVERY_CHANGES', '50'))
+BACKUP_KEEP_LAST = int(os.environ.get('BACKUP_KEEP_LAST', '10'))
+BACKUP_KEEP_DAILY = int(os.environ.get('BACKUP_KEEP_DAILY', '7'))
+
+# ===== РАСПИСАНИЕ =====
+# Регулярные тренировки по московскому времени. Файл SCHEDULE_FILE (если
+# есть) - JSON-список слотов с теми же полями, что в DEFAULT_SCHEDULE, плюс
+# max_main / max_reserve / open_before / close_before / archive_after.
+# При AUTO_SCHEDULE бот сам создает тренировку и открывает запись за
+# open_before часов до начала, закрывает запись за close_before часов и
+# отправляет список в архив (ARCHIVE_FILE) через archive_after часов.
+# В архив же пишутся отмены и переводы из резерва, по нему считается
+# статистика посещений (/top, /risk, /fill)
+SCHEDULE_FILE = os.environ.get('SCHEDULE_FILE', 'schedule.json')
+AUTO_SCHEDULE = os.environ.get('AUTO_SCHEDULE', 'False').lower() == 'true'
+ARCHIVE_FILE = os.environ.get('ARCHIVE_FILE', DATA_FILE + '.archive')
+DEFAULT_SCHEDULE = [
+    {'key': 'tue', 'weekday': 1, 'time': '20:45', 'place': 'Пехорка'},
+    {'key': 'sat', 'weekday': 5, 'time': '09:00', 'place': 'Ляпкина'},
+]
+SCHEDULE = load_slots(SCHEDULE_FILE, DEFAULT_SCHEDULE)
+
+# ===== ЖУРНАЛ ИЗМЕНЕНИЙ =====
+# Каждая запись, отмена, перевод из резерва, действие админа и смена
+# настроек - JSON-строка в AUDIT_FILE (время московское, by - Telegram id
+# того, кто это сделал). Файл ротируется по AUDIT_MAX_BYTES, хранится
+# AUDIT_BACKUPS старых. Поиск - /history <имя> или /history today.
+# При MULTI_INSTANCE у каждого процесса свой файл AUDIT_FILE-<INSTANCE_ID>
+AUDIT_FILE = os.environ.get('AUDIT_FILE', DATA_FILE + '.audit')
+AUDIT_MAX_BYTES = int(os.environ.get('AUDIT_MAX_BYTES', str(5 * 1024 * 1024)))
+AUDIT_BACKUPS = int(os.environ.get('AUDIT_BACKUPS', '5'))
+
+# ===== ЗАПИСЬ ТРАФИКА =====
+# TRAFFIC_FILE - записывать входящие обновления и вызовы Telegram API,
+# чтобы потом воспроизвести их локально: python replay.py <файл>.
+# Id и имена в файле - псевдонимы с ключом TRAFFIC_SECRET (пусто -
+# случайный ключ на каждый запуск). При MULTI_INSTANCE у каждого
+# процесса свой файл TRAFFIC_FILE-<INSTANCE_ID>. Пусто - не записывать
+TRAFFIC_FILE = os.environ.get('TRAFFIC_FILE', '')
+TRAFFIC_SECRET = os.environ.get('TRAFFIC_SECRET', '')
+
+# ===== НАПОМИНАНИЯ =====
+# За сколько часов до начала напомнить записанным (через запятую,
+# пустая строка - без напоминаний). Доставка идет через рассылку
+REMINDER_OFFSETS = [float(h) for h in os.environ.get('REMINDER_OFFSETS', '24,2').split(',') if h.strip()]
+
 def get_moscow_time():
     return datetime.now(MOSCOW_TZ)
 
@@ -52,37 +308,29 @@ def format_moscow_date(dt=None):
     return dt.strftime('%Y-%m-%d')
 
 # ===== ХРАНЕНИЕ ДАННЫХ =====
-def load_data():
-    try:
-        if os.path.exists(DATA_FILE):
-            with open(DATA_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            # Проверяем обязательные поля
-            if 'main' not in data:
-                data['main'] = []
-            if 'reserve' not in data:
-                data['reserve'] = []
-            if 'manual_entries' not in data:
-                data['manual_entries'] = []
-            if 'time' not in data:
-                data['time'] = '20:45'
-            if 'date' not in data:
-                data['date'] = format_moscow_date()
-            if 'place' not in data:
-                data['place'] = 'Пехорка, вторник'
-            if 'registration_open' not in data:
-                data['registration_open'] = True
-            
-            return data
-    except Exception as e:
-        logger.error(f"Ошибка загрузки: {e}")
-    
-    # Создаем новые данные
-    return create_default_data()
+def normalize_training(data):
+    # Проверяем обязательные поля
+    if 'main' not in data:
+        data['main'] = []
+    if 'reserve' not in data:
+        data['reserve'] = []
+    if 'manual_entries' not in data:
+        data['manual_entries'] = []
+    if 'time' not in data:
+        data['time'] = '20:45'
+    if 'date' not in data:
+        data['date'] = format_moscow_date()
+    if 'place' not in data:
+        data['place'] = 'Пехорка, вторник'
+    if 'registration_open' not in data:
+        data['registration_open'] = True
+    return data
 
-def create_default_data():
-    data = {
+def normalize_data(data):
+    return state_from_json(data, normalize=normalize_training)
+
+def default_training():
+    return {
         'main': [],
         'reserve': [],
         'time': '20:45',
@@ -91,91 +339,358 @@ def create_default_data():
         'registration_open': True,
         'manual_entries': []
     }
-    save_data(data)
-    return data
 
-def is_admin(user_id):
-    return user_id == ADMIN_ID
+def default_data():
+    return {'trainings': [dict(default_training(), id=1)]}
+
+def open_store(data_file, db_file, journal_file):
+    """Хранилище по STORAGE_MODE (основной чат и шарды групп)"""
+    if STORAGE_MODE == 'sqlite':
+        return SqliteStore(
+            db_file,
+            default_factory=default_data,
+            decode=normalize_data,
+            encode=state_to_json,
+            import_path=data_file,
+            shared=MULTI_INSTANCE
+        )
+    return StateStore(
+        data_file,
+        default_factory=default_data,
+        decode=normalize_data,
+        encode=state_to_json,
+        flush_delay=FLUSH_DELAY,
+        max_delay=FLUSH_MAX_DELAY,
+        journal_path=journal_file if STORAGE_MODE == 'journal' else None,
+        compact_records=COMPACT_RECORDS,
+        compact_interval=COMPACT_INTERVAL
+    )
+
+# Данные читаются с диска один раз, дальше все берется из памяти
+store = open_store(DATA_FILE, DB_FILE, JOURNAL_FILE)
+
+STORAGE_FILE = DB_FILE if STORAGE_MODE == 'sqlite' else DATA_FILE
+
+backups = BackupManager(
+    store,
+    BACKUP_DIR,
+    interval=BACKUP_INTERVAL,
+    every_changes=BACKUP_EVERY_CHANGES,
+    keep_last=BACKUP_KEEP_LAST,
+    keep_daily=BACKUP_KEEP_DAILY,
+    tz=MOSCOW_TZ
+)
+
+instrument_store(store, metrics)
+
+conversations = ConversationStore(
+    SqliteBackend(DB_FILE) if STORAGE_MODE == 'sqlite'
+    else JsonFileBackend(CONVERSATIONS_FILE, FLUSH_DELAY, FLUSH_MAX_DELAY),
+    ttl=CONVERSATION_TTL,
+    max_entries=CONVERSATION_MAX,
+    shared=MULTI_INSTANCE
+)
+instrument_conversations(conversations, metrics)
+
+user_profiles = ProfileStore(
+    profiles.SqliteBackend(DB_FILE) if STORAGE_MODE == 'sqlite'
+    else profiles.JsonFileBackend(PROFILES_FILE),
+    shared=MULTI_INSTANCE
+)
+
+archive = Archive(ARCHIVE_FILE)
+
+audit = AuditLog(
+    f"{AUDIT_FILE}-{INSTANCE_ID}" if MULTI_INSTANCE else AUDIT_FILE,
+    now=get_moscow_time,
+    siblings=f"{AUDIT_FILE}-*" if MULTI_INSTANCE else None,
+    max_bytes=AUDIT_MAX_BYTES,
+    backups=AUDIT_BACKUPS
+)
+
+# Отложенные действия (расписание) - один поток, спит до ближайшего срока
+scheduler = Scheduler()
+
+# ===== ЧАТЫ =====
+# У каждого чата свое хранилище, очереди команд и кэш текстов (Tenant).
+# Все изменения списка одной тренировки выполняются строго по одному через
+# ее очередь, чтение идет напрямую из памяти без блокировок.
+# Создание/удаление тренировок - через общую очередь чата.
+main_chat = Tenant(
+    None,
+    {'admins': [ADMIN_ID], 'max_main': MAX_MAIN, 'max_reserve': MAX_RESERVE,
+     'test_mode': TEST_MODE},
+    store,
+    archive
+)
+
+def open_shard(path):
+    shard_store = open_store(
+        os.path.join(path, os.path.basename(DATA_FILE)),
+        os.path.join(path, os.path.basename(DB_FILE)),
+        os.path.join(path, os.path.basename(JOURNAL_FILE))
+    )
+    shard_store.load()
+    shard_store.start()
+    shard_archive = Archive(os.path.join(path, os.path.basename(ARCHIVE_FILE)))
+    shard_archive.open()
+    return shard_store, shard_archive
+
+tenants = TenantRegistry(TENANTS_DIR, open_shard, main_chat, max_loaded=TENANTS_MAX_LOADED)
+
+# Чат, чье обновление обрабатывает текущий поток (см. bind_tenant)
+current = threading.local()
+
+def tenant():
+    """Чат текущего обработчика; в фоновых задачах - основной"""
+    return getattr(current, 'tenant', None) or main_chat
+
+def storage_file():
+    store = tenant().store
+    return getattr(store, 'db_path', None) or store.path
+
+def load_data():
+    store = tenant().store
+    # Изменения других процессов (в обычном режиме ничего не делает)
+    store.refresh()
+    return store.data
+
+def get_trainings():
+    """Все тренировки по порядку (дата, время)"""
+    trainings = list(load_data()['trainings'].values())
+    return sorted(trainings, key=lambda t: (t['date'], t['time'], t['id']))
+
+def get_training(training_id):
+    return load_data()['trainings'].get(training_id)
+
+def open_trainings():
+    return [t for t in get_trainings() if t['registration_open']]
+
+def user_trainings(user_id):
+    return [t for t in get_trainings() if t['roster'].find_id(user_id)]
+
+def run_command(training_id, command, *args):
+    chat = tenant()
+    result = chat.queue(training_id).submit(in_transaction, chat, origin(), command, training_id, *args)
+    if chat_live_list():
+        live_list.touch(training_id)
+    return result
+
+def run_trainings_command(command, *args):
+    chat = tenant()
+    return chat.trainings_queue.submit(in_transaction, chat, origin(), command, *args)
+
+def origin():
+    """Откуда команда: (id обновления Telegram, кто его прислал). Команду
+    может выполнить поток другого обработчика (CommandQueue), поэтому
+    передаем явно, а не через current"""
+    return getattr(current, 'update_id', None), getattr(current, 'actor', None)
+
+def in_transaction(chat, origin, command, *args):
+    """Проверка и изменение - одна транзакция (важно для нескольких процессов).
+    Изменение сохраняется вместе с id обновления Telegram, которое его вызвало"""
+    update_id, actor = origin
+    store = chat.store
+    with store.recording() as applied:
+        with store.transaction(), store.for_update(update_id):
+            result = command(store, *args)
+    # В журнал - только то, что уже сохранено
+    for op, op_result in applied:
+        for event in op_events(op, op_result):
+            audit.record(dict(event, chat=chat.chat_id, by=actor))
+    return result
+
+def create_default_data():
+    training_id = run_trainings_command(commands.create_training, default_training())
+    plan_reminders(training_id)
+    return training_id
+
+def training_limits(data):
+    """Лимиты тренировки: свои (из расписания) или лимиты чата"""
+    max_main, max_reserve = tenant().limits()
+    if data is None:
+        return max_main, max_reserve
+    return data.get('max_main', max_main), data.get('max_reserve', max_reserve)
+
+def mode_text():
+    return "ТЕСТОВЫЙ РЕЖИМ" if tenant().settings['test_mode'] else "РАБОЧИЙ РЕЖИМ"
+
+def archive_training(training_id, reason):
+    return run_command(
+        training_id, commands.archive_training, tenant().archive,
+        {
+            'kind': 'training',
+            'archived_at': get_moscow_time().isoformat(timespec='seconds'),
+            'reason': reason,
+            'max_main': training_limits(get_training(training_id))[0],
+        }
+    )
+
+def is_admin(user_id, chat_id=None):
+    """Админ чата текущего обработчика или чата `chat_id`.
+    ADMIN_ID - админ во всех чатах"""
+    if user_id == ADMIN_ID:
+        return True
+    if chat_id is None:
+        return user_id in tenant().settings['admins']
+    with tenants.use(chat_id) as chat:
+        return user_id in chat.settings['admins']
+
+def is_main_admin(user_id):
+    """Команды над основными данными (резервные копии и т.п.)"""
+    return is_admin(user_id) and tenant().is_default
+
+def admin_training(user_id):
+    # Какую тренировку админ сейчас редактирует (по умолчанию - ближайшую)
+    training = get_training(tenant().selected.get(user_id))
+    if training is None:
+        trainings = get_trainings()
+        training = trainings[0] if trainings else None
+    return training
+
+def training_title(training):
+    return f"{training['date']} {training['time']}, {training['place']}"
+
+def notify_markup(training_id):
+    """Кнопка рассылки участникам после изменения тренировки"""
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton(
+        "📣 Оповестить участников", callback_data=f"admin_broadcast:{training_id}"
+    ))
+    return markup
+
+def broadcast_training(chat_id, training_id, text):
+    """Разослать текст всем записанным на тренировку (у кого есть Telegram id)"""
+    data = get_training(training_id)
+    if data is None:
+        send_message(chat_id, "❌ Тренировка уже завершена!")
+        return
+    count = broadcaster.submit(chat_id, [user.id for user in data['roster']], text)
+    if count:
+        send_message(chat_id, f"📣 Рассылка запущена: {count} получателей")
+    else:
+        send_message(chat_id, "❌ Некого оповещать - нет участников с Telegram")
+
+def trainings_markup(trainings, action):
+    """Инлайн-кнопки выбора тренировки: callback_data = '<action>:<id>'"""
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    for training in trainings:
+        markup.add(types.InlineKeyboardButton(
+            training_title(training), callback_data=f"{action}:{training['id']}"
+        ))
+    return markup
+
+# ===== РЕГУЛЯРНЫЕ ТРЕНИРОВКИ =====
+def find_occurrence(occurrence):
+    for training in get_trainings():
+        if training.get('occurrence') == occurrence:
+            return training['id']
+    return None
+
+def create_occurrence(slot, start, occurrence, registration_open):
+    training = dict(
+        default_training(),
+        date=format_moscow_date(start),
+        time=slot.time,
+        place=slot.place,
+        registration_open=registration_open,
+        occurrence=occurrence,
+        **slot.limits()
+    )
+    training_id = run_trainings_command(commands.create_training, training)
+    plan_reminders(training_id)
+    return training_id
+
+def set_registration(training_id, value):
+    values = {'registration_open': value}
+    if value:
+        # По этой отметке каждый процесс открывает окно пачки (register)
+        values['registration_opened_at'] = time.time()
+    run_command(training_id, commands.update_settings, values)
+
+schedule = RecurringSchedule(
+    SCHEDULE,
+    scheduler,
+    MOSCOW_TZ,
+    find=find_occurrence,
+    archived=archive.has_occurrence,
+    create=create_occurrence,
+    set_open=set_registration,
+    archive=lambda training_id: archive_training(training_id, 'schedule')
+)
+
+# ===== НАПОМИНАНИЯ =====
+def reminder_markup(training_id):
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    markup.add(
+        types.InlineKeyboardButton("✅ Иду", callback_data=f"going:{training_id}"),
+        types.InlineKeyboardButton("🚫 Отменить", callback_data=f"cancel:{training_id}")
+    )
+    return markup
+
+def deliver_reminder(training_id, offset, stamp):
+    """Срабатывание напоминания: отметить в тренировке и запустить рассылку"""
+    data = get_training(training_id)
+    # Тренировку удалили или перенесли - это событие уже не актуально
+    if data is None or reminder_stamp(offset, data) != stamp:
+        return
+    # Метки прежних сроков тренировки больше не нужны
+    suffix = stamp.split('@', 1)[1]
+    reminded = [s for s in data.get('reminded', []) if s.endswith('@' + suffix)]
+    if stamp in reminded:
+        return
+    run_command(training_id, commands.update_settings, {'reminded': reminded + [stamp]})
+    text = (
+        f"⏰ Напоминание о тренировке\n\n"
+        f"📅 {data['date']}\n"
+        f"⏰ {data['time']}\n"
+        f"📍 {data['place']}\n\n"
+        f"Если не сможете прийти - отмените запись, место перейдет резерву."
+    )
+    count = broadcaster.submit(None, [user.id for user in data['roster']], text,
+                               markup=reminder_markup(training_id))
+    logger.info(f"⏰ Напоминание {stamp} (тренировка {training_id}): {count} получателей")
+
+reminders = Reminders(scheduler, MOSCOW_TZ, REMINDER_OFFSETS, deliver_reminder)
+
+def plan_reminders(training_id=None):
+    """Перепланировать напоминания тренировки (None - всех)"""
+    # Напоминания и расписание - только у основного чата
+    if not tenant().is_default:
+        return
+    if training_id is None:
+        trainings = get_trainings()
+    else:
+        training = get_training(training_id)
+        trainings = [training] if training else []
+    for training in trainings:
+        reminders.plan(training)
 
 @bot.message_handler(commands=['emergency'])
 def emergency_recovery(message):
-    """ЭКСТРЕННОЕ ВОССТАНОВЛЕНИЕ ДАННЫХ"""
-    import os, json, glob
+    """ЭКСТРЕННОЕ ВОССТАНОВЛЕНИЕ ДАННЫХ (из последней непустой копии)"""
+    if not is_main_admin(message.from_user.id):
+        return
     
     text = "🚨 *ЭКСТРЕННОЕ ВОССТАНОВЛЕНИЕ*\n\n"
     
-    # 1. Ищем ВСЕ файлы
-    all_files = []
-    for root, dirs, files in os.walk('/'):
-        for file in files:
-            if file.endswith('.json'):
-                path = os.path.join(root, file)
-                all_files.append(path)
-        if len(all_files) > 50:
-            break
-    
-    text += f"📂 Проверено {len(all_files)} файлов\n\n"
-    
-    # 2. Ищем наши данные
-    found_data = []
-    for file in all_files[:100]:  # Первые 100 файлов
-        try:
-            with open(file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            # Проверяем структуру наших данных
-            if isinstance(data, dict):
-                if 'main' in data or 'reserve' in data:
-                    main_count = len(data.get('main', []))
-                    reserve_count = len(data.get('reserve', []))
-                    manual_count = len(data.get('manual_entries', []))
-                    
-                    found_data.append({
-                        'file': file,
-                        'main': main_count,
-                        'reserve': reserve_count,
-                        'manual': manual_count,
-                        'data': data
-                    })
-                    
-                    text += f"✅ *НАЙДЕНЫ ДАННЫЕ!*\n"
-                    text += f"📁 Файл: `{file}`\n"
-                    text += f"👥 Участников: {main_count} осн, {reserve_count} резерв\n"
-                    
-                    # Показываем имена
-                    if main_count > 0:
-                        text += f"Список:\n"
-                        for user in data.get('main', [])[:5]:
-                            name = user.get('display_name', 'Неизвестно')
-                            text += f"• {name}\n"
-                        if main_count > 5:
-                            text += f"... и еще {main_count - 5}\n"
-                    
-                    text += "\n"
-                    
-        except:
-            continue
+    # Ищем по манифесту - диск не сканируется
+    entries = backups.entries()
+    text += f"📂 Резервных копий: {len(entries)}\n\n"
+    entry = next((e for e in entries if e['main'] + e['manual'] + e['reserve']), None)
     
-    if found_data:
-        # 3. Восстанавливаем
-        best_file = found_data[0]['file']
-        with open(best_file, 'r', encoding='utf-8') as f:
-            old_data = json.load(f)
-        
-        # Сохраняем в текущий файл
-        with open(DATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(old_data, f, indent=2)
+    if entry:
+        restore_backup(entry['name'])
         
         text += f"🎉 *ДАННЫЕ ВОССТАНОВЛЕНЫ!*\n"
-        text += f"📁 Из: {best_file}\n"
-        text += f"📁 В: {DATA_FILE}\n\n"
+        text += f"📁 Из: `{entry['name']}`\n"
+        text += f"📁 В: {STORAGE_FILE}\n\n"
         
         # Показываем восстановленный список
         text += "👥 *ВОССТАНОВЛЕННЫЙ СПИСОК:*\n"
-        all_main = old_data.get('main', []) + old_data.get('manual_entries', [])
+        all_main = [u for t in get_trainings() for u in t['roster'].main]
         for i, user in enumerate(all_main[:20], 1):
-            name = user.get('display_name', 'Неизвестно')
-            text += f"{i}. {name}\n"
+            text += f"{i}. {user.display_name.translate(NAME_STRIP)}\n"
         
         if len(all_main) > 20:
             text += f"... и еще {len(all_main) - 20}\n"
@@ -183,25 +698,74 @@ def emergency_recovery(message):
     else:
         text += "❌ *ДАННЫЕ НЕ НАЙДЕНЫ!*\n"
         text += "Список участников пуст. Нужно записываться заново.\n"
-        text += f"Текущий файл: {DATA_FILE}"
+        text += f"Текущий файл: {STORAGE_FILE}"
     
-    bot.send_message(message.chat.id, text, parse_mode='Markdown')
+    send_message(message.chat.id, text, parse_mode='Markdown')
 
-def save_data(data):
-    try:
-        with open(DATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        logger.info(f"Данные сохранены в {DATA_FILE}")
-    except Exception as e:
-        logger.error(f"Ошибка сохранения: {e}")
+# ===== РЕЗЕРВНЫЕ КОПИИ =====
+def restore_backup(name):
+    """Восстановить состояние из копии (текущее перед этим тоже сохраняется)"""
+    data = backups.read(name)
+    backups.snapshot('before_restore')
+    run_trainings_command(commands.reset, data)
+    store.flush()
+    plan_reminders()
+
+def backup_line(i, entry):
+    return (
+        f"{i}. {entry['time'][:16].replace('T', ' ')} - "
+        f"{entry['main'] + entry['manual']} осн. + {entry['reserve']} рез. "
+        f"({entry['reason']})"
+    )
+
+@bot.message_handler(commands=['backup'])
+def make_backup(message):
+    """Сделать резервную копию сейчас"""
+    if not is_main_admin(message.from_user.id):
+        return
+    entry = backups.snapshot('manual')
+    send_message(message.chat.id, f"💾 Копия сохранена: {entry['name']}")
+
+@bot.message_handler(commands=['backups'])
+def list_backups(message):
+    """Список резервных копий (новые первыми)"""
+    if not is_main_admin(message.from_user.id):
+        return
+    entries = backups.entries()
+    if not entries:
+        send_message(message.chat.id, "Резервных копий пока нет")
+        return
+    text = "💾 РЕЗЕРВНЫЕ КОПИИ\n\n"
+    for i, entry in enumerate(entries, 1):
+        text += backup_line(i, entry) + "\n"
+    text += "\nВосстановить: /restore <номер>"
+    send_message(message.chat.id, text)
 
-def is_admin(user_id):
-    return user_id == ADMIN_ID
+@bot.message_handler(commands=['restore'])
+def restore_command(message):
+    """Восстановить копию по номеру из /backups или по имени файла"""
+    if not is_main_admin(message.from_user.id):
+        return
+    arg = message.text.partition(' ')[2].strip()
+    entries = backups.entries()
+    if arg.isdigit() and 1 <= int(arg) <= len(entries):
+        entry = entries[int(arg) - 1]
+    else:
+        entry = backups.find(arg)
+    if entry is None:
+        send_message(message.chat.id, "❌ Копия не найдена! Номер смотрите в /backups")
+        return
+    try:
+        restore_backup(entry['name'])
+    except (OSError, ValueError) as e:
+        send_message(message.chat.id, f"❌ Не удалось восстановить: {str(e)[:100]}")
+        return
+    send_message(message.chat.id, f"✅ Восстановлено из копии\n{backup_line(1, entry)[3:]}")
 
 # ===== КОМАНДА /start =====
 @bot.message_handler(commands=['start'])
 def start(message):
-    data = load_data()
+    trainings = get_trainings()
     
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
     buttons = ["📝 Записаться", "👥 Список", "⏰ Расписание", "🚫 Отменить", "❓ Помощь"]
@@ -211,21 +775,34 @@ def start(message):
     
     markup.add(*[types.KeyboardButton(btn) for btn in buttons])
     
-    text = (
-        f"🏋️‍♂️ *SportOrlovS Training Bot* ({MODE_TEXT})\n\n"
-        f"*Следующая тренировка:*\n"
-        f"📅 {data['date']}\n"
-        f"⏰ {data['time']}\n"
-        f"📍 {data['place']}\n"
-        f"👥 *Лимиты:* {MAX_MAIN} осн. + {MAX_RESERVE} рез.\n\n"
+    text = f"🏋️‍♂️ *SportOrlovS Training Bot* ({mode_text()})\n\n"
+    if len(trainings) == 1:
+        data = trainings[0]
+        text += (
+            f"*Следующая тренировка:*\n"
+            f"📅 {data['date']}\n"
+            f"⏰ {data['time']}\n"
+            f"📍 {data['place']}\n"
+        )
+    elif trainings:
+        text += "*Ближайшие тренировки:*\n"
+        for data in trainings:
+            text += f"📅 {data['date']} ⏰ {data['time']} 📍 {data['place']}\n"
+    else:
+        text += "*Тренировок пока нет*\n"
+    max_main, max_reserve = training_limits(None)
+    text += (
+        f"👥 *Лимиты:* {max_main} осн. + {max_reserve} рез.\n\n"
         f"Выберите действие:"
     )
     
-    bot.send_message(message.chat.id, text, reply_markup=markup, parse_mode='Markdown')
+    send_message(message.chat.id, text, reply_markup=markup, parse_mode='Markdown')
 
 @bot.message_handler(commands=['rebuild'])
 def rebuild_from_memory(message):
     """Попытаться восстановить из памяти"""
+    if not is_main_admin(message.from_user.id):
+        return
     
     # Создаем новый файл с примером
     new_data = {
@@ -243,200 +820,377 @@ def rebuild_from_memory(message):
         'manual_entries': []
     }
     
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(new_data, f, indent=2)
+    run_trainings_command(commands.reset, new_data)
+    tenant().store.flush()
+    plan_reminders()
     
-    bot.send_message(
+    send_message(
         message.chat.id,
         "🔄 Создан новый файл с примером данных.\n"
         "Теперь записывайте участников заново."
     )
 
 # ===== СПИСОК УЧАСТНИКОВ (БЕЗОПАСНЫЙ) =====
+# Спецсимволы Markdown, которые убираются из имен
+NAME_STRIP = str.maketrans('', '', '*_`')
+
+def render_list(data):
+    roster = data['roster']
+    max_main, max_reserve = training_limits(data)
+    all_main = roster.main
+    reserve = roster.reserve
+    
+    # БЕЗ Markdown - безопасно
+    text = f"🏋️‍♂️ ТРЕНИРОВКА {data['date']}\n"
+    text += f"⏰ Время: {data['time']}\n"
+    text += f"📍 Место: {data['place']}\n"
+    text += f"👥 Лимиты: {max_main}+{max_reserve}\n\n"
+    
+    text += f"✅ Основной список ({len(all_main)}/{max_main}):\n"
+    if all_main:
+        for i, user in enumerate(all_main, 1):
+            # Убираем спецсимволы
+            name = user.display_name.translate(NAME_STRIP)
+            mark = " 👑" if user.is_manual else ""
+            text += f"{i}. {name}{mark}\n"
+    else:
+        text += "Пока никого\n"
+    
+    text += f"\n⏳ Резерв ({len(reserve)}/{max_reserve}):\n"
+    if reserve:
+        for i, user in enumerate(reserve, 1):
+            name = user.display_name.translate(NAME_STRIP)
+            text += f"{i}. {name}\n"
+    else:
+        text += "Пока никого\n"
+    
+    text += f"\n📊 Всего записано: {len(all_main) + len(reserve)}"
+    return text
+
+def list_text(training_id):
+    """Текст списка из кэша (None - тренировки нет)"""
+    def render():
+        data = get_training(training_id)
+        return render_list(data) if data else None
+    return tenant().render_cache.get(('list', training_id), render)
+
+live_list = LiveList(outbox, list_text, LIVE_LIST_FILE, LIVE_LIST_DEBOUNCE) if LIVE_LIST else None
+
+def chat_live_list():
+    """Живой список (только у основного чата) или None"""
+    return live_list if tenant().is_default else None
+
 @bot.message_handler(func=lambda m: m.text == "👥 Список")
-def show_list(message):
+def show_list(message, training_id=None):
     try:
-        data = load_data()
-        all_main = data['main'] + data.get('manual_entries', [])
-        
-        # БЕЗ Markdown - безопасно
-        text = f"🏋️‍♂️ ТРЕНИРОВКА {data['date']}\n"
-        text += f"⏰ Время: {data['time']}\n"
-        text += f"📍 Место: {data['place']}\n"
-        text += f"👥 Лимиты: {MAX_MAIN}+{MAX_RESERVE}\n\n"
-        
-        text += f"✅ Основной список ({len(all_main)}/{MAX_MAIN}):\n"
-        if all_main:
-            for i, user in enumerate(all_main, 1):
-                name = user.get('display_name', 'Неизвестно')
-                # Убираем спецсимволы
-                name = name.replace('*', '').replace('_', '').replace('`', '')
-                mark = " 👑" if user.get('is_manual') else ""
-                text += f"{i}. {name}{mark}\n"
-        else:
-            text += "Пока никого\n"
-        
-        text += f"\n⏳ Резерв ({len(data['reserve'])}/{MAX_RESERVE}):\n"
-        if data['reserve']:
-            for i, user in enumerate(data['reserve'], 1):
-                name = user.get('display_name', 'Неизвестно')
-                name = name.replace('*', '').replace('_', '').replace('`', '')
-                text += f"{i}. {name}\n"
+        if training_id is not None:
+            trainings = [get_training(training_id)]
         else:
-            text += "Пока никого\n"
+            trainings = get_trainings()
         
-        text += f"\n📊 Всего записано: {len(all_main) + len(data['reserve'])}"
-        
-        bot.send_message(message.chat.id, text)
+        if not trainings or trainings[0] is None:
+            send_message(message.chat.id, "Тренировок пока нет")
+            return
         
+        # Каждая тренировка - отдельным сообщением
+        for data in trainings:
+            text = list_text(data['id'])
+            if chat_live_list():
+                live_list.show(message.chat.id, data['id'], text)
+            else:
+                send_message(message.chat.id, text)
+    
     except Exception as e:
-        bot.send_message(message.chat.id, f"Ошибка: {str(e)[:100]}")
+        send_message(message.chat.id, f"Ошибка: {str(e)[:100]}")
         logger.error(f"Ошибка в show_list: {e}")
 
 # ===== ЗАПИСЬ НА ТРЕНИРОВКУ =====
 @bot.message_handler(func=lambda m: m.text == "📝 Записаться")
 def sign_up(message):
-    data = load_data()
+    trainings = open_trainings()
     
-    if not data['registration_open']:
-        bot.send_message(message.chat.id, "❌ Запись закрыта!")
+    if not trainings:
+        send_message(message.chat.id, "❌ Запись закрыта!")
         return
     
-    user_id = message.from_user.id
-    
-    # Проверка дубликатов
-    all_users = data['main'] + data['reserve'] + data.get('manual_entries', [])
-    for user in all_users:
-        if user.get('id') == user_id:
-            bot.send_message(message.chat.id, "❌ Вы уже записаны!")
-            return
+    if len(trainings) > 1:
+        send_message(
+            message.chat.id,
+            "📝 На какую тренировку записаться?",
+            reply_markup=trainings_markup(trainings, 'signup')
+        )
+        return
     
-    msg = bot.send_message(
-        message.chat.id,
-        "✏️ Введите имя для отображения в списке:"
-    )
-    bot.register_next_step_handler(msg, lambda m: process_name(m, user_id))
+    quick_sign_up(message.chat.id, message.from_user, trainings[0]['id'], message.date)
 
-def process_name(message, user_id):
-    name = message.text.strip()
-    if not name:
-        bot.send_message(message.chat.id, "❌ Имя не может быть пустым!")
+def quick_sign_up(chat_id, from_user, training_id, sent_at=None):
+    """Записать под сохраненным именем, без профиля - спросить имя"""
+    name = user_profiles.get(from_user.id)
+    if name is None:
+        ask_name(chat_id, from_user.id, training_id)
         return
+    register(chat_id, from_user, training_id, name, quick=True, sent_at=sent_at)
+
+def ask_name(chat_id, user_id, training_id, text="✏️ Введите имя для отображения в списке:"):
+    data = get_training(training_id)
     
-    data = load_data()
+    if data is None or not data['registration_open']:
+        send_message(chat_id, "❌ Запись закрыта!")
+        return
     
-    # Проверяем дубликат имени
-    for user in data['main'] + data['reserve']:
-        if user.get('display_name', '').lower() == name.lower():
-            bot.send_message(message.chat.id, "❌ Это имя уже занято!")
-            return
+    # Проверка дубликатов
+    if data['roster'].find_id(user_id):
+        send_message(chat_id, "❌ Вы уже записаны!")
+        return
     
+    # Состояние сохраняем до вопроса: быстрый ответ не потеряется
+    conversations.set(chat_id, user_id, 'name', training=training_id)
+    send_message(chat_id, text)
+
+def check_new_name(chat_id, name):
+    """Имя из ответа пользователя подходит для профиля"""
+    if not name:
+        send_message(chat_id, "❌ Имя не может быть пустым!")
+        return False
+    return True
+
+def rename_markup(training_id):
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("✏️ Сменить имя", callback_data=f"rename:{training_id}"))
+    return markup
+
+def process_name(message, training_id):
+    name = message.text.strip()
+    if not check_new_name(message.chat.id, name):
+        return
+    register(message.chat.id, message.from_user, training_id, name, sent_at=message.date)
+
+def register(chat_id, from_user, training_id, name, quick=False, sent_at=None):
+    """Записать участника. `sent_at` - время сообщения Telegram (unix),
+    None - нажатие кнопки, время - сейчас"""
+    moment = datetime.fromtimestamp(sent_at, MOSCOW_TZ) if sent_at else get_moscow_time()
     user_data = {
-        'id': user_id,
+        'id': from_user.id,
         'display_name': name,
-        'username': message.from_user.username or '',
-        'time': format_moscow_time(),
+        'username': from_user.username or '',
+        'time': format_moscow_time(moment),
+        'signed_at': moment.isoformat(timespec='seconds'),
         'is_manual': False
     }
     
-    all_main_count = len(data['main']) + len(data.get('manual_entries', []))
+    # Сразу после открытия записи - в пачку, по порядку отправки. Когда
+    # открыта запись, видно из данных (после refresh - и из другого процесса)
+    data = get_training(training_id)
+    key = (tenant().chat_id, training_id)
+    if data and data['registration_open'] and data.get('registration_opened_at'):
+        signup_burst.open(key, ago=time.time() - data['registration_opened_at'])
+    signup = (chat_id, from_user, name, quick, user_data, getattr(current, 'update_id', None))
+    order = (int(moment.timestamp()), signup[-1] or 0)
+    if signup_burst.submit(key, order, signup):
+        current.deferred = signup[-1] is not None
+        return
     
-    if all_main_count < MAX_MAIN:
-        data['main'].append(user_data)
+    result = run_command(training_id, commands.sign_up, user_data, *training_limits(data))
+    registered(chat_id, from_user, training_id, name, result, quick)
+
+def register_burst(key, signups):
+    """Записать пачку заявок (SignupBurst) и ответить каждому"""
+    chat_id, training_id = key
+    with tenants.use(chat_id) as chat:
+        current.tenant = chat
+        try:
+            try:
+                results = run_command(
+                    training_id, commands.sign_up_many,
+                    [(user_data, update_id) for *_, user_data, update_id in signups],
+                    *training_limits(get_training(training_id))
+                )
+            finally:
+                # Обновления из пачки обработаны (или упали) - offset идет дальше
+                for *_, update_id in signups:
+                    if update_id is not None:
+                        update_log.done(update_id, chat.store)
+            for (reply_to, from_user, name, quick, _, _), result in zip(signups, results):
+                try:
+                    registered(reply_to, from_user, training_id, name, result, quick)
+                except Exception as e:
+                    logger.error(f"Ошибка ответа на запись {name}: {e}")
+        finally:
+            current.tenant = None
+
+signup_burst = SignupBurst(register_burst, window=BURST_WINDOW, duration=BURST_DURATION)
+
+def registered(chat_id, from_user, training_id, name, result, quick=False):
+    """Ответить на запись"""
+    if result == 'main':
         status = f"✅ {name}, вы в основном списке!"
-    elif len(data['reserve']) < MAX_RESERVE:
-        data['reserve'].append(user_data)
+    elif result == 'reserve':
         status = f"⏳ {name}, вы в резерве!"
+    elif result == 'name_taken' and quick:
+        # Сохраненное имя в этом списке уже у другого - спрашиваем новое
+        ask_name(chat_id, from_user.id, training_id,
+                 f"❌ Имя «{name}» уже есть в списке. Введите другое имя:")
+        return
+    elif result == 'name_taken':
+        send_message(chat_id, "❌ Это имя уже занято!")
+        return
+    elif result == 'duplicate':
+        send_message(chat_id, "❌ Вы уже записаны!")
+        return
+    elif result in ('closed', 'missing'):
+        send_message(chat_id, "❌ Запись закрыта!")
+        return
     else:
-        bot.send_message(message.chat.id, "❌ Все места заняты!")
+        send_message(chat_id, "❌ Все места заняты!")
         return
     
-    save_data(data)
-    bot.send_message(message.chat.id, status)
-    show_list(message)
+    user_profiles.remember(from_user.id, name, from_user.username or '')
+    markup = rename_markup(training_id)
+    if chat_live_list() and live_list.has(chat_id, training_id):
+        # Закрепленный список обновится сам
+        send_message(chat_id, status, reply_markup=markup)
+    elif chat_live_list():
+        send_message(chat_id, status, reply_markup=markup)
+        live_list.show(chat_id, training_id, list_text(training_id))
+    else:
+        # Статус и список - одним сообщением
+        send_message(chat_id, f"{status}\n\n{list_text(training_id)}", reply_markup=markup)
+
+def process_rename(message, training_id):
+    user_id = message.from_user.id
+    name = message.text.strip()
+    if not check_new_name(message.chat.id, name):
+        return
+    
+    result = run_command(training_id, commands.rename, user_id, name)
+    if result == 'name_taken':
+        send_message(message.chat.id, "❌ Это имя уже занято!")
+        return
+    if result in ('not_signed', 'missing'):
+        send_message(message.chat.id, "❌ Вы не записаны на эту тренировку")
+        return
+    user_profiles.remember(user_id, name, message.from_user.username or '')
+    send_message(message.chat.id, f"✅ Теперь вы в списке как {name}")
 
 # ===== ОТМЕНА ЗАПИСИ =====
 @bot.message_handler(func=lambda m: m.text == "🚫 Отменить")
 def cancel_registration(message):
-    data = load_data()
-    user_id = message.from_user.id
+    trainings = user_trainings(message.from_user.id)
     
-    # Ищем в основном списке
-    for i, user in enumerate(data['main']):
-        if user.get('id') == user_id:
-            removed = data['main'].pop(i)
-            name = removed.get('display_name', 'Неизвестно')
-            
-            # Переводим из резерва
-            if data['reserve']:
-                promoted = data['reserve'].pop(0)
-                data['main'].append(promoted)
-                promoted_name = promoted.get('display_name', 'Неизвестно')
-                
-                try:
-                    if promoted.get('id'):
-                        bot.send_message(
-                            promoted['id'],
-                            f"🎉 {promoted_name}, вы переведены в основной список!"
-                        )
-                except:
-                    pass
-                
-                save_data(data)
-                bot.send_message(
-                    message.chat.id,
-                    f"✅ {name}, запись отменена!\n🔄 {promoted_name} переведен из резерва."
-                )
-            else:
-                save_data(data)
-                bot.send_message(message.chat.id, f"✅ {name}, запись отменена!")
-            return
+    if not trainings:
+        send_message(message.chat.id, "❌ Вы не записаны")
+        return
     
-    # Ищем в резерве
-    for i, user in enumerate(data['reserve']):
-        if user.get('id') == user_id:
-            removed = data['reserve'].pop(i)
-            name = removed.get('display_name', 'Неизвестно')
-            save_data(data)
-            bot.send_message(message.chat.id, f"✅ {name}, запись отменена!")
-            return
+    if len(trainings) > 1:
+        send_message(
+            message.chat.id,
+            "🚫 Какую запись отменить?",
+            reply_markup=trainings_markup(trainings, 'cancel')
+        )
+        return
     
-    bot.send_message(message.chat.id, "❌ Вы не записаны")
+    cancel_in_training(message.chat.id, message.from_user.id, trainings[0]['id'])
+
+def cancel_in_training(chat_id, user_id, training_id):
+    removed, promoted = run_command(training_id, commands.cancel, user_id)
+    
+    if not removed:
+        send_message(chat_id, "❌ Вы не записаны")
+        return
+    
+    record_cancel(get_training(training_id), removed, promoted)
+    name = removed.display_name
+    
+    # Переводим из резерва
+    if promoted:
+        promoted_name = promoted.display_name
+        
+        # Уведомление уходит вне очереди; если не доставлено - ошибка в логе
+        if promoted.id:
+            send_message(
+                promoted.id,
+                f"🎉 {promoted_name}, вы переведены в основной список!",
+                priority=PROMOTION
+            )
+        
+        send_message(
+            chat_id,
+            f"✅ {name}, запись отменена!\n🔄 {promoted_name} переведен из резерва."
+        )
+    else:
+        send_message(chat_id, f"✅ {name}, запись отменена!")
+
+def record_cancel(data, removed, promoted):
+    """Отмена и перевод из резерва - в историю (для статистики)"""
+    now = get_moscow_time()
+    hours_left = None
+    if data is not None:
+        start = reminders.start_of(data)
+        if start is not None:
+            hours_left = round((start - now).total_seconds() / 3600, 2)
+    training_id = data['id'] if data else None
+    archive = tenant().archive
+    archive.append({
+        'kind': 'cancel', 'training': training_id, 'user': user_key(removed.to_dict()),
+        'name': removed.display_name, 'hours_left': hours_left,
+        'at': now.isoformat(timespec='seconds')
+    })
+    if promoted:
+        archive.append({
+            'kind': 'promote', 'training': training_id, 'user': user_key(promoted.to_dict()),
+            'name': promoted.display_name, 'at': now.isoformat(timespec='seconds')
+        })
 
 # ===== РАСПИСАНИЕ =====
 @bot.message_handler(func=lambda m: m.text == "⏰ Расписание")
 def show_schedule(message):
-    data = load_data()
-    text = (
-        f"⏰ РАСПИСАНИЕ\n\n"
-        f"Ближайшая тренировка:\n"
-        f"📅 {data['date']}\n"
-        f"⏰ {data['time']}\n"
-        f"📍 {data['place']}\n\n"
-        f"Регулярное:\n"
-        f"▪️ Вторник: 20:45 (Пехорка)\n"
-        f"▪️ Суббота: 09:00 (Ляпкина)\n\n"
-        f"Текущее время: {format_moscow_time()}"
-    )
-    bot.send_message(message.chat.id, text)
+    # В тексте есть текущее время - кэш живет не дольше минуты
+    now = format_moscow_time()
+    text = tenant().render_cache.get(('schedule', now), lambda: render_schedule(now))
+    send_message(message.chat.id, text)
+
+def render_schedule(now):
+    trainings = get_trainings()
+    text = "⏰ РАСПИСАНИЕ\n\n"
+    if len(trainings) == 1:
+        data = trainings[0]
+        text += (
+            f"Ближайшая тренировка:\n"
+            f"📅 {data['date']}\n"
+            f"⏰ {data['time']}\n"
+            f"📍 {data['place']}\n\n"
+        )
+    elif trainings:
+        text += "Ближайшие тренировки:\n"
+        for data in trainings:
+            text += f"📅 {data['date']} ⏰ {data['time']} 📍 {data['place']}\n"
+        text += "\n"
+    text += "Регулярное:\n"
+    for slot in SCHEDULE:
+        text += f"▪️ {slot.describe()}\n"
+    text += f"\nТекущее время: {now}"
+    
+    return text
 
 # ===== ПОМОЩЬ =====
 @bot.message_handler(func=lambda m: m.text == "❓ Помощь")
 def show_help(message):
+    max_main, max_reserve = training_limits(None)
     text = (
         "❓ ПОМОЩЬ\n\n"
         "Как пользоваться:\n"
-        "1. 📝 Записаться - добавиться в список\n"
+        "1. 📝 Записаться - добавиться в список (имя запоминается,\n"
+        "   в следующий раз запись в одно нажатие)\n"
         "2. 👥 Список - посмотреть участников\n"
         "3. ⏰ Расписание - время и место\n"
         "4. 🚫 Отменить - отменить свою запись\n\n"
-        f"Лимиты: {MAX_MAIN} осн. + {MAX_RESERVE} рез.\n"
+        f"Лимиты: {max_main} осн. + {max_reserve} рез.\n"
         "При отмене первый из резерва переходит автоматически"
     )
-    bot.send_message(message.chat.id, text)
+    send_message(message.chat.id, text)
 
 # ===== АДМИН =====
-@bot.message_handler(func=lambda m: m.text == "👑 Админ" and is_admin(m.from_user.id))
+@bot.message_handler(func=lambda m: m.text == "👑 Админ" and is_admin(m.from_user.id, m.chat.id))
 def admin_panel(message):
     markup = types.InlineKeyboardMarkup(row_width=2)
     buttons = [
@@ -444,30 +1198,42 @@ def admin_panel(message):
         ("📅 Дата", "admin_date"),
         ("📍 Место", "admin_place"),
         ("🔄 Новая", "admin_new"),
+        ("🔀 Выбрать", "admin_pick"),
+        ("🏁 Завершить", "admin_finish"),
         ("🔓 Открыть", "admin_open"),
         ("🔒 Закрыть", "admin_close"),
         ("👤 Добавить", "admin_add"),
         ("🗑️ Удалить", "admin_remove"),
-        ("📊 Статистика", "admin_stats")
+        ("↕️ Перенести", "admin_move"),
+        ("📊 Статистика", "admin_stats"),
+        ("📣 Оповестить", "admin_notify")
     ]
     
     for text, callback in buttons:
         markup.add(types.InlineKeyboardButton(text, callback_data=callback))
     
-    data = load_data()
-    all_main = len(data['main']) + len(data.get('manual_entries', []))
+    data = admin_training(message.from_user.id)
+    if data is None:
+        text = "👑 АДМИН-ПАНЕЛЬ\n\nТренировок нет - создайте новую"
+        send_message(message.chat.id, text, reply_markup=markup)
+        return
     
-    text = (
+    text = tenant().render_cache.get(('admin', data['id']), lambda: render_admin_panel(data))
+    send_message(message.chat.id, text, reply_markup=markup)
+
+def render_admin_panel(data):
+    roster = data['roster']
+    max_main, max_reserve = training_limits(data)
+    
+    return (
         f"👑 АДМИН-ПАНЕЛЬ\n\n"
-        f"Тренировка:\n"
+        f"Тренировка (всего {len(load_data()['trainings'])}):\n"
         f"📅 {data['date']}\n"
         f"⏰ {data['time']}\n"
         f"📍 {data['place']}\n"
-        f"👥 {all_main}/{MAX_MAIN} + {len(data['reserve'])}/{MAX_RESERVE}\n"
+        f"👥 {roster.main_count}/{max_main} + {roster.reserve_count}/{max_reserve}\n"
         f"📝 Запись: {'открыта ✅' if data['registration_open'] else 'закрыта ❌'}"
     )
-    
-    bot.send_message(message.chat.id, text, reply_markup=markup)
 
 # ===== CALLBACK ОБРАБОТЧИК =====
 @bot.callback_query_handler(func=lambda call: True)
@@ -476,162 +1242,338 @@ def callback_handler(call):
         bot.answer_callback_query(call.id, "❌ Нет доступа!")
         return
     
+    chat_id = call.message.chat.id
+    
     try:
+        # ----- Участники -----
+        if call.data.startswith('signup:'):
+            quick_sign_up(chat_id, call.from_user, int(call.data.split(':')[1]))
+            bot.answer_callback_query(call.id)
+            return
+        
+        if call.data.startswith('rename:'):
+            conversations.set(chat_id, call.from_user.id, 'rename',
+                              training=int(call.data.split(':')[1]))
+            send_message(chat_id, "✏️ Введите новое имя для списка:")
+            bot.answer_callback_query(call.id)
+            return
+        
+        if call.data.startswith('cancel:'):
+            cancel_in_training(chat_id, call.from_user.id, int(call.data.split(':')[1]))
+            bot.answer_callback_query(call.id)
+            return
+        
+        if call.data.startswith('going:'):
+            data = get_training(int(call.data.split(':')[1]))
+            if data and data['roster'].find_id(call.from_user.id):
+                bot.answer_callback_query(call.id, "👍 Отлично, ждем!")
+            else:
+                bot.answer_callback_query(call.id, "❌ Вы не записаны на эту тренировку")
+            return
+        
+        # ----- Админ -----
+        if call.data.startswith('admin_select:'):
+            training_id = int(call.data.split(':')[1])
+            tenant().selected[call.from_user.id] = training_id
+            data = get_training(training_id)
+            if data:
+                send_message(chat_id, f"✅ Выбрана тренировка {training_title(data)}")
+            bot.answer_callback_query(call.id)
+            return
+        
+        if call.data.startswith('admin_broadcast:'):
+            training_id = int(call.data.split(':')[1])
+            data = get_training(training_id)
+            if data:
+                text = (
+                    f"📢 Изменения в тренировке!\n\n"
+                    f"📅 {data['date']}\n"
+                    f"⏰ {data['time']}\n"
+                    f"📍 {data['place']}"
+                )
+                broadcast_training(chat_id, training_id, text)
+            else:
+                send_message(chat_id, "❌ Тренировка уже завершена!")
+            bot.answer_callback_query(call.id)
+            return
+        
+        if call.data == 'admin_new':
+            training_id = create_default_data()
+            tenant().selected[call.from_user.id] = training_id
+            send_message(chat_id, "🔄 Создана новая тренировка!")
+            bot.answer_callback_query(call.id)
+            return
+        
+        if call.data == 'admin_pick':
+            trainings = get_trainings()
+            if trainings:
+                send_message(
+                    chat_id, "Выберите тренировку:",
+                    reply_markup=trainings_markup(trainings, 'admin_select')
+                )
+            else:
+                send_message(chat_id, "❌ Тренировок нет!")
+            bot.answer_callback_query(call.id)
+            return
+        
+        data = admin_training(call.from_user.id)
+        if data is None:
+            send_message(chat_id, "❌ Тренировок нет - создайте новую!")
+            bot.answer_callback_query(call.id)
+            return
+        training_id = data['id']
+        
         if call.data == 'admin_time':
-            msg = bot.send_message(call.message.chat.id, "Введите время (например 20:45):")
-            bot.register_next_step_handler(msg, lambda m: admin_set_time(m, call.message.chat.id))
+            conversations.set(chat_id, call.from_user.id, 'admin_time', training=training_id)
+            send_message(chat_id, "Введите время (например 20:45):")
         
         elif call.data == 'admin_date':
-            msg = bot.send_message(call.message.chat.id, "Введите дату (ГГГГ-ММ-ДД):")
-            bot.register_next_step_handler(msg, lambda m: admin_set_date(m, call.message.chat.id))
+            conversations.set(chat_id, call.from_user.id, 'admin_date', training=training_id)
+            send_message(chat_id, "Введите дату (ГГГГ-ММ-ДД):")
         
         elif call.data == 'admin_place':
-            msg = bot.send_message(call.message.chat.id, "Введите место:")
-            bot.register_next_step_handler(msg, lambda m: admin_set_place(m, call.message.chat.id))
+            conversations.set(chat_id, call.from_user.id, 'admin_place', training=training_id)
+            send_message(chat_id, "Введите место:")
         
-        elif call.data == 'admin_new':
-            data = create_default_data()
-            bot.send_message(call.message.chat.id, "🔄 Создана новая тренировка!")
+        elif call.data == 'admin_finish':
+            archive_training(training_id, 'admin')
+            tenant().selected.pop(call.from_user.id, None)
+            send_message(chat_id, f"🏁 Тренировка {training_title(data)} завершена!")
         
         elif call.data == 'admin_open':
-            data = load_data()
-            data['registration_open'] = True
-            save_data(data)
-            bot.send_message(call.message.chat.id, "🔓 Запись открыта!")
+            set_registration(training_id, True)
+            send_message(chat_id, "🔓 Запись открыта!")
         
         elif call.data == 'admin_close':
-            data = load_data()
-            data['registration_open'] = False
-            save_data(data)
-            bot.send_message(call.message.chat.id, "🔒 Запись закрыта!")
+            run_command(training_id, commands.update_settings, {'registration_open': False})
+            send_message(chat_id, "🔒 Запись закрыта!")
         
         elif call.data == 'admin_stats':
-            data = load_data()
-            all_main = len(data['main']) + len(data.get('manual_entries', []))
+            roster = data['roster']
+            max_main, max_reserve = training_limits(data)
             text = (
                 f"📊 СТАТИСТИКА\n\n"
-                f"Основной: {all_main}/{MAX_MAIN}\n"
-                f"Резерв: {len(data['reserve'])}/{MAX_RESERVE}\n"
-                f"Всего: {all_main + len(data['reserve'])}\n\n"
-                f"Файл: {DATA_FILE}\n"
-                f"Размер: {os.path.getsize(DATA_FILE) if os.path.exists(DATA_FILE) else 0} байт"
+                f"Тренировка: {training_title(data)}\n"
+                f"Основной: {roster.main_count}/{max_main}\n"
+                f"Резерв: {roster.reserve_count}/{max_reserve}\n"
+                f"Всего: {len(roster)}\n"
+                f"Тренировок: {len(load_data()['trainings'])}\n\n"
+                f"Файл: {storage_file()}\n"
+                f"Размер: {os.path.getsize(storage_file()) if os.path.exists(storage_file()) else 0} байт"
             )
-            bot.send_message(call.message.chat.id, text)
+            send_message(chat_id, text)
         
         elif call.data == 'admin_add':
-            msg = bot.send_message(call.message.chat.id, "Введите имя участника:")
-            bot.register_next_step_handler(msg, admin_add_user)
+            conversations.set(chat_id, call.from_user.id, 'admin_add', training=training_id)
+            send_message(chat_id, "Введите имя участника (или несколько - по одному в строке):")
+        
+        elif call.data == 'admin_notify':
+            conversations.set(chat_id, call.from_user.id, 'admin_notify', training=training_id)
+            send_message(chat_id, "Введите текст для участников:")
         
         elif call.data == 'admin_remove':
-            data = load_data()
-            all_users = data['main'] + data.get('manual_entries', []) + data['reserve']
-            if not all_users:
-                bot.send_message(call.message.chat.id, "❌ Список пуст!")
-                return
-            
-            text = "Выберите номер для удаления:\n"
-            for i, user in enumerate(all_users[:20], 1):
-                name = user.get('display_name', 'Неизвестно')
-                text += f"{i}. {name}\n"
-            
-            msg = bot.send_message(call.message.chat.id, text)
-            bot.register_next_step_handler(msg, lambda m: admin_remove_user(m, all_users))
+            ask_numbers(chat_id, call.from_user.id, training_id, data, 'admin_remove',
+                        "Кого удалить?")
+        
+        elif call.data == 'admin_move':
+            ask_numbers(chat_id, call.from_user.id, training_id, data, 'admin_move',
+                        "Кого перенести (основной ⇄ резерв)?")
     
     except Exception as e:
-        bot.send_message(call.message.chat.id, f"Ошибка: {str(e)[:100]}")
+        send_message(chat_id, f"Ошибка: {str(e)[:100]}")
     
     bot.answer_callback_query(call.id)
 
-def admin_set_time(message, chat_id):
+def admin_set_time(message, chat_id, training_id):
     if not is_admin(message.from_user.id):
         return
-    data = load_data()
-    data['time'] = message.text.strip()
-    save_data(data)
-    bot.send_message(chat_id, f"✅ Время изменено на {data['time']}")
+    run_command(training_id, commands.update_settings, {'time': message.text.strip()})
+    plan_reminders(training_id)
+    send_message(
+        chat_id, f"✅ Время изменено на {message.text.strip()}",
+        reply_markup=notify_markup(training_id)
+    )
 
-def admin_set_date(message, chat_id):
+def admin_set_date(message, chat_id, training_id):
     if not is_admin(message.from_user.id):
         return
     try:
         datetime.strptime(message.text.strip(), '%Y-%m-%d')
-        data = load_data()
-        data['date'] = message.text.strip()
-        save_data(data)
-        bot.send_message(chat_id, f"✅ Дата изменена на {data['date']}")
+        run_command(training_id, commands.update_settings, {'date': message.text.strip()})
+        plan_reminders(training_id)
+        send_message(
+            chat_id, f"✅ Дата изменена на {message.text.strip()}",
+            reply_markup=notify_markup(training_id)
+        )
     except:
-        bot.send_message(chat_id, "❌ Неверный формат даты!")
+        send_message(chat_id, "❌ Неверный формат даты!")
 
-def admin_set_place(message, chat_id):
+def admin_set_place(message, chat_id, training_id):
     if not is_admin(message.from_user.id):
         return
-    data = load_data()
-    data['place'] = message.text.strip()
-    save_data(data)
-    bot.send_message(chat_id, f"✅ Место изменено на {data['place']}")
+    run_command(training_id, commands.update_settings, {'place': message.text.strip()})
+    send_message(
+        chat_id, f"✅ Место изменено на {message.text.strip()}",
+        reply_markup=notify_markup(training_id)
+    )
 
-def admin_add_user(message):
+def admin_notify(message, chat_id, training_id):
     if not is_admin(message.from_user.id):
         return
-    name = message.text.strip()
-    if not name:
-        bot.send_message(message.chat.id, "❌ Имя не может быть пустым!")
+    text = (message.text or '').strip()
+    if not text:
+        send_message(chat_id, "❌ Текст не может быть пустым!")
         return
-    
-    data = load_data()
-    
-    # Проверяем дубликаты
-    all_users = data['main'] + data['reserve'] + data.get('manual_entries', [])
-    for user in all_users:
-        if user.get('display_name', '').lower() == name.lower():
-            bot.send_message(message.chat.id, "❌ Это имя уже занято!")
-            return
-    
-    user_data = {
+    data = get_training(training_id)
+    if data is None:
+        send_message(chat_id, "❌ Тренировка уже завершена!")
+        return
+    broadcast_training(chat_id, training_id, f"📢 {training_title(data)}\n\n{text}")
+
+def manual_user(name):
+    return {
         'display_name': name,
         'time': format_moscow_time(),
+        'signed_at': get_moscow_time().isoformat(timespec='seconds'),
         'is_manual': True
     }
+
+def admin_add_user(message, training_id):
+    if not is_admin(message.from_user.id):
+        return
+    names = [line.strip() for line in message.text.splitlines() if line.strip()]
+    if not names:
+        send_message(message.chat.id, "❌ Имя не может быть пустым!")
+        return
+    if len(names) > 1:
+        admin_add_many(message, training_id, names)
+        return
+    name = names[0]
+    
+    user_data = manual_user(name)
     
-    all_main_count = len(data['main']) + len(data.get('manual_entries', []))
+    result = run_command(training_id, commands.add_manual, user_data, *training_limits(get_training(training_id)))
     
-    if all_main_count < MAX_MAIN:
-        data.setdefault('manual_entries', []).append(user_data)
-        bot.send_message(message.chat.id, f"✅ {name} добавлен в основной список!")
-    elif len(data['reserve']) < MAX_RESERVE:
-        data['reserve'].append(user_data)
-        bot.send_message(message.chat.id, f"⏳ {name} добавлен в резерв!")
+    if result == 'main':
+        send_message(message.chat.id, f"✅ {name} добавлен в основной список!")
+    elif result == 'reserve':
+        send_message(message.chat.id, f"⏳ {name} добавлен в резерв!")
+    elif result == 'name_taken':
+        send_message(message.chat.id, "❌ Это имя уже занято!")
+    elif result == 'missing':
+        send_message(message.chat.id, "❌ Тренировка уже завершена!")
     else:
-        bot.send_message(message.chat.id, "❌ Все места заняты!")
+        send_message(message.chat.id, "❌ Все места заняты!")
+
+def admin_add_many(message, training_id, names):
+    """Несколько имен (по одному в строке) - одной операцией: все или никто"""
+    users = [manual_user(name) for name in names]
+    result, summary = run_command(training_id, commands.add_many, users,
+                                  *training_limits(get_training(training_id)))
+    if result == 'missing':
+        send_message(message.chat.id, "❌ Тренировка уже завершена!")
+        return
+    if result == 'full':
+        fresh = len(names) - len(summary['taken'])
+        send_message(message.chat.id, f"❌ Не хватает мест: свободно {summary['free']}, "
+                                      f"новых имен {fresh}. Никто не добавлен")
         return
     
-    save_data(data)
+    lines = [f"✅ Добавлено: {len(summary['main']) + len(summary['reserve'])}"]
+    if summary['main']:
+        lines.append("В основной список: " + ", ".join(summary['main']))
+    if summary['reserve']:
+        lines.append("В резерв: " + ", ".join(summary['reserve']))
+    if summary['taken']:
+        lines.append("❌ Уже в списке: " + ", ".join(summary['taken']))
+    send_message(message.chat.id, "\n".join(lines))
 
-def admin_remove_user(message, all_users):
-    if not is_admin(message.from_user.id):
+# ===== НОМЕРА В СПИСКЕ =====
+def ask_numbers(chat_id, user_id, training_id, data, state, question):
+    """Показать весь список с номерами и ждать номера в ответ"""
+    roster = data['roster']
+    if not len(roster):
+        send_message(chat_id, "❌ Список пуст!")
         return
+    
+    text = f"{question}\nВведите номера через пробел или запятую, можно диапазоны: 1-3 7\n\n"
+    for i, user in enumerate(roster, 1):
+        if i == roster.main_count + 1:
+            text += "⏳ Резерв:\n"
+        text += f"{i}. {user.display_name}\n"
+    
+    # Запоминаем, кто под каким номером был показан (имя и id),
+    # а не сами объекты - состояние хранится на диске
+    shown = [[user.display_name, user.id] for user in roster]
+    conversations.set(chat_id, user_id, state, training=training_id, shown=shown)
+    send_message(chat_id, text)
+
+def parse_numbers(text, count):
+    """'1-3, 7' -> [1, 2, 3, 7]; ValueError с неверным фрагментом"""
+    numbers = set()
+    for part in text.replace(',', ' ').split():
+        first, _, last = part.partition('-')
+        try:
+            first = int(first)
+            last = int(last) if last else first
+        except ValueError:
+            raise ValueError(part)
+        if not 1 <= first <= last <= count:
+            raise ValueError(part)
+        numbers.update(range(first, last + 1))
+    if not numbers:
+        raise ValueError(text)
+    return sorted(numbers)
+
+def chosen(message, shown):
+    """Показанные записи [имя, id] по номерам из ответа (None - ошибка)"""
     try:
-        num = int(message.text.strip())
-        if 1 <= num <= len(all_users):
-            user = all_users[num-1]
-            name = user.get('display_name', 'Неизвестно')
-            
-            data = load_data()
-            
-            # Удаляем из нужного списка
-            if user in data['main']:
-                data['main'].remove(user)
-            elif user in data.get('manual_entries', []):
-                data['manual_entries'].remove(user)
-            elif user in data['reserve']:
-                data['reserve'].remove(user)
-            
-            save_data(data)
-            bot.send_message(message.chat.id, f"✅ {name} удален!")
-        else:
-            bot.send_message(message.chat.id, "❌ Неверный номер!")
-    except:
-        bot.send_message(message.chat.id, "❌ Введите число!")
+        numbers = parse_numbers(message.text, len(shown))
+    except ValueError as e:
+        send_message(message.chat.id, f"❌ Неверный номер: {e}")
+        return None
+    return [shown[num - 1] for num in numbers]
+
+def admin_remove_user(message, training_id, shown):
+    if not is_admin(message.from_user.id):
+        return
+    selected = chosen(message, shown)
+    if selected is None:
+        return
+    result = run_command(training_id, commands.remove_many, selected)
+    if result is None:
+        send_message(message.chat.id, "❌ Тренировка уже завершена!")
+        return
+    removed, gone = result
+    lines = []
+    if removed:
+        lines.append("✅ Удалены: " + ", ".join(p.display_name for p in removed))
+    if gone:
+        lines.append("❌ Уже нет в списке: " + ", ".join(gone))
+    send_message(message.chat.id, "\n".join(lines))
+
+def admin_move_users(message, training_id, shown):
+    if not is_admin(message.from_user.id):
+        return
+    selected = chosen(message, shown)
+    if selected is None:
+        return
+    result, summary = run_command(training_id, commands.move_many, selected,
+                                  *training_limits(get_training(training_id)))
+    if result == 'missing':
+        send_message(message.chat.id, "❌ Тренировка уже завершена!")
+        return
+    if result == 'full':
+        send_message(message.chat.id, "❌ После переноса список превысит лимит. Ничего не изменено")
+        return
+    lines = []
+    if summary['main']:
+        lines.append("✅ В основной список: " + ", ".join(summary['main']))
+    if summary['reserve']:
+        lines.append("✅ В резерв: " + ", ".join(summary['reserve']))
+    if summary['gone']:
+        lines.append("❌ Уже нет в списке: " + ", ".join(summary['gone']))
+    send_message(message.chat.id, "\n".join(lines))
 @bot.message_handler(commands=['checkdata'])
 def check_data_now(message):
     """Проверить текущие данные"""
@@ -639,46 +1581,579 @@ def check_data_now(message):
     
     text = "📊 *ПРОВЕРКА ДАННЫХ:*\n\n"
     
-    if os.path.exists('training_data.json'):
-        with open('training_data.json', 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        all_main = data.get('main', []) + data.get('manual_entries', [])
-        
+    # Сначала сбрасываем отложенные изменения, чтобы размер был актуальным
+    tenant().store.flush()
+    path = storage_file()
+    
+    if os.path.exists(path):
         text += f"✅ *Файл найден!*\n"
-        text += f"📁 Размер: {os.path.getsize('training_data.json')} байт\n\n"
-        text += f"👥 *Участники:*\n"
-        text += f"• Основной список: {len(all_main)} чел.\n"
-        text += f"• Резерв: {len(data.get('reserve', []))} чел.\n\n"
-        
-        if all_main:
-            text += "📋 *Список участников:*\n"
-            for i, user in enumerate(all_main, 1):
-                name = user.get('display_name', 'Неизвестно')
-                text += f"{i}. {name}\n"
-        else:
-            text += "📭 *Список пуст*\n"
+        text += f"📁 Размер: {os.path.getsize(path)} байт\n\n"
         
+        for data in get_trainings():
+            roster = data['roster']
+            all_main = roster.main
+            
+            text += f"🏋️ *{data['date']} {data['time']}*\n"
+            text += f"👥 *Участники:*\n"
+            text += f"• Основной список: {len(all_main)} чел.\n"
+            text += f"• Резерв: {roster.reserve_count} чел.\n\n"
+            
+            if all_main:
+                text += "📋 *Список участников:*\n"
+                for i, user in enumerate(all_main, 1):
+                    text += f"{i}. {user.display_name}\n"
+            else:
+                text += "📭 *Список пуст*\n"
+            text += "\n"
+    
     else:
-        text += "❌ *Файл training_data.json не найден!*\n"
+        text += f"❌ *Файл {path} не найден!*\n"
     
-    bot.send_message(message.chat.id, text, parse_mode='Markdown')
+    send_message(message.chat.id, text, parse_mode='Markdown')
 
-# ===== ЗАПУСК =====
-def main():
-    logger.info(f"🚀 Бот запущен. Режим: {MODE_TEXT}")
-    logger.info(f"📁 Файл данных: {DATA_FILE}")
+@bot.message_handler(commands=['metrics'])
+def show_metrics(message):
+    """Кратко: время обработчиков, Telegram API и хранилища"""
+    if not is_main_admin(message.from_user.id):
+        return
     
-    while True:
+    text = "📈 МЕТРИКИ (вызовов, p50 / p95 мс, ошибок)\n"
+    for title, name, label in (("Обработчики", 'handler', 'handler'),
+                               ("Telegram API", 'api', 'method'),
+                               ("Хранилище", 'storage', 'op')):
+        rows = metrics.summary(name, label)
+        if not rows:
+            continue
+        text += f"\n{title}:\n"
+        for value, count, p50, p95, errors in rows[:10]:
+            text += f"▪️ {value}: {count}, {p50 * 1000:.0f} / {p95 * 1000:.0f}"
+            text += f", ❌ {errors}\n" if errors else "\n"
+    
+    text += "\n"
+    for name, value in sorted(metrics.gauges().items()):
+        text += f"{name}: {value}\n"
+    send_message(message.chat.id, text)
+
+# ===== СТАТИСТИКА ПОСЕЩЕНИЙ =====
+def command_count(message, default=10):
+    """Число из аргумента команды (/top 20)"""
+    parts = message.text.split()
+    try:
+        return max(1, min(int(parts[1]), 50)) if len(parts) > 1 else default
+    except ValueError:
+        return default
+
+def synced_archive():
+    """Архив чата с записями других процессов (MULTI_INSTANCE)"""
+    archive = tenant().archive
+    archive.sync()
+    return archive
+
+@bot.message_handler(commands=['top'])
+def show_top(message):
+    """Кто чаще всех бывает в основном списке"""
+    if not is_admin(message.from_user.id):
+        return
+    stats = synced_archive().stats
+    rows = stats.top(command_count(message))
+    if not rows:
+        send_message(message.chat.id, "🗄 Архив пуст - статистики пока нет")
+        return
+    text = f"🏆 ТОП ПОСЕЩЕНИЙ (тренировок в архиве: {stats.trainings})\n\n"
+    for i, (key, user) in enumerate(rows, 1):
+        lead = f", запись за {user['lead_hours'] / user['leads']:.0f} ч" if user['leads'] else ""
+        text += f"{i}. {user['name']} - {user['attended']}{lead}\n"
+    send_message(message.chat.id, text)
+
+@bot.message_handler(commands=['risk'])
+def show_risk(message):
+    """Кто чаще отменяет запись (поздние отмены весят вдвое)"""
+    if not is_admin(message.from_user.id):
+        return
+    stats = synced_archive().stats
+    rows = stats.risky(command_count(message))
+    if not rows:
+        send_message(message.chat.id, "✅ Отмен пока не было")
+        return
+    text = "⚠️ РИСК НЕЯВКИ\n(отмен / поздних / записей)\n\n"
+    for i, (key, user) in enumerate(rows, 1):
+        text += (
+            f"{i}. {user['name']} - {stats.risk(user):.0%} "
+            f"({user['cancels']} / {user['late_cancels']} / {stats.signups(user)})\n"
+        )
+    send_message(message.chat.id, text)
+
+@bot.message_handler(commands=['fill'])
+def show_fill(message):
+    """Как быстро заполнялся основной список: /fill вторник"""
+    if not is_admin(message.from_user.id):
+        return
+    parts = message.text.split()
+    days = [day.lower() for day in WEEKDAYS]
+    if len(parts) < 2 or parts[1].lower() not in days:
+        send_message(message.chat.id, "Укажите день недели: /fill вторник")
+        return
+    weekday = days.index(parts[1].lower())
+    history = synced_archive().stats.fill_history(weekday)
+    if not history:
+        send_message(message.chat.id, f"🗄 По дню «{WEEKDAYS[weekday]}» истории нет")
+        return
+    text = f"⏱ ЗАПОЛНЕНИЕ: {WEEKDAYS[weekday]}\n\n"
+    for item in reversed(history):
+        if item['minutes'] is None:
+            text += f"📅 {item['date']}: не заполнен ({item['main']}/{item['limit']})\n"
+        else:
+            text += f"📅 {item['date']}: за {item['minutes'] // 60} ч {item['minutes'] % 60} мин\n"
+    send_message(message.chat.id, text)
+
+# ===== ЖУРНАЛ ИЗМЕНЕНИЙ =====
+AUDIT_TEXT = {
+    'join': "📝 записался",
+    'add': "👤 добавлен админом",
+    'cancel': "🚫 отменил запись",
+    'promote': "⬆️ переведен из резерва",
+    'remove': "🗑️ удален админом",
+    'move': "↕️ перенесен админом",
+    'rename': "✏️ сменил имя",
+    'settings': "⚙️ настройки",
+    'create': "🆕 создана тренировка",
+    'drop': "🏁 тренировка завершена",
+    'reset': "♻️ данные заменены",
+}
+
+def audit_line(entry):
+    # Запись - по времени нажатия (пачка SignupBurst применяется позже)
+    moment = entry.get('signed_at') or entry['ts']
+    when = datetime.fromisoformat(moment).strftime('%d.%m %H:%M:%S')
+    text = f"{when} #{entry.get('training') or '-'} "
+    if entry.get('name'):
+        text += f"{entry['name']} "
+    text += AUDIT_TEXT.get(entry['event'], entry['event'])
+    if entry.get('list'):
+        text += " (резерв)" if entry['list'] == 'reserve' else " (основной)"
+    if entry.get('values'):
+        text += ": " + ", ".join(f"{k}={v}" for k, v in entry['values'].items())
+    if entry.get('by') and entry['by'] != entry.get('user'):
+        text += f" [by {entry['by']}]"
+    return text
+
+@bot.message_handler(commands=['history'])
+def show_history(message):
+    """Кто когда записался и отменился: /history <имя>, /history today"""
+    if not is_admin(message.from_user.id):
+        return
+    query = message.text.partition(' ')[2].strip()
+    if not query:
+        send_message(message.chat.id, "Укажите имя или день: /history Иван, "
+                                      "/history today, /history 2024-05-21")
+        return
+    chat = tenant().chat_id
+    if query.lower() in ('today', 'сегодня'):
+        query = format_moscow_date()
+    try:
+        datetime.strptime(query, '%Y-%m-%d')
+        entries = audit.for_day(chat, query)
+    except ValueError:
+        entries = audit.for_name(chat, query)
+    if not entries:
+        send_message(message.chat.id, f"📜 По запросу «{query}» событий нет")
+        return
+    text = f"📜 ИСТОРИЯ: {query}\n\n" + "\n".join(audit_line(e) for e in entries)
+    send_message(message.chat.id, text)
+
+# ===== ГРУППЫ =====
+def is_chat_admin(chat_id, user_id):
+    """Админ группы в самом Telegram"""
+    if user_id == ADMIN_ID:
+        return True
+    try:
+        return bot.get_chat_member(chat_id, user_id).status in ('creator', 'administrator')
+    except Exception as e:
+        logger.error(f"Не удалось проверить админа группы {chat_id}: {e}")
+        return False
+
+@bot.message_handler(commands=['group'])
+def register_group(message):
+    """Отдельные тренировки, админы и лимиты для этой группы"""
+    chat = message.chat
+    if not TENANTS_DIR:
+        send_message(chat.id, "❌ Группы не включены (TENANTS_DIR)")
+        return
+    if chat.type not in ('group', 'supergroup'):
+        send_message(chat.id, "❌ Команда работает только в группе")
+        return
+    if tenants.exists(chat.id):
+        send_message(chat.id, "✅ У группы уже свои тренировки")
+        return
+    if not is_chat_admin(chat.id, message.from_user.id):
+        send_message(chat.id, "❌ Зарегистрировать группу может ее админ")
+        return
+    tenants.create(chat.id, chat.title or '', message.from_user.id)
+    send_message(
+        chat.id,
+        "🏘 Группа зарегистрирована: здесь теперь свои тренировки и список.\n"
+        "Вы - админ группы. Настройки: /limits, /testmode, /admins"
+    )
+
+def group_settings_allowed(message):
+    if not is_admin(message.from_user.id):
+        return False
+    if tenant().is_default:
+        send_message(message.chat.id, "Настройки основного чата задаются переменными окружения")
+        return False
+    return True
+
+@bot.message_handler(commands=['limits'])
+def set_limits(message):
+    """Лимиты группы: /limits 20 10"""
+    if not group_settings_allowed(message):
+        return
+    parts = message.text.split()
+    if len(parts) != 3 or not all(p.isdigit() and int(p) > 0 for p in parts[1:]):
+        max_main, max_reserve = tenant().limits()
+        send_message(message.chat.id, f"Сейчас: {max_main} + {max_reserve}. Изменить: /limits 20 10")
+        return
+    chat = tenant()
+    chat.settings['max_main'], chat.settings['max_reserve'] = int(parts[1]), int(parts[2])
+    tenants.save_settings(chat)
+    send_message(message.chat.id, f"✅ Лимиты: {parts[1]} осн. + {parts[2]} рез.")
+
+@bot.message_handler(commands=['testmode'])
+def set_test_mode(message):
+    """Тестовый режим группы: /testmode on|off"""
+    if not group_settings_allowed(message):
+        return
+    arg = message.text.partition(' ')[2].strip().lower()
+    if arg not in ('on', 'off'):
+        send_message(message.chat.id, f"Сейчас: {mode_text()}. Изменить: /testmode on|off")
+        return
+    chat = tenant()
+    chat.settings['test_mode'] = arg == 'on'
+    tenants.save_settings(chat)
+    send_message(message.chat.id, f"✅ {mode_text()}")
+
+@bot.message_handler(commands=['admins'])
+def group_admins(message):
+    """Админы группы: /admins, /admins +<id>, /admins -<id>"""
+    if not group_settings_allowed(message):
+        return
+    chat = tenant()
+    arg = message.text.partition(' ')[2].strip()
+    if arg[:1] in ('+', '-') and arg[1:].isdigit():
+        user_id = int(arg[1:])
+        admins = [a for a in chat.settings['admins'] if a != user_id]
+        if arg[0] == '+':
+            admins.append(user_id)
+        elif not admins:
+            send_message(message.chat.id, "❌ Нельзя удалить последнего админа")
+            return
+        chat.settings['admins'] = admins
+        tenants.save_settings(chat)
+    text = "👑 Админы группы:\n" + "\n".join(str(a) for a in chat.settings['admins'])
+    text += "\n\nДобавить: /admins +<id>, удалить: /admins -<id>"
+    send_message(message.chat.id, text)
+
+def bind_tenant(handler, chat_of):
+    """Обработчик работает с данными чата, откуда пришло обновление"""
+    @functools.wraps(handler)
+    def bound(update, *args, **kwargs):
+        with tenants.use(chat_of(update).id) as chat:
+            current.tenant = chat
+            current.actor = update.from_user.id
+            try:
+                return handler(update, *args, **kwargs)
+            finally:
+                current.tenant = current.actor = None
+    return bound
+
+def bind_tenants():
+    for handlers, chat_of in ((bot.message_handlers, lambda m: m.chat),
+                              (bot.callback_query_handlers, lambda c: c.message.chat)):
+        for handler in handlers:
+            handler['function'] = bind_tenant(handler['function'], chat_of)
+
+# ===== ОТВЕТЫ НА ВОПРОСЫ БОТА =====
+# Состояние -> обработчик ответа (message, данные состояния)
+CONVERSATION_HANDLERS = {
+    'name': lambda m, d: process_name(m, d['training']),
+    'rename': lambda m, d: process_rename(m, d['training']),
+    'admin_time': lambda m, d: admin_set_time(m, m.chat.id, d['training']),
+    'admin_date': lambda m, d: admin_set_date(m, m.chat.id, d['training']),
+    'admin_place': lambda m, d: admin_set_place(m, m.chat.id, d['training']),
+    'admin_add': lambda m, d: admin_add_user(m, d['training']),
+    'admin_notify': lambda m, d: admin_notify(m, m.chat.id, d['training']),
+    'admin_remove': lambda m, d: admin_remove_user(m, d['training'], d['shown']),
+    'admin_move': lambda m, d: admin_move_users(m, d['training'], d['shown']),
+}
+
+# Регистрируется последним: кнопки меню и команды обрабатываются как
+# обычно, а любой другой текст - ответ на заданный вопрос
+@bot.message_handler(func=lambda m: conversations.get(m.chat.id, m.from_user.id) is not None)
+def continue_conversation(message):
+    item = conversations.pop(message.chat.id, message.from_user.id)
+    if item is None:
+        return
+    handler = CONVERSATION_HANDLERS.get(item.state)
+    if handler is None:
+        logger.warning(f"Неизвестное состояние диалога: {item.state}")
+        return
+    handler(message, item.data)
+
+# Замеры вешаются после регистрации всех обработчиков
+metrics.gauge('outbox_depth', outbox.depth)
+metrics.gauge('state_version', lambda: store.version)
+metrics.gauge('storage_writes', lambda: store.writes)
+metrics.gauge('render_cache_hits', lambda: main_chat.render_cache.hits)
+metrics.gauge('render_cache_misses', lambda: main_chat.render_cache.misses)
+metrics.gauge('tenants_loaded', lambda: len(tenants))
+metrics.gauge('tenant_loads', lambda: tenants.loads)
+metrics.gauge('tenant_evictions', lambda: tenants.evictions)
+metrics.gauge('conversations', lambda: len(conversations))
+metrics.gauge('profiles', lambda: len(user_profiles))
+metrics.gauge('updates_skipped', lambda: update_log.skipped)
+metrics.gauge('updates_failed', lambda: poller.stats['failed'])
+for reason in ('coalesced', 'limited', 'shed'):
+    metrics.gauge(f'inbound_{reason}', lambda reason=reason: inbox.stats[reason])
+metrics.gauge('burst_batches', lambda: signup_burst.batches)
+metrics.gauge('burst_signups', lambda: signup_burst.signups)
+bind_tenants()
+instrument_bot(bot, metrics)
+
+# ===== ЗАПУСК =====
+webhook_server = None
+
+def update_chat_id(update):
+    if update.message:
+        return update.message.chat.id
+    if update.callback_query and update.callback_query.message:
+        return update.callback_query.message.chat.id
+    return None
+
+def handle_update(update):
+    """Обработать обновление; вернуть хранилище, которое оно могло изменить.
+    Изменения от уже примененного обновления не повторяются"""
+    with tenants.use(update_chat_id(update)) as chat:
+        store = chat.store
+        # Другой процесс мог успеть обработать это обновление
+        store.refresh()
+        if store.has_update(update.update_id):
+            logger.info(f"📨 Обновление {update.update_id} уже обработано - пропускаем")
+            return None
+        current.update_id = update.update_id
+        current.deferred = False
         try:
-            bot.polling(none_stop=True, timeout=60)
-        except Exception as e:
-            logger.error(f"Ошибка: {e}")
-            time.sleep(10)
+            bot.process_new_updates([update])
+        finally:
+            current.update_id = None
+        # Запись отложена до пачки (SignupBurst) - done вызовет она
+        return DEFERRED if current.deferred else store
 
-if __name__ == '__main__':
-    main()
+def dispatch_update(update_json):
+    """Передать обновление (JSON от Telegram) обработчикам бота"""
+    update = types.Update.de_json(update_json)
+    if not update_log.begin(update.update_id):
+        return
+    store = None
+    try:
+        store = handle_update(update)
+    finally:
+        if store is not DEFERRED:
+            update_log.done(update.update_id, store)
+
+# Кнопки и команды, которые только показывают данные
+READ_ONLY = {"👥 Список", "⏰ Расписание", "❓ Помощь", "/start"}
+
+def classify_update(update):
+    """(пользователь, ключ просмотра или None) - для AdmissionQueue.
+    Обновление - объект telebot (polling) или JSON вебхука"""
+    if isinstance(update, dict):
+        message = update.get('message') or {}
+        user_id = (message.get('from') or (update.get('callback_query') or {}).get('from') or {}).get('id')
+        chat_id = (message.get('chat') or {}).get('id')
+        text = message.get('text')
+    else:
+        message = update.message
+        sender = message.from_user if message else (update.callback_query.from_user
+                                                     if update.callback_query else None)
+        user_id = sender.id if sender else None
+        chat_id = message.chat.id if message else None
+        text = message.text if message else None
+    if text not in READ_ONLY or is_admin(user_id, chat_id):
+        return user_id, None
+    return user_id, (chat_id, text)
+
+inbox = AdmissionQueue(
+    classify_update,
+    maxsize=WEBHOOK_QUEUE_SIZE,
+    rate=INBOUND_RATE,
+    burst=INBOUND_BURST,
+    max_reads=INBOUND_MAX_READS,
+    # Отброшенное при polling считается обработанным - offset идет дальше
+    on_drop=None if BOT_MODE == 'webhook' else lambda update: update_log.done(update.update_id)
+)
+
+poller = UpdatePoller(bot, update_log, handle_update, workers=POLL_WORKERS,
+                      timeout=POLL_TIMEOUT, inbox=inbox)
 
+# Кнопки меню в записи трафика остаются как есть, остальной текст -
+# псевдонимы (ответы на вопросы бота - это имена)
+MENU_TEXTS = READ_ONLY | {"📝 Записаться", "🚫 Отменить", "👑 Админ"}
 
+traffic = None
+if TRAFFIC_FILE:
+    traffic = TrafficRecorder(
+        f"{TRAFFIC_FILE}-{INSTANCE_ID}" if MULTI_INSTANCE else TRAFFIC_FILE,
+        Redactor(TRAFFIC_SECRET.encode('utf-8') or None),
+        keep=MENU_TEXTS
+    )
+    # Входящие - при получении, до очереди: в записи и то, что будет отброшено
+    traffic.wrap(inbox, 'put')
+    traffic.wrap_api(bot, ('send_message', 'edit_message_text', 'answer_callback_query',
+                           'pin_chat_message', 'get_chat_member'))
 
+def shutdown(signum=None, frame=None):
+    """Остановка по SIGTERM/SIGINT: данные обязательно сохраняются"""
+    logger.info("🛑 Остановка бота...")
+    if webhook_server:
+        webhook_server.stop()
+        return
+    poller.stop()
+    raise SystemExit(0)
+
+def run_polling():
+    # Ошибки getUpdates UpdatePoller переживает сам (с паузой)
+    poller.serve_forever()
+
+def run_webhook():
+    global webhook_server
+    webhook_server = WebhookServer(
+        dispatch_update,
+        path=WEBHOOK_PATH,
+        secret=WEBHOOK_SECRET or None,
+        port=WEBHOOK_PORT,
+        workers=WEBHOOK_WORKERS,
+        queue_size=WEBHOOK_QUEUE_SIZE,
+        inbox=inbox
+    )
+    if WEBHOOK_URL:
+        bot.remove_webhook()
+        bot.set_webhook(
+            url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None
+        )
+    else:
+        # Без публичного адреса сервер работает локально (для проверки)
+        logger.info("WEBHOOK_URL не задан - setWebhook не вызывается")
+    webhook_server.serve_forever()
+
+# ===== ЛИДЕР =====
+lease = None
+
+def start_leader_duties():
+    """Фоновые задачи, которые должен выполнять ровно один процесс"""
+    backups.open()
+    backups.start()
+    # Напоминания с прошедшим сроком сразу ставят рассылку - рассылки
+    # должны быть уже загружены
+    broadcaster.start()
+    plan_reminders()
+    if AUTO_SCHEDULE:
+        schedule.start()
+    scheduler.start()
+    if live_list:
+        live_list.start()
+    if MULTI_INSTANCE:
+        threading.Thread(target=follow_shared_storage, name='shared-storage', daemon=True).start()
+
+def follow_shared_storage():
+    """Лидер подхватывает изменения других процессов: напоминания и живой список"""
+    seen = store.version
+    known = set(load_data()['trainings'])
+    while True:
+        time.sleep(SHARED_POLL)
+        store.refresh()
+        if store.version == seen:
+            continue
+        seen = store.version
+        current = set(load_data()['trainings'])
+        plan_reminders()
+        if live_list:
+            for training_id in known | current:
+                live_list.touch(training_id)
+        known = current
 
+def leadership_lost():
+    # Обязанности лидера уже может выполнять другой процесс. Выходим с
+    # ошибкой: платформа перезапустит процесс, и он вернется резервным
+    logger.error("👑 Лидерство потеряно - перезапуск процесса")
+    os._exit(3)
+
+def main():
+    global lease
+    logger.info(f"🚀 Бот запущен. Режим: {MODE_TEXT}, прием: {BOT_MODE}")
+    logger.info(f"📁 Хранилище: {STORAGE_MODE}, файл данных: {STORAGE_FILE}")
+    
+    if METRICS_PORT:
+        MetricsServer(metrics, host=METRICS_HOST, port=METRICS_PORT).start()
+    
+    store.load()
+    store.start()
+    conversations.load()
+    conversations.start()
+    user_profiles.load()
+    broadcaster.load()
+    update_log.load()
+    archive.open()
+    audit.start()
+    outbox.start()
+    signup_burst.start()
+    if traffic:
+        traffic.start(ADMIN_ID, state_to_json(load_data()), user_profiles.items())
+    if MULTI_INSTANCE:
+        logger.info(f"👥 Несколько процессов, этот: {INSTANCE_ID}")
+        # Аренда - на этот запуск: перезапущенный процесс ждет ее истечения
+        lease = LeaderLease(
+            DB_FILE, f"{INSTANCE_ID}-{os.getpid()}", ttl=LEASE_TTL, renew=LEASE_RENEW,
+            on_elected=start_leader_duties, on_lost=leadership_lost
+        )
+        metrics.gauge('leader', lambda: int(lease.is_leader))
+        metrics.gauge('storage_reloads', lambda: store.reloads)
+        lease.start()
+    else:
+        start_leader_duties()
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    
+    try:
+        if BOT_MODE == 'webhook':
+            run_webhook()
+        else:
+            # getUpdates может вызывать только один процесс
+            if lease and not lease.elected.is_set():
+                logger.info("⏳ Ожидаем лидерства, чтобы принимать обновления")
+                while not lease.elected.wait(1):
+                    pass
+            run_polling()
+    finally:
+        # Рассылка сохраняет прогресс, очередь досылает накопившееся,
+        # потом сохраняем данные и отдаем лидерство
+        signup_burst.stop()
+        if traffic:
+            traffic.stop(state_to_json(load_data()))
+        scheduler.stop()
+        if live_list:
+            live_list.stop()
+        broadcaster.stop()
+        outbox.stop()
+        backups.stop()
+        tenants.close()
+        store.close()
+        archive.close()
+        conversations.close()
+        update_log.save()
+        audit.stop()
+        if lease:
+            lease.stop()
+
+if __name__ == '__main__':
+    main()
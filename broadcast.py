@@ -0,0 +1,202 @@
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: общий режим недоступен
+    fcntl = None
+
+from journal import write_atomic
+from outbox import BULK, REPLY
+
+logger = logging.getLogger(__name__)
+
+
+class Broadcaster:
+    """Рассылка сообщения участникам тренировки в фоне.
+    
+    Получатели обрабатываются пачками по `batch_size`: пачка уходит в
+    outbox с низким приоритетом (лимиты Telegram соблюдает outbox), после
+    ее доставки прогресс сохраняется в файл `path`. Если процесс
+    перезапустится посреди рассылки, она продолжится с первой
+    недоставленной пачки (сообщения из прерванной пачки могут прийти
+    повторно). В конце админ получает число доставленных и недоставленных
+    (если admin_chat не None - у напоминаний отчета нет).
+    
+    Формат файла:
+        {"next_id": 3, "jobs": [{"id": 2, "admin_chat": ..., "text": ...,
+          "markup": "<JSON кнопок>" | null, "pending": [id, ...],
+          "delivered": 10, "failed": 1}]}
+    
+    `shared=True` - рассылки ставят несколько процессов бота, а доставляет
+    только лидер. Каждое изменение идет под файловой блокировкой
+    (<path>.lock) и начинается с перечитывания файла, поток доставки
+    заглядывает в файл раз в `poll` секунд.
+    
+    Сохраненные рассылки читаются в load() (его вызывает и start()); до
+    этого submit отказывается работать - иначе запись файла затерла бы
+    незавершенные рассылки.
+    """
+    
+    def __init__(self, outbox, path, batch_size=25, shared=False, poll=2.0):
+        if shared and fcntl is None:
+            raise RuntimeError("Общий режим рассылок требует fcntl (Linux/macOS)")
+        self.outbox = outbox
+        self.path = path
+        self.batch_size = batch_size
+        self.shared = shared
+        self.poll = poll
+        self._jobs = []
+        self._next_id = 1
+        self._loaded = False
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='broadcaster', daemon=True)
+    
+    # ===== СОСТОЯНИЕ =====
+    def load(self):
+        with self._cond:
+            if self._loaded:
+                return
+            self._read()
+            self._loaded = True
+        if self._jobs:
+            logger.info(f"📣 Незавершенных рассылок: {len(self._jobs)}, продолжаем")
+    
+    def _read(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Не удалось прочитать {self.path}: {e}")
+            return
+        self._jobs = saved.get('jobs', [])
+        self._next_id = saved.get('next_id', 1)
+    
+    @contextmanager
+    def _shared(self):
+        """Под self._cond: в общем режиме - блокировка файла и свежие задания"""
+        if not self.shared:
+            yield
+            return
+        with open(f"{self.path}.lock", 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self._jobs = []
+                self._read()
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+    
+    def _job(self, job_id):
+        return next((job for job in self._jobs if job['id'] == job_id), None)
+    
+    def _save(self):
+        payload = json.dumps({'next_id': self._next_id, 'jobs': self._jobs},
+                             ensure_ascii=False)
+        write_atomic(self.path, payload)
+    
+    # ===== ЗАПУСК РАССЫЛКИ =====
+    def submit(self, admin_chat, recipients, text, markup=None):
+        """Поставить рассылку в очередь, вернуть число получателей.
+        `markup` - кнопки (InlineKeyboardMarkup), хранятся в файле как JSON"""
+        # Без повторов и без ручных записей (у них нет Telegram id)
+        pending = list(dict.fromkeys(uid for uid in recipients if uid))
+        with self._cond, self._shared():
+            if not self._loaded:
+                raise RuntimeError("Рассылки еще не загружены (load)")
+            job = {
+                'id': self._next_id,
+                'admin_chat': admin_chat,
+                'text': text,
+                'markup': markup.to_json() if markup is not None else None,
+                'pending': pending,
+                'total': len(pending),
+                'delivered': 0,
+                'failed': 0,
+            }
+            self._next_id += 1
+            self._jobs.append(job)
+            self._save()
+            self._cond.notify()
+        return len(pending)
+    
+    def active(self):
+        """Незавершенные рассылки: [(id, осталось, всего)]"""
+        with self._cond:
+            return [(job['id'], len(job['pending']), job['total']) for job in self._jobs]
+    
+    # ===== ДОСТАВКА =====
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    with self._shared():
+                        if self._jobs:
+                            break
+                    self._cond.wait(self.poll if self.shared else None)
+                if self._stopped:
+                    return
+                job = self._jobs[0]
+            
+            if job['pending']:
+                self._send_batch(job)
+                continue
+            
+            with self._cond, self._shared():
+                if self._job(job['id']) is not None:
+                    self._jobs.remove(self._job(job['id']))
+                self._save()
+            if job['admin_chat'] is None:
+                continue
+            self.outbox.submit(
+                job['admin_chat'], 'send_message', job['admin_chat'],
+                f"📣 Рассылка завершена\n"
+                f"✅ Доставлено: {job['delivered']}\n"
+                f"❌ Не доставлено: {job['failed']}",
+                priority=REPLY
+            )
+    
+    def _send_batch(self, job):
+        batch = job['pending'][:self.batch_size]
+        # telebot принимает кнопки и готовой JSON-строкой
+        futures = [
+            self.outbox.submit(uid, 'send_message', uid, job['text'],
+                               reply_markup=job.get('markup'), priority=BULK)
+            for uid in batch
+        ]
+        delivered = failed = 0
+        for future in futures:
+            # Ошибку (бот заблокирован, чат не найден) уже записал outbox
+            if future.exception() is None:
+                delivered += 1
+            else:
+                failed += 1
+        
+        with self._cond, self._shared():
+            # В общем режиме задание только что перечитано из файла
+            job = self._job(job['id'])
+            if job is None:
+                return
+            job['pending'] = job['pending'][len(batch):]
+            job['delivered'] += delivered
+            job['failed'] += failed
+            self._save()
+    
+    # ===== ЗАПУСК / ОСТАНОВКА =====
+    def start(self):
+        self.load()
+        self._thread.start()
+    
+    def stop(self, timeout=10):
+        """Остановиться после текущей пачки, остаток доставится после перезапуска"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
@@ -0,0 +1,100 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class SignupBurst:
+    """Запись в первую минуту после открытия: кто раньше нажал, тот раньше
+    в списке.
+    
+    При открытии записи (open) заявки несколько секунд сыплются сотнями,
+    и рабочие потоки обрабатывают их не в том порядке, в каком люди
+    нажимали. В течение `duration` секунд после открытия заявки (submit)
+    не применяются сразу: они копятся `window` секунд, затем пачка
+    сортируется по времени отправки (дата сообщения Telegram, при
+    равенстве - id обновления) и передается в `apply(key, items)` одним
+    вызовом - одна операция хранилища и одна запись на диск на пачку.
+    
+    `key` - (чат, тренировка). `duration` 0 - режим выключен, submit
+    всегда возвращает False.
+    """
+    
+    def __init__(self, apply, window=1.0, duration=60.0, clock=time.monotonic):
+        self.apply = apply
+        self.window = window
+        self.duration = duration
+        self.clock = clock
+        self._cond = threading.Condition()
+        # Открытая запись: {key: до какого времени копим}
+        self._until = {}
+        # Накопленное: {key: (когда применить, [(порядок, заявка)])}
+        self._pending = {}
+        self._stopped = False
+        self.batches = 0
+        self.signups = 0
+        self._thread = threading.Thread(target=self._run, name='signup-burst', daemon=True)
+    
+    def open(self, key, ago=0.0):
+        """Запись открыта `ago` секунд назад (возможно, другим процессом):
+        окно отсчитывается от момента открытия. Повторный вызов для того
+        же открытия ничего не меняет"""
+        if self.duration <= 0 or ago >= self.duration:
+            return
+        with self._cond:
+            self._until[key] = self.clock() + self.duration - max(0.0, ago)
+    
+    def submit(self, key, order, item):
+        """Отложить заявку до конца окна; False - режим не включен, заявку
+        нужно обработать сразу"""
+        with self._cond:
+            if self._stopped or self._until.get(key, 0) <= self.clock():
+                self._until.pop(key, None)
+                return False
+            if key not in self._pending:
+                self._pending[key] = (self.clock() + self.window, [])
+                self._cond.notify()
+            self._pending[key][1].append((order, item))
+            return True
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    now = self.clock()
+                    due = [key for key, (at, _) in self._pending.items() if at <= now]
+                    if due:
+                        break
+                    timeout = min(at for at, _ in self._pending.values()) - now if self._pending else None
+                    self._cond.wait(timeout)
+                if self._stopped:
+                    return
+                batches = [(key, self._pending.pop(key)[1]) for key in due]
+            for key, items in batches:
+                self._flush(key, items)
+    
+    def _flush(self, key, items):
+        items.sort(key=lambda entry: entry[0])
+        self.batches += 1
+        self.signups += len(items)
+        try:
+            self.apply(key, [item for _, item in items])
+        except Exception as e:
+            logger.error(f"Ошибка записи пачки {key}: {e}")
+    
+    # ===== ЗАПУСК / ОСТАНОВКА =====
+    def start(self):
+        self._thread.start()
+    
+    def stop(self):
+        """Применить накопленное и остановиться"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+            batches = list(self._pending.items())
+            self._pending.clear()
+        if self._thread.is_alive():
+            self._thread.join()
+        for key, (_, items) in batches:
+            self._flush(key, items)
@@ -0,0 +1,355 @@
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+from roster import MAIN, MANUAL, RESERVE, name_key, training_to_json
+
+
+class CommandQueue:
+    """Последовательная очередь изменений одной тренировки.
+    
+    TeleBot запускает обработчики в пуле потоков, поэтому проверка
+    "есть ли место" и запись в список должны выполняться как одно целое.
+    Все изменения ставятся в очередь и выполняются строго по одному:
+    поток, который застал очередь пустой, становится ее обработчиком и
+    выполняет команды (свои и чужие), пока очередь не опустеет.
+    Остальные потоки просто ждут результат своей команды.
+    
+    Чтение списка очередь не затрагивает и никогда не блокируется.
+    """
+    
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._pending = deque()
+        self._draining = False
+        self.executed = 0
+    
+    def submit(self, fn, *args, **kwargs):
+        """Выполнить команду в порядке очереди и вернуть ее результат"""
+        future = Future()
+        with self._lock:
+            self._pending.append((fn, args, kwargs, future))
+            consumer = not self._draining
+            if consumer:
+                self._draining = True
+        if consumer:
+            self._drain()
+        return future.result()
+    
+    def _drain(self):
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._draining = False
+                    return
+                fn, args, kwargs, future = self._pending.popleft()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            self.executed += 1
+
+
+# ===== КОМАНДЫ НАД СПИСКОМ =====
+# Команды выполняются только внутри CommandQueue своей тренировки, поэтому
+# между проверкой лимитов и записью в список никто не вклинится.
+
+def sign_up(store, training_id, user_data, max_main, max_reserve):
+    """Записать участника. Возвращает 'main', 'reserve', 'full',
+    'closed', 'duplicate' (уже записан), 'name_taken' или 'missing'"""
+    data = store.data['trainings'].get(training_id)
+    if data is None:
+        return 'missing'
+    roster = data['roster']
+    
+    if not data['registration_open']:
+        return 'closed'
+    
+    user_id = user_data.get('id')
+    if user_id is not None and roster.find_id(user_id):
+        return 'duplicate'
+    
+    if roster.find_name(user_data['display_name']):
+        return 'name_taken'
+    
+    if roster.main_count < max_main:
+        store.apply({'op': 'join', 'training': training_id, 'list': MAIN, 'user': user_data})
+        return 'main'
+    if roster.reserve_count < max_reserve:
+        store.apply({'op': 'join', 'training': training_id, 'list': RESERVE, 'user': user_data})
+        return 'reserve'
+    return 'full'
+
+
+def sign_up_many(store, training_id, signups, max_main, max_reserve):
+    """Записать пачку участников (наплыв при открытии записи) в порядке
+    списка - одной операцией. `signups` - [(user_data, id обновления)].
+    Результат для каждого - как у sign_up"""
+    data = store.data['trainings'].get(training_id)
+    if data is None:
+        return ['missing'] * len(signups)
+    if not data['registration_open']:
+        return ['closed'] * len(signups)
+    roster = data['roster']
+    
+    free = {MAIN: max(0, max_main - roster.main_count),
+            RESERVE: max(0, max_reserve - roster.reserve_count)}
+    ids, names = set(), set()
+    ops, results = [], []
+    for user_data, update_id in signups:
+        user_id = user_data.get('id')
+        name = user_data['display_name']
+        if user_id is not None and (user_id in ids or roster.find_id(user_id)):
+            results.append('duplicate')
+            continue
+        if name_key(name) in names or roster.find_name(name):
+            results.append('name_taken')
+            continue
+        list_name = MAIN if free[MAIN] else RESERVE if free[RESERVE] else None
+        if list_name is None:
+            results.append('full')
+            continue
+        free[list_name] -= 1
+        ids.add(user_id)
+        names.add(name_key(name))
+        # id обновления у каждой записи: повторная доставка не запишет второй раз
+        ops.append({'op': 'join', 'list': list_name, 'user': user_data, 'update': update_id})
+        results.append(list_name)
+    if ops:
+        store.apply({'op': 'batch', 'training': training_id, 'ops': ops})
+    return results
+
+
+def cancel(store, training_id, user_id):
+    """Отменить запись. Возвращает (удаленный, переведенный из резерва)"""
+    data = store.data['trainings'].get(training_id)
+    if data is None:
+        return None, None
+    roster = data['roster']
+    
+    participant = roster.find_id(user_id)
+    if participant is None:
+        return None, None
+    
+    list_name = roster.list_of(participant)
+    op = {'op': 'cancel', 'list': list_name, 'id': user_id}
+    if list_name == MAIN and roster.reserve_count:
+        # Отмена и перевод из резерва - одна операция 'batch': одна запись,
+        # и список с освободившимся, но не занятым местом никто не увидит
+        removed, promoted = store.apply({'op': 'batch', 'training': training_id,
+                                         'ops': [op, {'op': 'promote'}]})
+        return removed, promoted
+    return store.apply(dict(op, training=training_id)), None
+
+
+def rename(store, training_id, user_id, name):
+    """Сменить имя записавшегося. Возвращает 'renamed', 'same',
+    'name_taken', 'not_signed' или 'missing'"""
+    data = store.data['trainings'].get(training_id)
+    if data is None:
+        return 'missing'
+    roster = data['roster']
+    
+    participant = roster.find_id(user_id)
+    if participant is None:
+        return 'not_signed'
+    if participant.display_name == name:
+        return 'same'
+    owner = roster.find_name(name)
+    if owner is not None and owner is not participant:
+        return 'name_taken'
+    store.apply({'op': 'rename', 'training': training_id, 'id': user_id, 'name': name})
+    return 'renamed'
+
+
+def add_manual(store, training_id, user_data, max_main, max_reserve):
+    """Админ добавляет участника. Возвращает 'main', 'reserve',
+    'full', 'name_taken' или 'missing'"""
+    data = store.data['trainings'].get(training_id)
+    if data is None:
+        return 'missing'
+    roster = data['roster']
+    
+    if roster.find_name(user_data['display_name']):
+        return 'name_taken'
+    
+    if roster.main_count < max_main:
+        store.apply({'op': 'manual_add', 'training': training_id, 'list': MANUAL, 'user': user_data})
+        return 'main'
+    if roster.reserve_count < max_reserve:
+        store.apply({'op': 'manual_add', 'training': training_id, 'list': RESERVE, 'user': user_data})
+        return 'reserve'
+    return 'full'
+
+
+def remove(store, training_id, participant):
+    """Админ удаляет конкретную запись. Возвращает удаленную запись или None"""
+    data = store.data['trainings'].get(training_id)
+    if data is None:
+        return None
+    roster = data['roster']
+    
+    list_name = roster.list_of(participant)
+    if list_name is None:
+        return None
+    if roster.find_name(participant.display_name) is participant:
+        return store.apply({'op': 'remove', 'training': training_id, 'name': participant.display_name})
+    # В старых файлах имена могли повторяться - тогда удаляем по позиции
+    users = roster.reserve if list_name == RESERVE else [
+        p for p in roster.main if roster.list_of(p) == list_name
+    ]
+    return store.apply({
+        'op': 'remove', 'training': training_id,
+        'list': list_name, 'index': users.index(participant)
+    })
+
+
+# Массовые команды админа: все проверки по текущему списку, затем одна
+# операция 'batch' - одна запись в журнал/базу и одно сообщение-итог
+
+def add_many(store, training_id, users, max_main, max_reserve):
+    """Админ добавляет несколько участников: всех или никого.
+    Возвращает (результат, итог): результат 'added', 'full' или 'missing';
+    итог - {'main': [...], 'reserve': [...], 'taken': [...], 'free': n}.
+    Занятые имена (и повторы в самом списке) пропускаются"""
+    data = store.data['trainings'].get(training_id)
+    if data is None:
+        return 'missing', {}
+    roster = data['roster']
+    
+    free_main = max(0, max_main - roster.main_count)
+    free_reserve = max(0, max_reserve - roster.reserve_count)
+    summary = {MAIN: [], RESERVE: [], 'taken': [], 'free': free_main + free_reserve}
+    ops = []
+    seen = set()
+    for user in users:
+        name = user['display_name']
+        if name_key(name) in seen or roster.find_name(name):
+            summary['taken'].append(name)
+            continue
+        seen.add(name_key(name))
+        if len(summary[MAIN]) < free_main:
+            ops.append({'op': 'manual_add', 'list': MANUAL, 'user': user})
+            summary[MAIN].append(name)
+        elif len(summary[RESERVE]) < free_reserve:
+            ops.append({'op': 'manual_add', 'list': RESERVE, 'user': user})
+            summary[RESERVE].append(name)
+        else:
+            return 'full', summary
+    if ops:
+        store.apply({'op': 'batch', 'training': training_id, 'ops': ops})
+    return 'added', summary
+
+
+def _find_shown(roster, shown):
+    """Участники по показанному админу списку [[имя, id], ...]:
+    (найденные, имена тех, кого в списке уже нет)"""
+    found, gone = [], []
+    for name, user_id in shown:
+        participant = next((p for p in roster
+                            if p.display_name == name and p.id == user_id), None)
+        if participant is None or participant in found:
+            gone.append(name)
+        else:
+            found.append(participant)
+    return found, gone
+
+
+def remove_many(store, training_id, shown):
+    """Админ удаляет несколько записей. Возвращает (удаленные, имена тех,
+    кого уже нет) или None, если тренировки нет"""
+    data = store.data['trainings'].get(training_id)
+    if data is None:
+        return None
+    roster = data['roster']
+    
+    found, gone = _find_shown(roster, shown)
+    by_name, by_index = [], []
+    for participant in found:
+        list_name = roster.list_of(participant)
+        if roster.find_name(participant.display_name) is participant:
+            by_name.append({'op': 'remove', 'name': participant.display_name})
+            continue
+        # В старых файлах имена могли повторяться - удаляем по позиции,
+        # с конца списка, чтобы позиции остальных не сдвигались
+        users = roster.reserve if list_name == RESERVE else [
+            p for p in roster.main if roster.list_of(p) == list_name
+        ]
+        by_index.append({'op': 'remove', 'list': list_name, 'index': users.index(participant)})
+    by_index.sort(key=lambda op: (op['list'], -op['index']))
+    if found:
+        store.apply({'op': 'batch', 'training': training_id, 'ops': by_index + by_name})
+    return found, gone
+
+
+def move_many(store, training_id, shown, max_main, max_reserve):
+    """Админ переносит участников: из основного списка в конец резерва,
+    из резерва в конец основного. Возвращает (результат, итог):
+    результат 'moved', 'full' (лимиты были бы превышены, ничего не
+    изменено) или 'missing'; итог - {'main': [...], 'reserve': [...],
+    'gone': [...]} (куда перенесены и кого уже нет)"""
+    data = store.data['trainings'].get(training_id)
+    if data is None:
+        return 'missing', {}
+    roster = data['roster']
+    
+    found, gone = _find_shown(roster, shown)
+    summary = {MAIN: [], RESERVE: [], 'gone': gone}
+    ops = []
+    for participant in found:
+        if roster.find_name(participant.display_name) is not participant:
+            # Повторяющееся имя из старых файлов - перенос по имени невозможен
+            gone.append(participant.display_name)
+            continue
+        if roster.list_of(participant) == RESERVE:
+            target = MANUAL if participant.is_manual else MAIN
+            summary[MAIN].append(participant.display_name)
+        else:
+            target = RESERVE
+            summary[RESERVE].append(participant.display_name)
+        ops.append({'op': 'move', 'name': participant.display_name, 'list': target})
+    
+    to_main, to_reserve = len(summary[MAIN]), len(summary[RESERVE])
+    if to_main and roster.main_count + to_main - to_reserve > max_main:
+        return 'full', summary
+    if to_reserve and roster.reserve_count + to_reserve - to_main > max_reserve:
+        return 'full', summary
+    if ops:
+        store.apply({'op': 'batch', 'training': training_id, 'ops': ops})
+    return 'moved', summary
+
+
+def update_settings(store, training_id, values):
+    if training_id not in store.data['trainings']:
+        return None
+    return store.apply({'op': 'settings', 'training': training_id, 'values': values})
+
+
+def archive_training(store, training_id, archive, info):
+    """Записать тренировку в архив и удалить ее. Выполняется в очереди
+    тренировки, поэтому в архив попадает окончательный список"""
+    data = store.data['trainings'].get(training_id)
+    if data is None:
+        return False
+    archive.append(dict(training_to_json(data), **info))
+    store.apply({'op': 'drop', 'training': training_id})
+    return True
+
+
+# ===== КОМАНДЫ НАД НАБОРОМ ТРЕНИРОВОК =====
+# Выполняются в отдельной общей очереди
+
+def create_training(store, training_data):
+    """Добавить тренировку (в формате JSON без id), вернуть ее id"""
+    training_id = store.data['next_id']
+    store.apply({'op': 'create', 'training': training_id, 'data': training_data})
+    return training_id
+
+
+def drop_training(store, training_id):
+    return store.apply({'op': 'drop', 'training': training_id})
+
+
+def reset(store, data):
+    return store.replace(data)
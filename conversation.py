@@ -0,0 +1,286 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from journal import write_atomic
+from state_store import WriteBehindFlusher
+
+logger = logging.getLogger(__name__)
+
+
+class Conversation:
+    """Ожидаемый ответ пользователя: состояние и его данные"""
+    
+    __slots__ = ('state', 'data', 'expires')
+    
+    def __init__(self, state, data, expires):
+        self.state = state
+        self.data = data
+        self.expires = expires
+
+
+class ConversationStore:
+    """Состояния диалогов по ключу (chat_id, user_id).
+    
+    Заменяет register_next_step_handler: вместо замыкания в памяти
+    хранится имя состояния ('name', 'admin_time', ...) и небольшой
+    JSON-словарь данных.
+    
+    * `ttl` - через сколько секунд брошенный вопрос забывается;
+    * `max_entries` - не больше стольких диалогов в памяти, самые давние
+      (LRU) вытесняются;
+    * `backend` - где хранить диалоги между перезапусками (None - только
+      в памяти);
+    * `shared` - с backend работают несколько процессов: ответ на вопрос
+      может прийти в другой процесс, поэтому диалоги читаются из backend
+      при каждом обращении, память не используется.
+    """
+    
+    def __init__(self, backend=None, ttl=900.0, max_entries=10000, clock=time.time,
+                 shared=False):
+        if shared and not hasattr(backend, 'take'):
+            raise ValueError("Общим может быть только хранилище диалогов в SQLite")
+        self.backend = backend
+        self.shared = shared
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.lock = threading.Lock()
+        self._items = OrderedDict()
+        self.evicted = 0
+        self.expired = 0
+    
+    def load(self):
+        if self.backend is None or self.shared:
+            return
+        now = self.clock()
+        with self.lock:
+            for key, state, data, expires in self.backend.load():
+                if expires > now:
+                    self._items[key] = Conversation(state, data, expires)
+                else:
+                    self.backend.delete(key)
+            self._evict()
+        if self._items:
+            logger.info(f"💬 Восстановлено незавершенных диалогов: {len(self._items)}")
+    
+    def start(self):
+        if hasattr(self.backend, 'start'):
+            self.backend.start()
+    
+    def close(self):
+        """Сохранить отложенные изменения backend"""
+        if hasattr(self.backend, 'close'):
+            self.backend.close()
+    
+    # ===== ДОСТУП =====
+    def set(self, chat_id, user_id, state, **data):
+        key = (chat_id, user_id)
+        expires = self.clock() + self.ttl
+        if self.shared:
+            self.backend.save(key, state, data, expires)
+            return
+        with self.lock:
+            self._items[key] = Conversation(state, data, expires)
+            self._items.move_to_end(key)
+            self._evict()
+            if self.backend:
+                self.backend.save(key, state, data, expires)
+    
+    def get(self, chat_id, user_id):
+        """Текущий диалог или None (просроченный удаляется)"""
+        key = (chat_id, user_id)
+        if self.shared:
+            row = self.backend.get(key)
+            if row is None or row[2] > self.clock():
+                return Conversation(*row) if row else None
+            self.backend.delete(key)
+            self.expired += 1
+            return None
+        with self.lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            if item.expires <= self.clock():
+                self._drop(key)
+                self.expired += 1
+                return None
+            self._items.move_to_end(key)
+            return item
+    
+    def pop(self, chat_id, user_id):
+        """Забрать диалог (ответ получен)"""
+        key = (chat_id, user_id)
+        if self.shared:
+            # Один ответ забирает ровно один процесс
+            row = self.backend.take(key)
+            item = Conversation(*row) if row else None
+        else:
+            with self.lock:
+                item = self._items.get(key)
+                if item is not None:
+                    self._drop(key)
+        if item is not None and item.expires <= self.clock():
+            self.expired += 1
+            return None
+        return item
+    
+    def __len__(self):
+        return len(self._items)
+    
+    # ===== ОЧИСТКА =====
+    def _drop(self, key):
+        del self._items[key]
+        if self.backend:
+            self.backend.delete(key)
+    
+    def _evict(self):
+        # В начале - давно не тронутые диалоги, просроченные убираем сразу
+        now = self.clock()
+        while self._items:
+            key, item = next(iter(self._items.items()))
+            if item.expires > now:
+                break
+            self._drop(key)
+            self.expired += 1
+        while len(self._items) > self.max_entries:
+            key, _ = self._items.popitem(last=False)
+            self.evicted += 1
+            if self.backend:
+                self.backend.delete(key)
+    
+    def sweep(self):
+        """Удалить все просроченные диалоги"""
+        now = self.clock()
+        with self.lock:
+            for key in [k for k, item in self._items.items() if item.expires <= now]:
+                self._drop(key)
+                self.expired += 1
+
+
+# ===== ХРАНЕНИЕ =====
+class JsonFileBackend:
+    """Диалоги в JSON-файле.
+    
+    Файл перезаписывается целиком, поэтому после start() изменения не
+    пишутся сразу: как и состояние (WriteBehindFlusher), файл сохраняется
+    после `flush_delay` секунд затишья, но не реже чем раз в `max_delay`.
+    Сбой между записями теряет только последние вопросы бота - их
+    зададут снова. До start() каждое изменение пишется сразу.
+    """
+    
+    def __init__(self, path, flush_delay=0.5, max_delay=3.0):
+        self.path = path
+        self.flush_delay = flush_delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self._rows = {}
+        self._dirty = False
+        self._flusher = None
+    
+    def load(self):
+        if not os.path.exists(self.path):
+            return []
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                rows = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Не удалось прочитать {self.path}: {e}")
+            return []
+        self._rows = {(r['chat'], r['user']): r for r in rows}
+        return [((r['chat'], r['user']), r['state'], r['data'], r['expires'])
+                for r in rows]
+    
+    def save(self, key, state, data, expires):
+        with self.lock:
+            self._rows[key] = {'chat': key[0], 'user': key[1], 'state': state,
+                               'data': data, 'expires': expires}
+            self._dirty = True
+        self._changed()
+    
+    def delete(self, key):
+        with self.lock:
+            if self._rows.pop(key, None) is None:
+                return
+            self._dirty = True
+        self._changed()
+    
+    def _changed(self):
+        if self._flusher:
+            self._flusher.notify()
+        else:
+            self.flush()
+    
+    def flush(self):
+        with self.lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            write_atomic(self.path, json.dumps(list(self._rows.values()), ensure_ascii=False))
+    
+    def start(self):
+        self._flusher = WriteBehindFlusher(self, self.flush_delay, self.max_delay)
+        self._flusher.start()
+    
+    def close(self):
+        if self._flusher:
+            self._flusher.stop()
+            self._flusher = None
+        self.flush()
+
+
+class SqliteBackend:
+    """Диалоги в таблице SQLite (одна строка на диалог)"""
+    
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS conversations (
+        chat_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        state TEXT NOT NULL,
+        data TEXT NOT NULL,
+        expires REAL NOT NULL,
+        PRIMARY KEY (chat_id, user_id)
+    )
+    """
+    
+    def __init__(self, db_path):
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None,
+                                    timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(self.SCHEMA)
+    
+    def load(self):
+        return [((chat_id, user_id), state, json.loads(data), expires)
+                for chat_id, user_id, state, data, expires in
+                self.conn.execute("SELECT chat_id, user_id, state, data, expires FROM conversations")]
+    
+    def save(self, key, state, data, expires):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO conversations (chat_id, user_id, state, data, expires) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (key[0], key[1], state, json.dumps(data, ensure_ascii=False), expires)
+        )
+    
+    def delete(self, key):
+        self.conn.execute(
+            "DELETE FROM conversations WHERE chat_id = ? AND user_id = ?", key
+        )
+    
+    def get(self, key):
+        """(state, data, expires) или None - для общего режима"""
+        row = self.conn.execute(
+            "SELECT state, data, expires FROM conversations WHERE chat_id = ? AND user_id = ?", key
+        ).fetchone()
+        return (row[0], json.loads(row[1]), row[2]) if row else None
+    
+    def take(self, key):
+        """Прочитать и удалить диалог одной операцией"""
+        row = self.conn.execute(
+            "DELETE FROM conversations WHERE chat_id = ? AND user_id = ? "
+            "RETURNING state, data, expires", key
+        ).fetchone()
+        return (row[0], json.loads(row[1]), row[2]) if row else None
@@ -0,0 +1,165 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def write_atomic(path, payload):
+    """Записать файл целиком: сначала во временный, потом os.replace.
+    
+    При падении посреди записи на диске остается старая версия файла,
+    а не обрезанный JSON. Временный файл у каждой записи свой: два
+    потока, сохраняющие один файл, не пишут друг другу в середину.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                                    prefix=f"{os.path.basename(path)}.", suffix='.tmp')
+    try:
+        with open(fd, 'w', encoding='utf-8') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class Journal:
+    """Журнал изменений: одна компактная JSON-строка на операцию.
+    
+    Каждая запись дописывается в конец файла и сразу fsync-ается, поэтому
+    стоимость записи не зависит от размера списка. Рядом лежит снимок
+    (DATA_FILE), в который журнал периодически сворачивается.
+    
+    Файлы:
+        <path>      - текущий журнал
+        <path>.1    - журнал, который сейчас сворачивается в снимок
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.rotated_path = f"{path}.1"
+        self.seq = 0
+        self.pending = 0
+        self._file = None
+    
+    def open(self):
+        self._file = open(self.path, 'a', encoding='utf-8')
+    
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+    
+    def append(self, op):
+        """Дописать операцию, вернуть ее порядковый номер"""
+        self.seq += 1
+        record = dict(op, seq=self.seq)
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+        self._file.write(line + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.pending += 1
+        return self.seq
+    
+    def rotate(self):
+        """Отложить текущий журнал для свертки и начать новый.
+        
+        Вызывается под блокировкой хранилища вместе с сериализацией снимка,
+        чтобы ни одна операция не потерялась между ними.
+        """
+        self.close()
+        if os.path.exists(self.path):
+            if os.path.exists(self.rotated_path):
+                # Прошлая свертка не завершилась - склеиваем хвосты
+                with open(self.rotated_path, 'a', encoding='utf-8') as dst, \
+                        open(self.path, 'r', encoding='utf-8') as src:
+                    dst.write(src.read())
+                os.remove(self.path)
+            else:
+                os.replace(self.path, self.rotated_path)
+        self.pending = 0
+        self.open()
+    
+    def drop_rotated(self):
+        if os.path.exists(self.rotated_path):
+            os.remove(self.rotated_path)
+    
+    def records(self, after_seq=0):
+        """Прочитать операции из обоих файлов журнала после снимка"""
+        for path in (self.rotated_path, self.path):
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Оборванная последняя строка после падения
+                        logger.warning(f"Пропущена битая запись журнала в {path}")
+                        continue
+                    seq = record.get('seq', 0)
+                    self.seq = max(self.seq, seq)
+                    if seq > after_seq:
+                        yield record
+
+
+class Compactor(threading.Thread):
+    """Фоновая свертка журнала в снимок.
+    
+    Срабатывает, когда в журнале накопилось `max_records` записей или
+    прошло `interval` секунд с последней свертки (если было что сворачивать),
+    а также по request() - даже если журнал пуст.
+    """
+    
+    def __init__(self, store, max_records=500, interval=60.0):
+        super().__init__(name='journal-compactor', daemon=True)
+        self.store = store
+        self.max_records = max_records
+        self.interval = interval
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._requested = False
+    
+    def notify(self, pending):
+        if pending >= self.max_records:
+            with self._cond:
+                self._cond.notify()
+    
+    def request(self):
+        """Свернуть при первой возможности: состояние изменилось мимо журнала"""
+        with self._cond:
+            self._requested = True
+            self._cond.notify()
+    
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self.is_alive():
+            self.join()
+    
+    def run(self):
+        last = time.monotonic()
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                if not self._requested:
+                    self._cond.wait(max(0.0, last + self.interval - time.monotonic()))
+                if self._stopped:
+                    return
+                requested, self._requested = self._requested, False
+            if requested or self.store.journal.pending:
+                self.store.compact()
+            last = time.monotonic()
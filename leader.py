@@ -0,0 +1,129 @@
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires REAL NOT NULL
+)
+"""
+
+
+class LeaderLease(threading.Thread):
+    """Выбор лидера среди процессов бота через аренду в общей SQLite.
+    
+    Лидер - тот, чья запись в таблице leases еще не истекла. Он продлевает
+    аренду каждые `renew` секунд на `ttl` секунд вперед; остальные
+    процессы с той же периодичностью пробуют ее занять. Если лидер завис
+    или упал, через `ttl` секунд лидером становится другой процесс.
+    
+    Свою аренду процесс считает действующей только до момента последнего
+    продления + ttl по локальным монотонным часам: зависший лидер узнает,
+    что лидерство могло перейти к другому, даже не дождавшись базы.
+    
+    * `on_elected()` - вызывается один раз, когда процесс стал лидером;
+    * `on_lost()` - аренда потеряна (обычно процесс после этого завершают).
+    """
+    
+    def __init__(self, db_path, holder, name='leader', ttl=15.0, renew=5.0,
+                 on_elected=None, on_lost=None, clock=time.time):
+        super().__init__(name='leader-lease', daemon=True)
+        if renew >= ttl:
+            raise ValueError("Аренду нужно продлевать чаще, чем она истекает")
+        self.db_path = db_path
+        self.holder = holder
+        self.lease_name = name
+        self.ttl = ttl
+        self.renew = renew
+        self.on_elected = on_elected
+        self.on_lost = on_lost
+        self.clock = clock
+        self.elected = threading.Event()
+        self._valid_until = 0.0
+        self._cond = threading.Condition()
+        self._stopped = False
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None,
+                                    timeout=renew)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(SCHEMA)
+    
+    @property
+    def is_leader(self):
+        return self.elected.is_set() and time.monotonic() < self._valid_until
+    
+    def try_acquire(self):
+        """Занять или продлить аренду; True - процесс лидер"""
+        started = time.monotonic()
+        now = self.clock()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute(
+                "SELECT holder, expires FROM leases WHERE name = ?", (self.lease_name,)
+            ).fetchone()
+            free = row is None or row[0] == self.holder or row[1] <= now
+            if free:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO leases (name, holder, expires) VALUES (?, ?, ?)",
+                    (self.lease_name, self.holder, now + self.ttl)
+                )
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        if free:
+            self._valid_until = started + self.ttl
+        return free
+    
+    def holder_now(self):
+        """Кто сейчас лидер (None - никто)"""
+        row = self.conn.execute(
+            "SELECT holder, expires FROM leases WHERE name = ?", (self.lease_name,)
+        ).fetchone()
+        return row[0] if row and row[1] > self.clock() else None
+    
+    # ===== ФОН =====
+    def run(self):
+        while True:
+            try:
+                acquired = self.try_acquire()
+            except sqlite3.Error as e:
+                logger.warning(f"Не удалось продлить аренду лидера: {e}")
+                # До конца аренды процесс остается лидером
+                acquired = self.is_leader
+            
+            if acquired and not self.elected.is_set():
+                logger.info(f"👑 {self.holder} стал лидером")
+                self.elected.set()
+                if self.on_elected:
+                    self.on_elected()
+            elif not acquired and self.elected.is_set():
+                logger.error(f"{self.holder} потерял лидерство")
+                self.elected.clear()
+                if self.on_lost:
+                    self.on_lost()
+            
+            with self._cond:
+                if self._stopped:
+                    return
+                self._cond.wait(self.renew)
+                if self._stopped:
+                    return
+    
+    def stop(self):
+        """Остановиться и отдать аренду (следующий лидер не ждет ttl)"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self.is_alive():
+            self.join()
+        if self.elected.is_set():
+            self.conn.execute(
+                "DELETE FROM leases WHERE name = ? AND holder = ?", (self.lease_name, self.holder)
+            )
+            self.elected.clear()
+        self.conn.close()
@@ -0,0 +1,191 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from journal import write_atomic
+from outbox import BULK
+
+logger = logging.getLogger(__name__)
+
+# Ответы Telegram, после которых сообщение больше нельзя править
+LOST_MESSAGE_ERRORS = (
+    'message to edit not found',
+    "message can't be edited",
+    'chat not found',
+    'bot was blocked by the user',
+)
+
+
+class LiveList:
+    """Один закрепленный список участников на чат, обновляемый правкой.
+    
+    Первый показ списка в чате отправляет сообщение и закрепляет его,
+    дальше показ и каждое изменение тренировки (touch) только правят
+    текст через edit_message_text - новых сообщений в чате нет. Правки
+    собираются за `debounce` секунд: десять записей подряд дают одну
+    правку в каждом чате.
+    
+    `render(training_id)` возвращает текст списка или None, если
+    тренировки больше нет. Номера сообщений хранятся в файле `path`,
+    чтобы после перезапуска править те же сообщения.
+    """
+    
+    def __init__(self, outbox, render, path, debounce=2.0):
+        self.outbox = outbox
+        self.render = render
+        self.path = path
+        self.debounce = debounce
+        self._messages = {}   # (chat_id, training_id) -> message_id
+        self._texts = {}      # (chat_id, training_id) -> текст в сообщении
+        self._sending = {}    # (chat_id, training_id) -> последний текст, пока
+                              # новое сообщение еще не отправлено
+        self._dirty = {}      # training_id -> когда обновлять (monotonic)
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='live-list', daemon=True)
+    
+    # ===== СОСТОЯНИЕ =====
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for chat_id, training_id, message_id in json.load(f):
+                    self._messages[(chat_id, training_id)] = message_id
+        except (OSError, ValueError) as e:
+            logger.error(f"Не удалось прочитать {self.path}: {e}")
+    
+    def _save(self):
+        rows = [[chat_id, training_id, message_id]
+                for (chat_id, training_id), message_id in self._messages.items()]
+        write_atomic(self.path, json.dumps(rows))
+    
+    def _forget(self, key):
+        with self._cond:
+            if self._messages.pop(key, None) is not None:
+                self._texts.pop(key, None)
+                self._save()
+    
+    # ===== ПОКАЗ =====
+    def has(self, chat_id, training_id):
+        return (chat_id, training_id) in self._messages
+    
+    def show(self, chat_id, training_id, text):
+        """Показать список: обновить закрепленное сообщение или закрепить
+        новое (обработчик не ждет отправки)"""
+        key = (chat_id, training_id)
+        with self._cond:
+            message_id = self._messages.get(key)
+            if message_id is None:
+                sending = key in self._sending
+                self._sending[key] = text
+        if message_id:
+            self._edit(key, message_id, text)
+            return
+        if sending:
+            # Сообщение уже отправляется - поправим его, когда будет номер
+            return
+        future = self.outbox.submit(chat_id, 'send_message', chat_id, text)
+        future.add_done_callback(lambda f: self._sent(key, text, f))
+    
+    def _sent(self, key, text, future):
+        """Новое сообщение со списком отправлено - запомнить и закрепить"""
+        error = future.exception()
+        with self._cond:
+            latest = self._sending.pop(key, text)
+            if error is not None:
+                logger.error(f"Не удалось отправить список в чат {key[0]}: {error}")
+                return
+            message_id = future.result().message_id
+            self._messages[key] = message_id
+            self._texts[key] = text
+            self._save()
+        # В группе без прав администратора закрепить не выйдет - список
+        # все равно будет обновляться
+        self.outbox.submit(key[0], 'pin_chat_message', key[0], message_id,
+                           disable_notification=True)
+        self._edit(key, message_id, latest)
+    
+    def touch(self, training_id):
+        """Тренировка изменилась - обновить ее списки после паузы"""
+        with self._cond:
+            if training_id not in self._dirty:
+                self._dirty[training_id] = time.monotonic() + self.debounce
+                self._cond.notify()
+    
+    # ===== ОБНОВЛЕНИЕ =====
+    def _edit(self, key, message_id, text):
+        # Сравнение и запись - вместе: два потока с одним текстом не
+        # отправят его дважды
+        with self._cond:
+            if self._texts.get(key) == text:
+                return
+            self._texts[key] = text
+        chat_id = key[0]
+        future = self.outbox.submit(
+            chat_id, 'edit_message_text', text,
+            chat_id=chat_id, message_id=message_id, priority=BULK
+        )
+        future.add_done_callback(lambda f: self._edit_done(key, text, f))
+    
+    def _edit_done(self, key, text, future):
+        error = future.exception()
+        if error is None:
+            return
+        description = str(error).lower()
+        if any(reason in description for reason in LOST_MESSAGE_ERRORS):
+            # Сообщение удалили - при следующем показе закрепим новое
+            self._forget(key)
+        elif 'message is not modified' not in description:
+            with self._cond:
+                # Текст не дошел - следующий показ отправит его снова (если
+                # за это время не ушел уже более новый)
+                if self._texts.get(key) == text:
+                    del self._texts[key]
+    
+    def _refresh(self, training_id):
+        with self._cond:
+            keys = [key for key in self._messages if key[1] == training_id]
+        if not keys:
+            return
+        text = self.render(training_id)
+        for key in keys:
+            if text is None:
+                # Тренировка завершена - сообщение остается как есть
+                self._forget(key)
+            else:
+                self._edit(key, self._messages[key], text)
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    now = time.monotonic()
+                    due = [tid for tid, at in self._dirty.items() if at <= now]
+                    if due:
+                        break
+                    timeout = min(self._dirty.values()) - now if self._dirty else None
+                    self._cond.wait(timeout)
+                if self._stopped:
+                    return
+                for training_id in due:
+                    del self._dirty[training_id]
+            for training_id in due:
+                try:
+                    self._refresh(training_id)
+                except Exception as e:
+                    logger.error(f"Ошибка обновления списка {training_id}: {e}")
+    
+    # ===== ЗАПУСК / ОСТАНОВКА =====
+    def start(self):
+        self._load()
+        self._thread.start()
+    
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread.is_alive():
+            self._thread.join()
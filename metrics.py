@@ -0,0 +1,233 @@
+import functools
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм, сек
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+
+
+class Histogram:
+    __slots__ = ('counts', 'total', 'count')
+    
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.count = 0
+    
+    def observe(self, value):
+        self.total += value
+        self.count += 1
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+    
+    def quantile(self, q):
+        """Оценка квантиля по корзинам (верхняя граница корзины)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound if bound != float('inf') else BUCKETS[-2]
+        return BUCKETS[-2]
+
+
+def label_text(labels):
+    if not labels:
+        return ''
+    parts = ','.join(f'{k}="{str(v)}"' for k, v in labels)
+    return '{' + parts + '}'
+
+
+class Metrics:
+    """Счетчики и гистограммы времени в памяти процесса.
+    
+    Имя метрики + набор меток -> Histogram или число. Выдача в текстовом
+    формате Prometheus (render) и кратко для админа (summary).
+    """
+    
+    def __init__(self, prefix='sportbot'):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+    
+    # ===== ЗАПИСЬ =====
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+    
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+    
+    def gauge(self, name, read):
+        """Значение, которое читается в момент выдачи (глубина очереди и т.п.)"""
+        self._gauges[name] = read
+    
+    def timed(self, name, func, **labels):
+        """Обертка: время вызова в гистограмму `name`, ошибки в `<name>_errors`"""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                self.inc(f'{name}_errors', **labels)
+                raise
+            finally:
+                self.observe(name, time.perf_counter() - started, **labels)
+        return wrapper
+    
+    def wrap(self, obj, attr, name, **labels):
+        """Заменить метод объекта на обертку с замером времени"""
+        setattr(obj, attr, self.timed(name, getattr(obj, attr), **labels))
+    
+    # ===== ВЫДАЧА =====
+    def render(self):
+        """Текстовый формат Prometheus"""
+        lines = []
+        with self.lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+        
+        typed = set()
+        for (name, labels), histogram in histograms:
+            full = f'{self.prefix}_{name}_seconds'
+            if full not in typed:
+                typed.add(full)
+                lines.append(f'# TYPE {full} histogram')
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram.counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{full}_bucket{label_text(labels + (("le", le),))} {cumulative}')
+            lines.append(f'{full}_sum{label_text(labels)} {histogram.total:.6f}')
+            lines.append(f'{full}_count{label_text(labels)} {histogram.count}')
+        
+        for (name, labels), value in counters:
+            full = f'{self.prefix}_{name}_total'
+            if full not in typed:
+                typed.add(full)
+                lines.append(f'# TYPE {full} counter')
+            lines.append(f'{full}{label_text(labels)} {value}')
+        
+        for name, read in sorted(self._gauges.items()):
+            full = f'{self.prefix}_{name}'
+            try:
+                value = read()
+            except Exception as e:
+                logger.warning(f"Метрика {name} недоступна: {e}")
+                continue
+            lines.append(f'# TYPE {full} gauge')
+            lines.append(f'{full} {value}')
+        return '\n'.join(lines) + '\n'
+    
+    def summary(self, name, label):
+        """Строки для /metrics: значение метки, число вызовов, p50/p95, ошибки"""
+        with self.lock:
+            rows = []
+            for (metric, labels), histogram in self._histograms.items():
+                if metric != name:
+                    continue
+                value = dict(labels).get(label, '')
+                errors = self._counters.get((f'{name}_errors', labels), 0)
+                rows.append((
+                    value, histogram.count, histogram.quantile(0.5),
+                    histogram.quantile(0.95), errors
+                ))
+        rows.sort(key=lambda row: -row[1])
+        return rows
+    
+    def gauges(self):
+        values = {}
+        for name, read in self._gauges.items():
+            try:
+                values[name] = read()
+            except Exception:
+                continue
+        return values
+
+
+# ===== ИНСТРУМЕНТЫ ДЛЯ БОТА =====
+def instrument_bot(bot, metrics):
+    """Замер всех обработчиков бота и вызовов Telegram API.
+    
+    Вызывается после регистрации обработчиков: функции в списках
+    message_handlers / callback_query_handlers заменяются обертками.
+    Ответы на вопросы бота идут через обработчик continue_conversation,
+    время самих диалогов - instrument_conversations.
+    """
+    for kind, handlers in (('message', bot.message_handlers),
+                           ('callback', bot.callback_query_handlers)):
+        for handler in handlers:
+            func = handler['function']
+            handler['function'] = metrics.timed(
+                'handler', func, handler=func.__name__, kind=kind
+            )
+    
+    for method in ('send_message', 'edit_message_text', 'answer_callback_query',
+                   'pin_chat_message'):
+        metrics.wrap(bot, method, 'api', method=method)
+
+
+def instrument_conversations(conversations, metrics):
+    """Замер доступа к диалогам (вместе с записью в backend)"""
+    for op in ('get', 'set', 'pop'):
+        metrics.wrap(conversations, op, 'conversation', op=op)
+
+
+def instrument_store(store, metrics):
+    """Замер чтения и записи хранилища"""
+    for attr, op in (('load', 'load'), ('_persist', 'write'), ('flush', 'flush')):
+        metrics.wrap(store, attr, 'storage', op=op)
+    if getattr(store, 'journal', None):
+        metrics.wrap(store, 'compact', 'storage', op='compact')
+    if hasattr(store, 'read_training'):
+        metrics.wrap(store, 'read_training', 'storage', op='read')
+
+
+class MetricsServer(threading.Thread):
+    """GET /metrics на локальном порту (для Prometheus)"""
+    
+    def __init__(self, metrics, host='127.0.0.1', port=9100):
+        super().__init__(name='metrics-http', daemon=True)
+        metrics_ref = metrics
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics_ref.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self.server = ThreadingHTTPServer((host, port), Handler)
+    
+    def run(self):
+        logger.info(f"📈 Метрики: http://{self.server.server_address[0]}:{self.server.server_address[1]}/metrics")
+        self.server.serve_forever()
+    
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
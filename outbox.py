@@ -0,0 +1,321 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# ===== ПРИОРИТЕТЫ =====
+# Меньше - важнее. Уведомление о переводе из резерва и прямые ответы
+# уходят раньше массовых рассылок.
+PROMOTION = 0
+REPLY = 1
+BULK = 2
+
+LANE_NAMES = {PROMOTION: 'promotion', REPLY: 'reply', BULK: 'bulk'}
+
+
+class TokenBucket:
+    """Классическое ведро токенов: `rate` токенов в секунду, не больше `capacity`"""
+    
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'blocked_until')
+    
+    def __init__(self, rate, capacity, now=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic() if now is None else now
+        # После 429 Telegram просит не писать retry_after секунд
+        self.blocked_until = 0.0
+    
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def wait_time(self, now):
+        """Через сколько секунд будет доступен токен (0 - уже сейчас)"""
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+    
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+    
+    def block(self, seconds, now):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+
+class Job:
+    __slots__ = ('chat_id', 'method', 'args', 'kwargs', 'priority', 'future',
+                 'created', 'attempts', 'not_before')
+    
+    def __init__(self, chat_id, method, args, kwargs, priority):
+        self.chat_id = chat_id
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.future = Future()
+        self.created = time.monotonic()
+        self.attempts = 0
+        self.not_before = 0.0
+
+
+class Outbox:
+    """Очередь исходящих сообщений с ограничением скорости.
+    
+    * общее ведро - лимит Telegram на весь бот (~30 сообщений/сек);
+    * ведро на каждый чат - лимит на один чат (личный ~1/сек, группа ~20/мин);
+    * приоритеты: PROMOTION, REPLY, BULK;
+    * 429 Too Many Requests: чат (или весь бот) ставится на паузу на
+      retry_after секунд, сообщение возвращается в очередь;
+    * сетевые ошибки и 5xx - повтор с растущей паузой, до `max_attempts`.
+    
+    Диспетчер (один поток) выбирает следующее сообщение и берет токены,
+    сами запросы к API выполняет пул `senders` потоков.
+    """
+    
+    # Сколько первых сообщений очереди просматривать в поисках чата,
+    # который не упирается в свой лимит
+    SCAN_LIMIT = 64
+    # Сколько ведер чатов держать, прежде чем забыть простаивающие
+    MAX_CHAT_BUCKETS = 10000
+    
+    def __init__(self, transport, global_rate=30.0, chat_rate=1.0, chat_burst=3,
+                 group_rate=20 / 60, senders=8, max_attempts=5, backoff=1.0):
+        self.transport = transport
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self._chat_buckets = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+        # Очередь больше не принимает сообщений (stop дошел до конца)
+        self._closed = False
+        self._pool = ThreadPoolExecutor(max_workers=senders, thread_name_prefix='outbox-send')
+        self._thread = threading.Thread(target=self._run, name='outbox-dispatcher', daemon=True)
+        self.metrics = OutboxMetrics()
+    
+    # ===== ПОСТАНОВКА В ОЧЕРЕДЬ =====
+    def submit(self, chat_id, method, /, *args, priority=REPLY, **kwargs):
+        """Поставить вызов API в очередь, вернуть Future с результатом"""
+        job = Job(chat_id, method, args, kwargs, priority)
+        self._push(job)
+        return job.future
+    
+    def _push(self, job):
+        with self._cond:
+            if self._closed:
+                # Повтор после 429 или сетевой ошибки пришел уже после stop
+                self._abandon(job)
+                return
+            heapq.heappush(self._heap, (job.priority, next(self._seq), job))
+            self.metrics.queued(len(self._heap))
+            self._cond.notify()
+    
+    def depth(self):
+        return len(self._heap)
+    
+    # ===== ДИСПЕТЧЕР =====
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= self.MAX_CHAT_BUCKETS:
+                self._forget_idle(time.monotonic())
+            # Отрицательный id - группа или канал
+            rate = self.group_rate if chat_id < 0 else self.chat_rate
+            bucket = self._chat_buckets[chat_id] = TokenBucket(rate, self.chat_burst)
+        return bucket
+    
+    def _forget_idle(self, now):
+        # Полное ведро без паузы после 429 ничем не отличается от нового
+        for chat_id, bucket in list(self._chat_buckets.items()):
+            if bucket.wait_time(now) == 0 and bucket.tokens >= bucket.capacity:
+                del self._chat_buckets[chat_id]
+    
+    def _next_job(self, now):
+        """Выбрать сообщение, которое можно отправить сейчас.
+        
+        Возвращает (job, 0) или (None, сколько ждать).
+        """
+        global_wait = self.global_bucket.wait_time(now)
+        if global_wait > 0:
+            return None, global_wait
+        
+        wait = None
+        for _, _, job in heapq.nsmallest(self.SCAN_LIMIT, self._heap):
+            job_wait = max(job.not_before - now, self._chat_bucket(job.chat_id).wait_time(now))
+            if job_wait <= 0:
+                self._heap.remove(next(item for item in self._heap if item[2] is job))
+                heapq.heapify(self._heap)
+                self.metrics.queued(len(self._heap))
+                self.global_bucket.take(now)
+                self._chat_bucket(job.chat_id).take(now)
+                return job, 0
+            wait = job_wait if wait is None else min(wait, job_wait)
+        return None, wait
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped and not self._heap:
+                        return
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    job, wait = self._next_job(time.monotonic())
+                    if job:
+                        break
+                    self._cond.wait(wait)
+            try:
+                self._pool.submit(self._send, job)
+            except RuntimeError:
+                # stop не дождался диспетчера и уже остановил пул
+                with self._cond:
+                    self._abandon(job)
+    
+    # ===== ОТПРАВКА =====
+    def _send(self, job):
+        job.attempts += 1
+        started = time.monotonic()
+        try:
+            result = getattr(self.transport, job.method)(*job.args, **job.kwargs)
+        except Exception as e:
+            self._handle_error(job, e)
+            return
+        now = time.monotonic()
+        self.metrics.sent(job.priority, now - job.created, now - started)
+        job.future.set_result(result)
+    
+    def _handle_error(self, job, error):
+        code = getattr(error, 'error_code', None)
+        now = time.monotonic()
+        
+        if code == 429:
+            retry_after = retry_after_of(error)
+            self.metrics.throttled()
+            logger.warning(f"429 для чата {job.chat_id}, пауза {retry_after} сек")
+            with self._cond:
+                self._chat_bucket(job.chat_id).block(retry_after, now)
+                # Заметный retry_after - признак глобального ограничения
+                if retry_after > 1:
+                    self.global_bucket.block(retry_after, now)
+            self._push(job)
+            return
+        
+        # 4xx (кроме 429) - повтор не поможет: бот заблокирован, чат не найден...
+        retryable = code is None or code >= 500
+        if retryable and job.attempts < self.max_attempts:
+            job.not_before = now + self.backoff * 2 ** (job.attempts - 1)
+            self.metrics.retried()
+            self._push(job)
+            return
+        
+        self.metrics.failed(job.priority)
+        logger.error(f"Не удалось отправить {job.method} в чат {job.chat_id}: {error}")
+        job.future.set_exception(error)
+    
+    def _abandon(self, job):
+        """Сообщение не будет отправлено: очередь остановлена (под self._cond)"""
+        self.metrics.failed(job.priority)
+        logger.warning(f"Очередь остановлена, {job.method} в чат {job.chat_id} не отправлен")
+        job.future.set_exception(RuntimeError("Очередь отправки остановлена"))
+    
+    # ===== ЗАПУСК / ОСТАНОВКА =====
+    def start(self):
+        self._thread.start()
+    
+    def stop(self, timeout=10):
+        """Дослать очередь (не дольше timeout секунд) и остановиться.
+        
+        Что не успело уйти (в том числе повторы после 429), завершается
+        ошибкой: ожидающие Future не висят.
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+        with self._cond:
+            self._closed = True
+            for _, _, job in self._heap:
+                self._abandon(job)
+            self._heap.clear()
+            self.metrics.queued(0)
+            self._cond.notify()
+        self._pool.shutdown(wait=True)
+
+
+def retry_after_of(error, default=5):
+    result = getattr(error, 'result_json', None) or {}
+    parameters = result.get('parameters') or {}
+    return parameters.get('retry_after', default)
+
+
+class OutboxMetrics:
+    """Счетчики очереди: глубина, задержка доставки, ошибки"""
+    
+    # Границы корзин гистограммы задержки, сек
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float('inf'))
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.depth = 0
+        self.max_depth = 0
+        self.sent_total = {lane: 0 for lane in LANE_NAMES}
+        self.failed_total = {lane: 0 for lane in LANE_NAMES}
+        self.retries = 0
+        self.throttles = 0
+        self.latency_buckets = [0] * len(self.BUCKETS)
+        self.latency_sum = 0.0
+        self.api_time_sum = 0.0
+    
+    def queued(self, depth):
+        self.depth = depth
+        self.max_depth = max(self.max_depth, depth)
+    
+    def sent(self, lane, latency, api_time):
+        with self.lock:
+            self.sent_total[lane] += 1
+            self.latency_sum += latency
+            self.api_time_sum += api_time
+            for i, bound in enumerate(self.BUCKETS):
+                if latency <= bound:
+                    self.latency_buckets[i] += 1
+                    break
+    
+    def failed(self, lane):
+        with self.lock:
+            self.failed_total[lane] += 1
+    
+    def retried(self):
+        with self.lock:
+            self.retries += 1
+    
+    def throttled(self):
+        with self.lock:
+            self.throttles += 1
+    
+    def snapshot(self):
+        with self.lock:
+            sent = sum(self.sent_total.values())
+            return {
+                'depth': self.depth,
+                'max_depth': self.max_depth,
+                'sent': {LANE_NAMES[k]: v for k, v in self.sent_total.items()},
+                'failed': {LANE_NAMES[k]: v for k, v in self.failed_total.items()},
+                'retries': self.retries,
+                'throttled': self.throttles,
+                'avg_latency': self.latency_sum / sent if sent else 0.0,
+                'avg_api_time': self.api_time_sum / sent if sent else 0.0,
+                'latency_buckets': list(zip(self.BUCKETS, self.latency_buckets)),
+            }
@@ -0,0 +1,140 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from journal import write_atomic
+from roster import name_key
+
+logger = logging.getLogger(__name__)
+
+
+class ProfileStore:
+    """Последнее имя, под которым записывался каждый пользователь Telegram.
+    
+    По нему "📝 Записаться" записывает сразу, без вопроса об имени.
+    Занятость имени проверяет только список тренировки: одно имя могут
+    носить разные люди, пока они не в одном списке.
+    
+    * `backend` - где хранить профили (None - только в памяти);
+    * `shared` - с backend работают несколько процессов: профили читаются
+      из backend при каждом обращении, память не используется.
+    """
+    
+    def __init__(self, backend=None, shared=False):
+        if shared and not hasattr(backend, 'get'):
+            raise ValueError("Общим может быть только хранилище профилей в SQLite")
+        self.backend = backend
+        self.shared = shared
+        self.lock = threading.Lock()
+        self._names = {}
+    
+    def load(self):
+        if self.backend is None or self.shared:
+            return
+        with self.lock:
+            for user_id, name in self.backend.load():
+                self._names[user_id] = name
+        if self._names:
+            logger.info(f"👤 Загружено профилей: {len(self._names)}")
+    
+    def get(self, user_id):
+        """Сохраненное имя пользователя или None"""
+        if self.shared:
+            row = self.backend.get(user_id)
+            return row[0] if row else None
+        with self.lock:
+            return self._names.get(user_id)
+    
+    def remember(self, user_id, name, username=''):
+        """Запомнить имя пользователя (запись только если оно изменилось)"""
+        if self.shared:
+            if self.get(user_id) != name:
+                self.backend.save(user_id, name, username)
+            return
+        with self.lock:
+            if self._names.get(user_id) == name:
+                return
+            self._names[user_id] = name
+            if self.backend:
+                self.backend.save(user_id, name, username)
+    
+    def items(self):
+        """Все профили: [(id, имя)]"""
+        if self.shared:
+            return self.backend.load()
+        with self.lock:
+            return list(self._names.items())
+    
+    def __len__(self):
+        if self.shared:
+            return self.backend.count()
+        with self.lock:
+            return len(self._names)
+
+
+# ===== ХРАНЕНИЕ =====
+class JsonFileBackend:
+    """Профили в JSON-файле (перезаписывается только при смене имени)"""
+    
+    def __init__(self, path):
+        self.path = path
+        self._rows = {}
+    
+    def load(self):
+        if not os.path.exists(self.path):
+            return []
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                rows = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Не удалось прочитать {self.path}: {e}")
+            return []
+        self._rows = {row['id']: row for row in rows}
+        return [(row['id'], row['display_name']) for row in rows]
+    
+    def save(self, user_id, name, username):
+        self._rows[user_id] = {'id': user_id, 'display_name': name,
+                               'username': username, 'updated': time.time()}
+        write_atomic(self.path, json.dumps(list(self._rows.values()), ensure_ascii=False))
+
+
+class SqliteBackend:
+    """Профили в таблице SQLite с индексом по имени"""
+    
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS profiles (
+        user_id INTEGER PRIMARY KEY,
+        display_name TEXT NOT NULL,
+        name_norm TEXT NOT NULL,
+        username TEXT,
+        updated REAL NOT NULL
+    );
+    """
+    
+    def __init__(self, db_path):
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None,
+                                    timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(self.SCHEMA)
+    
+    def load(self):
+        return list(self.conn.execute("SELECT user_id, display_name FROM profiles"))
+    
+    def save(self, user_id, name, username):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO profiles (user_id, display_name, name_norm, username, updated) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (user_id, name, name_key(name), username, time.time())
+        )
+    
+    def get(self, user_id):
+        """(имя,) или None - для общего режима"""
+        return self.conn.execute(
+            "SELECT display_name FROM profiles WHERE user_id = ?", (user_id,)
+        ).fetchone()
+    
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM profiles").fetchone()[0]
@@ -0,0 +1,69 @@
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+
+def reminder_stamp(offset, training):
+    """Метка напоминания: смещение + срок тренировки.
+    
+    После смены даты или времени метка другая - напоминание уйдет заново.
+    """
+    return f"{offset:g}@{training['date']} {training['time']}"
+
+
+class Reminders:
+    """Напоминания записанным за `offsets` часов до начала тренировки.
+    
+    На каждую тренировку и смещение - одно событие в Scheduler, а не по
+    событию на участника: получатели берутся из списка в момент
+    срабатывания, доставкой пачками занимается `deliver` (рассылка).
+    Отправленные метки хранятся в самой тренировке ('reminded'), поэтому
+    план после перезапуска восстанавливается из данных через plan().
+    
+    Если срок нескольких напоминаний уже прошел (тренировку создали
+    поздно или бот был выключен), уходит только последнее из них.
+    """
+    
+    def __init__(self, scheduler, tz, offsets, deliver):
+        self.scheduler = scheduler
+        self.tz = tz
+        self.offsets = sorted(offsets, reverse=True)
+        self.deliver = deliver
+    
+    def start_of(self, training):
+        try:
+            start = datetime.strptime(f"{training['date']} {training['time']}", '%Y-%m-%d %H:%M')
+        except ValueError:
+            return None
+        return self.tz.localize(start)
+    
+    def plan(self, training):
+        """(Пере)запланировать напоминания тренировки по ее дате и времени"""
+        training_id = training['id']
+        start = self.start_of(training)
+        now = datetime.fromtimestamp(self.scheduler.clock.now(), self.tz)
+        sent = set(training.get('reminded', []))
+        # Раньше последнего отправленного напоминания ничего не досылаем
+        sent_offsets = [o for o in self.offsets if reminder_stamp(o, training) in sent]
+        last_sent = min(sent_offsets) if sent_offsets else None
+        due = []
+        for offset in self.offsets:
+            key = f"reminder:{training_id}:{offset:g}"
+            stamp = reminder_stamp(offset, training)
+            if start is None or start <= now or (last_sent is not None and offset >= last_sent):
+                self.scheduler.cancel(key)
+                continue
+            due.append((start - timedelta(hours=offset), offset, key, stamp))
+        
+        # Из просроченных оставляем только самое позднее
+        late = [item for item in due if item[0] <= now]
+        for when, offset, key, stamp in late[:-1]:
+            self.scheduler.cancel(key)
+        for when, offset, key, stamp in late[-1:] + [item for item in due if item[0] > now]:
+            self.scheduler.at(max(when, now).timestamp(), self.deliver,
+                              training_id, offset, stamp, key=key)
+    
+    def forget(self, training_id):
+        for offset in self.offsets:
+            self.scheduler.cancel(f"reminder:{training_id}:{offset:g}")
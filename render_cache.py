@@ -0,0 +1,39 @@
+import threading
+
+
+class RenderCache:
+    """Готовые тексты (список, расписание, админ-панель) по версии состояния.
+    
+    `version` - функция, возвращающая текущую версию (store.version и
+    все, от чего еще зависят тексты, например лимиты чата).
+    Пока состояние не менялось, текст берется из кэша; любое изменение
+    повышает версию, и весь кэш сбрасывается при следующем обращении.
+    """
+    
+    def __init__(self, version):
+        self.version = version
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._version = None
+        self._texts = {}
+    
+    def get(self, key, render):
+        """Текст по ключу; при промахе вызывается render() без аргументов"""
+        # Версию читаем до отрисовки: текст не может оказаться старше ключа
+        version = self.version()
+        with self.lock:
+            if version != self._version:
+                self._texts.clear()
+                self._version = version
+            text = self._texts.get(key)
+            if text is not None:
+                self.hits += 1
+                return text
+            self.misses += 1
+        
+        text = render()
+        with self.lock:
+            if self._version == version:
+                self._texts[key] = text
+        return text
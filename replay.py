@@ -0,0 +1,189 @@
+"""Воспроизведение записанного трафика бота (TRAFFIC_FILE) на заглушке.
+
+Бот запускается как в bench.py - в этом же процессе, против
+FakeTelegramApi - с состоянием и профилями из заголовка записи и
+получает записанные обновления в том же порядке: с исходными паузами
+(--speed 1), в N раз быстрее (--speed N) или без пауз (--speed 0).
+
+В конце выводится:
+* разница итоговых списков с записанными при остановке бота;
+* время обработчиков (p50/p95 по корзинам гистограмм, как в /metrics);
+* число вызовов Telegram API в записи и при воспроизведении.
+
+Запуск:
+    python replay.py traffic.jsonl
+    python replay.py traffic.jsonl --speed 10 --storage sqlite
+    python replay.py traffic.jsonl --speed 0 --json new.json --compare old.json
+
+Обновления обрабатывает один рабочий поток (--workers 1): порядок как в
+записи, и повторный запуск дает тот же результат. Группы (TENANTS_DIR)
+и незаконченные диалоги на момент начала записи не воспроизводятся.
+"""
+import argparse
+import difflib
+import json
+import os
+import sys
+import tempfile
+import time
+
+from bench import FakeTelegramApi, start_bot, stop_bot
+from roster import LISTS
+import traffic
+
+
+def roster_lines(state):
+    """Списки тренировок построчно - для сравнения"""
+    lines = []
+    for training in sorted(state['trainings'], key=lambda t: t['id']):
+        lines.append(f"#{training['id']} {training.get('date')} {training.get('time')}")
+        for list_name in LISTS:
+            for number, user in enumerate(training.get(list_name, []), 1):
+                lines.append(f"  {list_name} {number}. {user['display_name']}")
+    return lines
+
+
+def wait_processed(bot_railway, last_update, timeout):
+    """Дождаться, пока бот обработает все обновления до last_update"""
+    deadline = time.monotonic() + timeout
+    while bot_railway.update_log.offset <= last_update:
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def run(args):
+    header, events, end = traffic.read(args.capture)
+    inbound = [event['in'] for event in events if 'in' in event]
+    times = [event['t'] for event in events if 'in' in event]
+    recorded_calls = {}
+    for event in events:
+        if 'out' in event:
+            recorded_calls[event['out']] = recorded_calls.get(event['out'], 0) + 1
+    
+    workdir = tempfile.mkdtemp(prefix='sportbot-replay-')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.environ['POLL_WORKERS'] = str(args.workers)
+    # Воспроизведение само не записывается
+    os.environ.pop('TRAFFIC_FILE', None)
+    api = FakeTelegramApi()
+    api.start()
+    bot_railway = start_bot(api, args, workdir, admin=header['admin'])
+    try:
+        bot_railway.store.apply({'op': 'reset', 'data': header['state']})
+        for user_id, name in header['profiles']:
+            bot_railway.user_profiles.remember(user_id, name)
+        
+        started = time.monotonic()
+        for update, at in zip(inbound, times):
+            if args.speed:
+                delay = at / args.speed - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            api.push(dict(update))
+        # Заглушка нумерует обновления с 1
+        finished = wait_processed(bot_railway, len(inbound), args.timeout)
+        elapsed = time.monotonic() - started
+        final = bot_railway.state_to_json(bot_railway.load_data())
+    finally:
+        stop_bot(bot_railway)
+        api.stop()
+    
+    metrics = bot_railway.metrics
+    results = {
+        'capture': args.capture,
+        'started': header.get('started'),
+        'speed': args.speed,
+        'updates': len(inbound),
+        'finished': finished,
+        'seconds': round(elapsed, 3),
+        'handlers': {
+            name: {'count': count, 'p50_ms': round(p50 * 1000, 1),
+                   'p95_ms': round(p95 * 1000, 1), 'errors': errors}
+            for name, count, p50, p95, errors in metrics.summary('handler', 'handler')
+        },
+        'api_calls': {
+            'recorded': recorded_calls,
+            'replayed': {name: count for name, count, *_ in metrics.summary('api', 'method')},
+        },
+        'diff': None,
+    }
+    if end is not None:
+        results['diff'] = list(difflib.unified_diff(
+            roster_lines(end), roster_lines(final), 'запись', 'воспроизведение', lineterm='', n=1
+        ))
+    return results
+
+
+# ===== ОТЧЕТ =====
+def report(results, baseline=None):
+    speed = f"{results['speed']:g}x" if results['speed'] else "без пауз"
+    lines = [f"Запись: {results['capture']} от {results['started']}, "
+             f"обновлений: {results['updates']}, скорость: {speed}",
+             f"Воспроизведено за {results['seconds']} сек", ""]
+    if not results['finished']:
+        lines.extend(["❌ Не все обновления обработаны за отведенное время", ""])
+    
+    lines.append(f"{'обработчик':<26} {'вызовов':>8} {'p50 мс':>8} {'p95 мс':>8} {'ошибок':>7}")
+    old_handlers = (baseline or {}).get('handlers', {})
+    for name, r in results['handlers'].items():
+        lines.append(f"{name:<26} {r['count']:>8} {r['p50_ms']:>8} {r['p95_ms']:>8} {r['errors']:>7}")
+        old = old_handlers.get(name)
+        if old:
+            diff = ' '.join(f"{key} {old[key]}→{r[key]}"
+                            for key in ('count', 'p95_ms', 'errors') if old.get(key) != r[key])
+            if diff:
+                lines.append(f"{'':<26} было: {diff}")
+    
+    lines.append("")
+    lines.append(f"{'вызов API':<26} {'запись':>8} {'повтор':>8}")
+    calls = results['api_calls']
+    for name in sorted(set(calls['recorded']) | set(calls['replayed'])):
+        lines.append(f"{name:<26} {calls['recorded'].get(name, 0):>8} "
+                     f"{calls['replayed'].get(name, 0):>8}")
+    
+    lines.append("")
+    if results['diff'] is None:
+        lines.append("Итоговых списков в записи нет (бот не был остановлен)")
+    elif results['diff']:
+        lines.append("❌ Итоговые списки отличаются от записанных:")
+        lines.extend(results['diff'])
+    else:
+        lines.append("✅ Итоговые списки совпадают с записанными")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Воспроизведение записанного трафика бота")
+    parser.add_argument('capture', help="файл записи (TRAFFIC_FILE)")
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="во сколько раз быстрее записи, 0 - без пауз")
+    parser.add_argument('--storage', choices=('snapshot', 'journal', 'sqlite'),
+                        default=os.environ.get('STORAGE_MODE', 'snapshot'))
+    parser.add_argument('--workers', type=int, default=1,
+                        help="рабочих потоков бота (больше 1 - порядок не гарантирован)")
+    parser.add_argument('--timeout', type=float, default=60.0,
+                        help="сколько ждать обработки после последнего обновления, сек")
+    parser.add_argument('--json', help="сохранить результаты в JSON")
+    parser.add_argument('--compare', help="JSON прошлого запуска для сравнения")
+    args = parser.parse_args(argv)
+    # Бот работает в отдельной временной папке - пути делаем абсолютными
+    args.capture = os.path.abspath(args.capture)
+    if args.json:
+        args.json = os.path.abspath(args.json)
+    
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    
+    results = run(args)
+    print(report(results, baseline))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+from collections import deque
+
+# Имена списков в JSON-файле данных
+MAIN = 'main'
+MANUAL = 'manual_entries'
+RESERVE = 'reserve'
+LISTS = (MAIN, MANUAL, RESERVE)
+
+
+def name_key(name):
+    """Ключ для сравнения имен без учета регистра"""
+    return name.strip().casefold()
+
+
+class Participant:
+    """Одна запись в списке (формат как в training_data.json)"""
+    
+    __slots__ = ('id', 'display_name', 'username', 'time', 'is_manual', 'extra')
+    
+    def __init__(self, display_name, id=None, username='', time='',
+                 is_manual=False, extra=None):
+        self.id = id
+        self.display_name = display_name
+        self.username = username
+        self.time = time
+        self.is_manual = is_manual
+        # Поля, о которых Roster не знает, сохраняются как есть
+        self.extra = extra
+    
+    @classmethod
+    def from_dict(cls, user):
+        known = {k: user[k] for k in Participant.__slots__[:-1] if k in user}
+        extra = {k: v for k, v in user.items() if k not in known}
+        known.setdefault('display_name', 'Неизвестно')
+        return cls(extra=extra or None, **known)
+    
+    def to_dict(self):
+        user = {}
+        if self.id is not None:
+            user['id'] = self.id
+        user['display_name'] = self.display_name
+        if self.username or not self.is_manual:
+            user['username'] = self.username
+        user['time'] = self.time
+        user['is_manual'] = self.is_manual
+        if self.extra:
+            user.update(self.extra)
+        return user
+    
+    def get(self, field, default=None):
+        """Совместимость с кодом, который работал со словарями"""
+        if field in Participant.__slots__[:-1]:
+            value = getattr(self, field)
+            return default if value is None else value
+        return (self.extra or {}).get(field, default)
+    
+    def __repr__(self):
+        return f"Participant({self.display_name!r}, id={self.id!r})"
+
+
+class Roster:
+    """Список участников одной тренировки с индексами.
+    
+    * main и manual_entries - упорядоченные словари (вставка и удаление
+      за O(1)), снаружи видны как один основной список: сначала main,
+      потом ручные записи - как и раньше в show_list;
+    * reserve - deque, перевод первого из резерва в основной за O(1);
+    * индексы по Telegram id и по имени (casefold) - проверка дубликатов
+      без перебора и без склеивания списков.
+    """
+    
+    __slots__ = ('_lists', '_where', '_by_id', '_by_name')
+    
+    def __init__(self):
+        self._lists = {MAIN: {}, MANUAL: {}, RESERVE: deque()}
+        self._where = {}
+        self._by_id = {}
+        self._by_name = {}
+    
+    # ===== ЧТЕНИЕ =====
+    @property
+    def main(self):
+        """Основной список: main + ручные записи, в порядке отображения"""
+        return list(self._lists[MAIN]) + list(self._lists[MANUAL])
+    
+    @property
+    def reserve(self):
+        return list(self._lists[RESERVE])
+    
+    @property
+    def main_count(self):
+        return len(self._lists[MAIN]) + len(self._lists[MANUAL])
+    
+    @property
+    def reserve_count(self):
+        return len(self._lists[RESERVE])
+    
+    def __len__(self):
+        return len(self._where)
+    
+    def __iter__(self):
+        """Все участники: основной список, затем резерв"""
+        yield from self._lists[MAIN]
+        yield from self._lists[MANUAL]
+        yield from self._lists[RESERVE]
+    
+    def find_id(self, user_id):
+        return self._by_id.get(user_id)
+    
+    def find_name(self, name):
+        return self._by_name.get(name_key(name))
+    
+    def at(self, list_name, index):
+        """Участник по позиции в конкретном списке (или None)"""
+        users = self._lists[list_name]
+        if not 0 <= index < len(users):
+            return None
+        if list_name == RESERVE:
+            return users[index]
+        return list(users)[index]
+    
+    def list_of(self, participant):
+        """В каком списке участник: 'main', 'manual_entries', 'reserve' или None"""
+        return self._where.get(participant)
+    
+    # ===== ИЗМЕНЕНИЯ =====
+    def add(self, participant, list_name):
+        target = self._lists[list_name]
+        if list_name == RESERVE:
+            target.append(participant)
+        else:
+            target[participant] = None
+        self._where[participant] = list_name
+        if participant.id is not None:
+            self._by_id.setdefault(participant.id, participant)
+        self._by_name.setdefault(name_key(participant.display_name), participant)
+        return participant
+    
+    def remove(self, participant):
+        """Удалить участника из его списка, вернуть имя списка"""
+        list_name = self._where.pop(participant, None)
+        if list_name is None:
+            return None
+        if list_name == RESERVE:
+            self._lists[RESERVE].remove(participant)
+        else:
+            del self._lists[list_name][participant]
+        if self._by_id.get(participant.id) is participant:
+            del self._by_id[participant.id]
+        key = name_key(participant.display_name)
+        if self._by_name.get(key) is participant:
+            del self._by_name[key]
+        return list_name
+    
+    def rename(self, participant, name):
+        """Сменить имя участника, место в списке сохраняется"""
+        key = name_key(participant.display_name)
+        if self._by_name.get(key) is participant:
+            del self._by_name[key]
+        participant.display_name = name
+        self._by_name.setdefault(name_key(name), participant)
+        return participant
+    
+    def move(self, participant, list_name):
+        """Перенести участника в конец другого списка"""
+        self.remove(participant)
+        return self.add(participant, list_name)
+    
+    def promote(self):
+        """Перевести первого из резерва в основной список"""
+        if not self._lists[RESERVE]:
+            return None
+        participant = self._lists[RESERVE].popleft()
+        self._lists[MAIN][participant] = None
+        self._where[participant] = MAIN
+        return participant
+    
+    # ===== JSON =====
+    @classmethod
+    def from_json(cls, data):
+        roster = cls()
+        for list_name in LISTS:
+            for user in data.get(list_name, []):
+                roster.add(Participant.from_dict(user), list_name)
+        return roster
+    
+    def to_json(self):
+        return {
+            list_name: [p.to_dict() for p in self._lists[list_name]]
+            for list_name in LISTS
+        }
+
+
+# ===== СОСТОЯНИЕ ТРЕНИРОВКИ =====
+# В памяти: настройки тренировки + data['roster'] (Roster).
+# На диске: прежний формат со списками main / reserve / manual_entries.
+
+def training_from_json(data):
+    data = dict(data)
+    lists = {name: data.pop(name, []) for name in LISTS}
+    data['roster'] = Roster.from_json(lists)
+    return data
+
+
+def training_to_json(data):
+    result = {k: v for k, v in data.items() if k != 'roster'}
+    result.update(data['roster'].to_json())
+    return result
+
+
+# ===== ВСЕ ТРЕНИРОВКИ =====
+# В памяти: {'trainings': {id: тренировка}, 'next_id': n}.
+# На диске: {'trainings': [тренировка, ...], 'next_id': n}. Старый файл с
+# одной тренировкой (main/reserve на верхнем уровне) читается как тренировка 1.
+FIRST_TRAINING_ID = 1
+
+
+def state_from_json(data, normalize=None):
+    if 'trainings' in data:
+        items = data['trainings']
+    else:
+        items = [dict(data, id=data.get('id', FIRST_TRAINING_ID))]
+    
+    trainings = {}
+    for item in items:
+        item = dict(item)
+        if normalize:
+            normalize(item)
+        item['id'] = int(item['id'])
+        trainings[item['id']] = training_from_json(item)
+    
+    next_id = max(data.get('next_id', FIRST_TRAINING_ID), max(trainings, default=0) + 1)
+    return {'trainings': trainings, 'next_id': next_id}
+
+
+def state_to_json(state):
+    return {
+        'trainings': [training_to_json(t) for t in state['trainings'].values()],
+        'next_id': state['next_id'],
+    }
+
+
+def apply_op(state, op):
+    """Применить операцию журнала к состоянию (кроме 'reset')"""
+    kind = op['op']
+    trainings = state['trainings']
+    
+    if kind == 'create':
+        training = training_from_json(dict(op['data'], id=op['training']))
+        trainings[op['training']] = training
+        state['next_id'] = max(state['next_id'], op['training'] + 1)
+        return training
+    
+    if kind == 'drop':
+        return trainings.pop(op['training'], None)
+    
+    # Записи журнала до появления нескольких тренировок - про первую
+    training_id = op.get('training', min(trainings, default=None))
+    training = trainings.get(training_id)
+    if training is None:
+        return None
+    return apply_training_op(training, op)
+
+
+def apply_training_op(data, op):
+    kind = op['op']
+    roster = data['roster']
+    
+    if kind in ('join', 'manual_add'):
+        # Новый участник в конец списка: main, manual_entries или reserve
+        return roster.add(Participant.from_dict(op['user']), op['list'])
+    
+    if kind == 'cancel':
+        # Участник сам отменил запись - ищем по Telegram id
+        participant = roster.find_id(op['id'])
+        if participant is not None:
+            roster.remove(participant)
+        return participant
+    
+    if kind == 'promote':
+        return roster.promote()
+    
+    if kind == 'rename':
+        # Участник сменил имя - ищем по Telegram id
+        participant = roster.find_id(op['id'])
+        if participant is not None:
+            roster.rename(participant, op['name'])
+        return participant
+    
+    if kind == 'remove':
+        # Админ удалил участника по имени (старые записи журнала - по позиции)
+        if 'name' in op:
+            participant = roster.find_name(op['name'])
+        else:
+            participant = roster.at(op['list'], op['index'])
+        if participant is not None:
+            roster.remove(participant)
+        return participant
+    
+    if kind == 'move':
+        # Админ перенес участника между основным списком и резервом
+        participant = roster.find_name(op['name'])
+        if participant is not None:
+            roster.move(participant, op['list'])
+        return participant
+    
+    if kind == 'batch':
+        # Несколько изменений админа одной операцией (одна запись на диск)
+        return [apply_training_op(data, sub) for sub in op['ops']]
+    
+    if kind == 'settings':
+        data.update(op['values'])
+        return op['values']
+    
+    raise ValueError(f"Неизвестная операция: {kind}")
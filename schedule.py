@@ -0,0 +1,166 @@
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = ('Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье')
+
+
+class Slot:
+    """Регулярная тренировка из расписания.
+    
+    * `weekday` - день недели (0 - понедельник) или его название;
+    * `time` - начало, 'ЧЧ:ММ' по часовому поясу расписания;
+    * `max_main` / `max_reserve` - лимиты (None - общие лимиты бота);
+    * `open_before` - за сколько часов до начала создать тренировку и
+      открыть запись;
+    * `close_before` - за сколько часов до начала закрыть запись;
+    * `archive_after` - через сколько часов после начала отправить список
+      в архив.
+    """
+    
+    def __init__(self, weekday, time, place, max_main=None, max_reserve=None,
+                 open_before=48.0, close_before=0.0, archive_after=3.0, key=None):
+        if isinstance(weekday, str):
+            weekday = [d.lower() for d in WEEKDAYS].index(weekday.lower())
+        if not 0 <= weekday <= 6:
+            raise ValueError(f"Неверный день недели: {weekday}")
+        self.weekday = weekday
+        self.time = datetime.strptime(time, '%H:%M').strftime('%H:%M')
+        self.place = place
+        self.max_main = max_main
+        self.max_reserve = max_reserve
+        self.open_before = timedelta(hours=open_before)
+        self.close_before = timedelta(hours=close_before)
+        self.archive_after = timedelta(hours=archive_after)
+        if self.close_before > self.open_before:
+            raise ValueError("Запись закрывается раньше, чем открывается")
+        self.key = key or f"{weekday}-{self.time}"
+    
+    @classmethod
+    def from_json(cls, data):
+        return cls(**data)
+    
+    def limits(self):
+        """Лимиты слота для записи в тренировку (только заданные)"""
+        limits = {}
+        if self.max_main is not None:
+            limits['max_main'] = self.max_main
+        if self.max_reserve is not None:
+            limits['max_reserve'] = self.max_reserve
+        return limits
+    
+    def describe(self):
+        return f"{WEEKDAYS[self.weekday]}: {self.time} ({self.place})"
+    
+    def next_start(self, after, tz):
+        """Ближайшее начало строго позже `after` (aware datetime)"""
+        hour, minute = map(int, self.time.split(':'))
+        day = after.astimezone(tz).date()
+        day += timedelta(days=(self.weekday - day.weekday()) % 7)
+        while True:
+            start = tz.localize(datetime(day.year, day.month, day.day, hour, minute))
+            if start > after:
+                return start
+            day += timedelta(days=7)
+    
+    def occurrence(self, start):
+        """Метка конкретной тренировки слота (хранится в самой тренировке)"""
+        return f"{self.key}/{start.strftime('%Y-%m-%d')}"
+
+
+def load_slots(path, default):
+    """Расписание из JSON-файла (список слотов), без файла - `default`"""
+    rows = default
+    if path and os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            rows = json.load(f)
+    slots = [Slot.from_json(row) for row in rows]
+    keys = [slot.key for slot in slots]
+    if len(set(keys)) != len(keys):
+        raise ValueError(f"Повторяются ключи слотов: {keys}")
+    return slots
+
+
+class RecurringSchedule:
+    """Автоматическая смена тренировок по расписанию.
+    
+    Для каждого слота планируется ближайшее занятие и три события в
+    Scheduler: создание тренировки с открытием записи, закрытие записи,
+    архивация списка. При создании планируется следующее занятие слота.
+    
+    Действия с данными передаются функциями, поэтому расписание не знает
+    о хранилище:
+    
+    * `find(occurrence)` - id тренировки с этой меткой или None;
+    * `archived(occurrence)` - тренировка уже в архиве (не создавать снова);
+    * `create(slot, start, occurrence, registration_open)`;
+    * `set_open(training_id, value)`;
+    * `archive(training_id)`.
+    
+    После перезапуска пропущенные события (срок в прошлом) выполняются
+    сразу, все действия идемпотентны.
+    """
+    
+    def __init__(self, slots, scheduler, tz, find, archived, create, set_open, archive):
+        self.slots = slots
+        self.scheduler = scheduler
+        self.tz = tz
+        self.find = find
+        self.archived = archived
+        self.create = create
+        self.set_open = set_open
+        self.archive = archive
+    
+    def now(self):
+        return datetime.fromtimestamp(self.scheduler.clock.now(), self.tz)
+    
+    def start(self):
+        """Запланировать текущие занятия всех слотов"""
+        now = self.now()
+        for slot in self.slots:
+            # Занятие, которое еще не ушло в архив, или следующее
+            self._plan(slot, now - slot.archive_after)
+    
+    def _plan(self, slot, after):
+        start = slot.next_start(after, self.tz)
+        occurrence = slot.occurrence(start)
+        at = self.scheduler.at
+        at((start - slot.open_before).timestamp(), self._create, slot, start,
+           key=f"{occurrence}:create")
+        at((start - slot.close_before).timestamp(), self._close, occurrence,
+           key=f"{occurrence}:close")
+        at((start + slot.archive_after).timestamp(), self._archive, occurrence,
+           key=f"{occurrence}:archive")
+        logger.info(f"📆 Запланировано: {slot.describe()} {start.strftime('%Y-%m-%d')}")
+    
+    # ===== СОБЫТИЯ =====
+    def _create(self, slot, start):
+        occurrence = slot.occurrence(start)
+        try:
+            if self.find(occurrence) is None and not self.archived(occurrence):
+                registration_open = self.now() < start - slot.close_before
+                self.create(slot, start, occurrence, registration_open)
+                logger.info(f"📆 Создана тренировка {occurrence}")
+        finally:
+            self._plan(slot, start)
+    
+    def _close(self, occurrence):
+        training_id = self.find(occurrence)
+        if training_id is not None:
+            self.set_open(training_id, False)
+            logger.info(f"📆 Запись закрыта: {occurrence}")
+    
+    def _archive(self, occurrence):
+        training_id = self.find(occurrence)
+        if training_id is not None:
+            self.archive(training_id)
+            logger.info(f"📆 В архиве: {occurrence}")
+    
+    def upcoming(self):
+        """Ближайшее начало каждого слота: [(slot, start), ...] по времени"""
+        now = self.now()
+        return sorted(((slot, slot.next_start(now, self.tz)) for slot in self.slots),
+                      key=lambda item: item[1])
@@ -0,0 +1,159 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class SystemClock:
+    """Настоящее время (секунды epoch)"""
+    
+    def now(self):
+        return time.time()
+
+
+class FakeClock:
+    """Ручные часы для проверок: время идет только через advance()"""
+    
+    def __init__(self, start=0.0):
+        self._now = float(start)
+    
+    def now(self):
+        return self._now
+    
+    def advance(self, seconds):
+        self._now += seconds
+        return self._now
+    
+    def set(self, when):
+        self._now = float(when)
+
+
+class Scheduler:
+    """Отложенные действия на min-heap по времени срабатывания.
+    
+    Фоновый поток спит до ближайшего срока (Condition.wait с таймаутом),
+    а не опрашивает очередь; новое событие раньше ближайшего будит его.
+    У события может быть ключ: повторный at() с тем же ключом заменяет
+    старое событие, cancel(key) отменяет его. Отмененные записи остаются
+    в куче и пропускаются при извлечении.
+    
+    С FakeClock поток не запускают: проверка сама двигает часы и
+    вызывает run_pending().
+    """
+    
+    def __init__(self, clock=None):
+        self.clock = clock or SystemClock()
+        self._heap = []
+        self._keys = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+        self.executed = 0
+    
+    # ===== СОБЫТИЯ =====
+    def at(self, when, callback, *args, key=None):
+        """Выполнить callback(*args) в момент `when` (секунды epoch)"""
+        entry = [when, next(self._seq), callback, args, key, False]
+        with self._cond:
+            if key is not None:
+                old = self._keys.pop(key, None)
+                if old is not None:
+                    old[-1] = True
+                self._keys[key] = entry
+            heapq.heappush(self._heap, entry)
+            if self._heap[0] is entry:
+                self._cond.notify()
+        return entry
+    
+    def after(self, seconds, callback, *args, key=None):
+        return self.at(self.clock.now() + seconds, callback, *args, key=key)
+    
+    def cancel(self, key):
+        with self._cond:
+            entry = self._keys.pop(key, None)
+            if entry is not None:
+                entry[-1] = True
+            return entry is not None
+    
+    def has(self, key):
+        with self._cond:
+            return key in self._keys
+    
+    def when(self, key):
+        with self._cond:
+            entry = self._keys.get(key)
+            return entry[0] if entry is not None else None
+    
+    def next_deadline(self):
+        with self._cond:
+            self._skip_cancelled()
+            return self._heap[0][0] if self._heap else None
+    
+    def __len__(self):
+        with self._cond:
+            return sum(1 for entry in self._heap if not entry[-1])
+    
+    def _skip_cancelled(self):
+        while self._heap and self._heap[0][-1]:
+            heapq.heappop(self._heap)
+    
+    def _pop_due(self, now):
+        self._skip_cancelled()
+        if not self._heap or self._heap[0][0] > now:
+            return None
+        entry = heapq.heappop(self._heap)
+        if entry[4] is not None:
+            self._keys.pop(entry[4], None)
+        return entry
+    
+    # ===== ВЫПОЛНЕНИЕ =====
+    def run_pending(self):
+        """Выполнить все события, срок которых наступил; вернуть их число.
+        
+        Событие, добавленное из callback со сроком в прошлом, тоже
+        выполняется в этом же вызове.
+        """
+        count = 0
+        while True:
+            with self._cond:
+                entry = self._pop_due(self.clock.now())
+            if entry is None:
+                return count
+            when, _, callback, args, key, _ = entry
+            try:
+                callback(*args)
+            except Exception as e:
+                logger.error(f"Ошибка события {key or callback.__name__}: {e}")
+            count += 1
+            self.executed += 1
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    self._skip_cancelled()
+                    if self._heap:
+                        delay = self._heap[0][0] - self.clock.now()
+                        if delay <= 0:
+                            break
+                        self._cond.wait(delay)
+                    else:
+                        self._cond.wait()
+                if self._stopped:
+                    return
+            self.run_pending()
+    
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='scheduler', daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join()
@@ -0,0 +1,407 @@
+import json
+import logging
+import sqlite3
+from contextlib import contextmanager
+
+from roster import LISTS, MAIN, MANUAL, RESERVE, name_key, training_to_json
+from state_store import StateStore
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS trainings (
+    id INTEGER PRIMARY KEY,
+    date TEXT NOT NULL,
+    time TEXT NOT NULL,
+    place TEXT NOT NULL,
+    registration_open INTEGER NOT NULL,
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS participants (
+    training_id INTEGER NOT NULL,
+    pos INTEGER NOT NULL,
+    list TEXT NOT NULL,
+    user_id INTEGER,
+    display_name TEXT NOT NULL,
+    name_norm TEXT NOT NULL,
+    username TEXT,
+    time TEXT,
+    is_manual INTEGER NOT NULL,
+    extra TEXT,
+    PRIMARY KEY (training_id, pos)
+);
+CREATE INDEX IF NOT EXISTS idx_participants_list ON participants (training_id, list, pos);
+CREATE INDEX IF NOT EXISTS idx_participants_user ON participants (training_id, user_id);
+CREATE INDEX IF NOT EXISTS idx_participants_name ON participants (training_id, name_norm);
+CREATE INDEX IF NOT EXISTS idx_participants_user_all ON participants (user_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS updates (
+    update_id INTEGER PRIMARY KEY
+);
+"""
+
+# Колонки таблицы trainings, остальные настройки лежат в extra (JSON)
+TRAINING_COLUMNS = ('date', 'time', 'place', 'registration_open')
+
+# Порядок списков такой же, как при чтении в Roster
+LIST_ORDER = f"CASE list WHEN '{MAIN}' THEN 0 WHEN '{MANUAL}' THEN 1 ELSE 2 END"
+
+# Все запросы - константы с параметрами: sqlite3 кэширует подготовленные
+# выражения по тексту запроса, поэтому каждый из них компилируется один раз
+SQL_INSERT_TRAINING = (
+    "INSERT OR REPLACE INTO trainings (id, date, time, place, registration_open, extra) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+SQL_INSERT_PARTICIPANT = (
+    "INSERT INTO participants (training_id, pos, list, user_id, display_name, name_norm, "
+    "username, time, is_manual, extra) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+SQL_NEXT_POS = "SELECT COALESCE(MAX(pos), 0) + 1 FROM participants WHERE training_id = ?"
+SQL_CANCEL = "DELETE FROM participants WHERE training_id = ? AND user_id = ?"
+SQL_FIRST_RESERVE = (
+    "SELECT pos FROM participants WHERE training_id = ? AND list = ? ORDER BY pos LIMIT 1"
+)
+SQL_MOVE = "UPDATE participants SET list = ?, pos = ? WHERE training_id = ? AND pos = ?"
+SQL_FIND_NAME = (
+    f"SELECT pos FROM participants WHERE training_id = ? AND name_norm = ? "
+    f"ORDER BY {LIST_ORDER}, pos LIMIT 1"
+)
+SQL_NTH_IN_LIST = (
+    "SELECT pos FROM participants WHERE training_id = ? AND list = ? "
+    "ORDER BY pos LIMIT 1 OFFSET ?"
+)
+SQL_RENAME = (
+    "UPDATE participants SET display_name = ?, name_norm = ? WHERE training_id = ? AND user_id = ?"
+)
+SQL_DELETE_POS = "DELETE FROM participants WHERE training_id = ? AND pos = ?"
+SQL_SELECT_TRAINING = "SELECT date, time, place, registration_open, extra FROM trainings WHERE id = ?"
+SQL_UPDATE_EXTRA = "UPDATE trainings SET extra = ? WHERE id = ?"
+SQL_FIND_USER = (
+    "SELECT list, display_name FROM participants WHERE training_id = ? AND user_id = ?"
+)
+SQL_ROSTER = (
+    "SELECT list, user_id, display_name, username, time, is_manual, extra "
+    f"FROM participants WHERE training_id = ? ORDER BY {LIST_ORDER}, pos"
+)
+SQL_ADD_UPDATE = "INSERT OR IGNORE INTO updates (update_id) VALUES (?)"
+SQL_RECENT_UPDATES = (
+    "SELECT update_id FROM (SELECT update_id FROM updates ORDER BY update_id DESC LIMIT ?) "
+    "ORDER BY update_id"
+)
+SQL_TRIM_UPDATES = (
+    "DELETE FROM updates WHERE update_id NOT IN "
+    "(SELECT update_id FROM updates ORDER BY update_id DESC LIMIT ?)"
+)
+SQL_SET_META = "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)"
+SQL_GET_META = "SELECT value FROM meta WHERE key = ?"
+
+
+class SqliteStore(StateStore):
+    """Хранилище в SQLite: несколько тренировок и их списки.
+    
+    Работа с памятью та же, что у StateStore (чтение без обращения к
+    диску, изменения через apply), но каждая операция сразу сохраняется
+    одной короткой транзакцией по индексам, без перезаписи всего состояния.
+    
+    При первом запуске на пустой базе данные переносятся из JSON-файла
+    `import_path`, если он есть.
+    
+    `shared=True` - с базой работают несколько процессов бота. Каждая
+    команда выполняется внутри transaction(): BEGIN IMMEDIATE берет
+    блокировку записи базы, и если другой процесс успел что-то записать
+    (PRAGMA data_version + счетчик revision в meta), состояние в памяти
+    сначала перечитывается. Так проверка лимитов и запись в список
+    остаются одним целым для всех процессов. Чтение вызывает refresh() -
+    один легкий запрос, если база не менялась.
+    """
+    
+    def __init__(self, db_path, default_factory, decode=None, encode=None, import_path=None,
+                 shared=False):
+        super().__init__(import_path or db_path, default_factory, decode=decode, encode=encode)
+        self.db_path = db_path
+        self.import_path = import_path
+        self.shared = shared
+        self.reloads = 0
+        self._tx_depth = 0
+        self._revision = 0
+        self._data_version = None
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None,
+                                    timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+    
+    # ===== ЧТЕНИЕ =====
+    def _read(self):
+        if self._meta('initialized') is None:
+            # Пустая база: переносим данные из JSON-файла
+            if self.import_path:
+                data = super()._read()
+                if data is not None:
+                    logger.info(f"Данные перенесены из {self.import_path} в {self.db_path}")
+                    self._needs_import = True
+                    return data
+            return None
+        
+        trainings = []
+        for row in self.conn.execute("SELECT id FROM trainings ORDER BY id"):
+            trainings.append(self.read_training(row[0]))
+        next_id = self._meta('next_id')
+        return {'trainings': trainings, 'next_id': int(next_id) if next_id else 1}
+    
+    def read_training(self, training_id):
+        """Тренировка с ее списком в формате JSON (по индексу, без чтения остальных)"""
+        row = self.conn.execute(SQL_SELECT_TRAINING, (training_id,)).fetchone()
+        if row is None:
+            return None
+        date, time_, place, registration_open, extra = row
+        training = json.loads(extra) if extra else {}
+        training.update({
+            'id': training_id,
+            'date': date,
+            'time': time_,
+            'place': place,
+            'registration_open': bool(registration_open),
+        })
+        training.update(self.read_roster(training_id))
+        return training
+    
+    def read_roster(self, training_id):
+        """Список тренировки X в формате JSON (main / reserve / manual_entries)"""
+        lists = {name: [] for name in LISTS}
+        for list_name, user_id, name, username, time_, is_manual, extra in \
+                self.conn.execute(SQL_ROSTER, (training_id,)):
+            user = json.loads(extra) if extra else {}
+            if user_id is not None:
+                user['id'] = user_id
+            user['display_name'] = name
+            if username is not None:
+                user['username'] = username
+            user['time'] = time_ or ''
+            user['is_manual'] = bool(is_manual)
+            lists[list_name].append(user)
+        return lists
+    
+    def find_user(self, training_id, user_id):
+        """Записан ли пользователь на тренировку: (список, имя) или None"""
+        return self.conn.execute(SQL_FIND_USER, (training_id, user_id)).fetchone()
+    
+    def load(self):
+        self._needs_import = False
+        with self.lock:
+            self._data_version = self._pragma_data_version()
+            self._revision = int(self._meta('revision') or 0)
+            data = super().load()
+            self._load_updates()
+            if self._needs_import:
+                self._persist({'op': 'reset', 'data': self.encode(data)})
+        return data
+    
+    # ===== НЕСКОЛЬКО ПРОЦЕССОВ =====
+    def _pragma_data_version(self):
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+    
+    def _refresh_locked(self):
+        """Перечитать состояние, если его изменил другой процесс (под self.lock)"""
+        data_version = self._pragma_data_version()
+        if data_version == self._data_version:
+            return False
+        self._data_version = data_version
+        # data_version меняют и чужие записи в других таблицах (диалоги)
+        revision = int(self._meta('revision') or 0)
+        if revision == self._revision:
+            return False
+        self._reload(revision)
+        return True
+    
+    def _reload(self, revision):
+        fresh = self.decode(self._read())
+        # Подменяем ключи по одному: читатели без блокировки видят либо
+        # старый, либо новый словарь тренировок, но не пустой
+        for key, value in fresh.items():
+            self._data[key] = value
+        self._revision = revision
+        self._load_updates()
+        self.version += 1
+        self.reloads += 1
+    
+    def _load_updates(self):
+        for update_id, in self.conn.execute(SQL_RECENT_UPDATES, (self.keep_updates,)):
+            self._remember_update(update_id)
+    
+    @property
+    def durable_version(self):
+        # Каждая операция записывается сразу
+        return self.version
+    
+    def apply(self, op):
+        # Сначала транзакция (и свежее состояние), потом изменение в памяти
+        with self.transaction():
+            return super().apply(op)
+    
+    def refresh(self):
+        """Подхватить изменения других процессов; True - состояние перечитано"""
+        if not self.shared or self._data is None:
+            return False
+        with self.lock:
+            if self._tx_depth:
+                return False
+            return self._refresh_locked()
+    
+    @contextmanager
+    def transaction(self):
+        """Команда целиком - одна транзакция базы (вложенные вызовы - в ней же)"""
+        with self.lock:
+            if self._tx_depth:
+                self._tx_depth += 1
+                try:
+                    yield
+                finally:
+                    self._tx_depth -= 1
+                return
+            
+            self.conn.execute("BEGIN IMMEDIATE")
+            self._tx_depth = 1
+            try:
+                if self.shared and self._data is not None:
+                    self._refresh_locked()
+                yield
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                # Память могла уйти вперед базы - перечитываем
+                if self._data is not None:
+                    self._reload(int(self._meta('revision') or 0))
+                raise
+            finally:
+                self._tx_depth = 0
+    
+    # ===== ЗАПИСЬ =====
+    def _meta(self, key):
+        row = self.conn.execute(SQL_GET_META, (key,)).fetchone()
+        return row[0] if row else None
+    
+    def _persist(self, op):
+        kind = op['op']
+        training_id = op.get('training')
+        if training_id is None and kind not in ('reset',):
+            training_id = min(self._data['trainings'], default=None)
+        
+        cur = self.conn.cursor()
+        with self.transaction():
+            if kind == 'reset':
+                self._write_all(cur)
+            elif kind == 'create':
+                self._write_training(cur, training_to_json(self._data['trainings'][training_id]))
+            elif kind == 'drop':
+                cur.execute("DELETE FROM participants WHERE training_id = ?", (training_id,))
+                cur.execute("DELETE FROM trainings WHERE id = ?", (training_id,))
+            elif kind == 'batch':
+                for sub in op['ops']:
+                    self._persist_training_op(cur, training_id, sub)
+                    if sub.get('update') is not None:
+                        cur.execute(SQL_ADD_UPDATE, (sub['update'],))
+            else:
+                self._persist_training_op(cur, training_id, op)
+            if op.get('update') is not None:
+                cur.execute(SQL_ADD_UPDATE, (op['update'],))
+                if self.writes % 100 == 0:
+                    cur.execute(SQL_TRIM_UPDATES, (self.keep_updates,))
+            cur.execute(SQL_SET_META, ('next_id', str(self._data['next_id'])))
+            self._revision += 1
+            cur.execute(SQL_SET_META, ('revision', str(self._revision)))
+        self.writes += 1
+    
+    def _persist_training_op(self, cur, training_id, op):
+        kind = op['op']
+        if kind in ('join', 'manual_add'):
+            pos = cur.execute(SQL_NEXT_POS, (training_id,)).fetchone()[0]
+            self._insert_participant(cur, training_id, pos, op['list'], op['user'])
+        elif kind == 'cancel':
+            cur.execute(SQL_CANCEL, (training_id, op['id']))
+        elif kind == 'promote':
+            row = cur.execute(SQL_FIRST_RESERVE, (training_id, RESERVE)).fetchone()
+            if row:
+                pos = cur.execute(SQL_NEXT_POS, (training_id,)).fetchone()[0]
+                cur.execute(SQL_MOVE, (MAIN, pos, training_id, row[0]))
+        elif kind == 'remove':
+            if 'name' in op:
+                row = cur.execute(SQL_FIND_NAME, (training_id, name_key(op['name']))).fetchone()
+            else:
+                row = cur.execute(SQL_NTH_IN_LIST, (training_id, op['list'], op['index'])).fetchone()
+            if row:
+                cur.execute(SQL_DELETE_POS, (training_id, row[0]))
+        elif kind == 'move':
+            row = cur.execute(SQL_FIND_NAME, (training_id, name_key(op['name']))).fetchone()
+            if row:
+                pos = cur.execute(SQL_NEXT_POS, (training_id,)).fetchone()[0]
+                cur.execute(SQL_MOVE, (op['list'], pos, training_id, row[0]))
+        elif kind == 'rename':
+            cur.execute(SQL_RENAME, (op['name'], name_key(op['name']), training_id, op['id']))
+        elif kind == 'settings':
+            self._update_settings(cur, training_id, op['values'])
+        else:
+            raise ValueError(f"Неизвестная операция: {kind}")
+    
+    def _write_all(self, cur):
+        cur.execute("DELETE FROM participants")
+        cur.execute("DELETE FROM trainings")
+        for training in self.encode(self._data)['trainings']:
+            self._write_training(cur, training)
+        cur.execute(SQL_SET_META, ('initialized', '1'))
+    
+    def _write_training(self, cur, training):
+        extra = {k: v for k, v in training.items()
+                 if k not in TRAINING_COLUMNS and k != 'id' and k not in LISTS}
+        cur.execute(SQL_INSERT_TRAINING, (
+            training['id'], training['date'], training['time'], training['place'],
+            int(bool(training['registration_open'])),
+            json.dumps(extra, ensure_ascii=False) if extra else None,
+        ))
+        cur.execute("DELETE FROM participants WHERE training_id = ?", (training['id'],))
+        pos = 0
+        for list_name in LISTS:
+            for user in training.get(list_name, []):
+                pos += 1
+                self._insert_participant(cur, training['id'], pos, list_name, user)
+    
+    def _insert_participant(self, cur, training_id, pos, list_name, user):
+        extra = {k: v for k, v in user.items()
+                 if k not in ('id', 'display_name', 'username', 'time', 'is_manual')}
+        cur.execute(SQL_INSERT_PARTICIPANT, (
+            training_id, pos, list_name, user.get('id'),
+            user['display_name'], name_key(user['display_name']),
+            user.get('username'), user.get('time', ''), int(bool(user.get('is_manual'))),
+            json.dumps(extra, ensure_ascii=False) if extra else None,
+        ))
+    
+    def _update_settings(self, cur, training_id, values):
+        for key, value in values.items():
+            if key in TRAINING_COLUMNS:
+                if key == 'registration_open':
+                    value = int(bool(value))
+                # Имя колонки из белого списка TRAINING_COLUMNS
+                cur.execute(f"UPDATE trainings SET {key} = ? WHERE id = ?", (value, training_id))
+        extra_values = {k: v for k, v in values.items() if k not in TRAINING_COLUMNS}
+        if extra_values:
+            row = cur.execute(SQL_SELECT_TRAINING, (training_id,)).fetchone()
+            extra = json.loads(row[4]) if row and row[4] else {}
+            extra.update(extra_values)
+            cur.execute(SQL_UPDATE_EXTRA, (json.dumps(extra, ensure_ascii=False), training_id))
+    
+    def flush(self):
+        # Каждая операция уже зафиксирована своей транзакцией
+        pass
+    
+    def start(self):
+        pass
+    
+    def close(self):
+        with self.lock:
+            if self._closed:
+                return
+            self._closed = True
+            self.conn.close()
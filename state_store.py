@@ -0,0 +1,344 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from journal import Journal, Compactor, write_atomic
+from roster import apply_op
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_SEQ_KEY = '_seq'
+# Id обновлений Telegram, изменения от которых уже в снимке
+UPDATES_KEY = '_updates'
+
+
+class StateStore:
+    """Состояние тренировок в памяти, хранение в JSON-файле.
+    
+    Файл читается один раз при старте, дальше все обработчики работают
+    с одним и тем же объектом. `decode` превращает JSON из файла в
+    состояние в памяти, `encode` - обратно. Изменения проходят через
+    apply() (см. roster.apply_op) и
+    сохраняются одним из двух способов:
+    
+    * snapshot - отложенная запись всего файла: серия изменений подряд
+      превращается в одну запись;
+    * journal  - каждая операция дописывается в журнал и fsync-ается,
+      а в фоне журнал сворачивается в снимок.
+    
+    Другие хранилища (см. sqlite_store.py) наследуют работу с памятью и
+    переопределяют только чтение (_read) и запись (_persist, flush).
+    
+    Операция, выполненная внутри for_update(update_id), сохраняется
+    вместе с id обновления Telegram (в журнале, в снимке, в базе).
+    has_update() после перезапуска отвечает, применено ли уже изменение
+    от повторно доставленного обновления; помнятся последние
+    `keep_updates` id.
+    """
+    
+    def __init__(self, path, default_factory, decode=None, encode=None,
+                 flush_delay=0.5, max_delay=3.0,
+                 journal_path=None, compact_records=500, compact_interval=60.0,
+                 keep_updates=1000):
+        self.path = path
+        self.default_factory = default_factory
+        self.decode = decode or (lambda data: data)
+        self.encode = encode or (lambda data: data)
+        self.lock = threading.RLock()
+        # Свертка целиком (снимок -> замена файла -> удаление журнала) -
+        # по одной: flush из обработчиков и Compactor не перемешиваются
+        self._compact_lock = threading.Lock()
+        self.writes = 0
+        # Растет при каждом изменении состояния (ключ кэша готовых текстов)
+        self.version = 0
+        self._data = None
+        self.keep_updates = keep_updates
+        self._updates = OrderedDict()
+        self._context = threading.local()
+        self._saved_version = 0
+        self._closed = False
+        self._flusher = WriteBehindFlusher(self, flush_delay, max_delay)
+        self.journal = Journal(journal_path) if journal_path else None
+        self._compactor = (
+            Compactor(self, compact_records, compact_interval) if self.journal else None
+        )
+    
+    # ===== ЧТЕНИЕ =====
+    def _read(self):
+        """Прочитать сохраненное состояние (JSON) или None"""
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки: {e}")
+        return None
+    
+    def load(self):
+        """Прочитать снимок и хвост журнала (один раз при старте)"""
+        data = self._read()
+        
+        with self.lock:
+            fresh = data is None
+            if fresh:
+                data = self.default_factory()
+            snapshot_seq = data.pop(SNAPSHOT_SEQ_KEY, 0)
+            for update_id in data.pop(UPDATES_KEY, []):
+                self._remember_update(update_id)
+            data = self.decode(data)
+            
+            if self.journal:
+                self.journal.seq = snapshot_seq
+                replayed = 0
+                for record in self.journal.records(after_seq=snapshot_seq):
+                    self._apply_op(data, record)
+                    replayed += 1
+                    fresh = False
+                if replayed:
+                    logger.info(f"Из журнала восстановлено операций: {replayed}")
+                self.journal.pending = replayed
+                self.journal.open()
+            
+            self._data = data
+            self.version += 1
+            self._saved_version = self.version
+            if fresh:
+                self._persist({'op': 'reset', 'data': self.encode(data)})
+        return self._data
+    
+    @property
+    def data(self):
+        if self._data is None:
+            self.load()
+        return self._data
+    
+    # ===== ИЗМЕНЕНИЯ =====
+    def _apply_op(self, data, op):
+        if op.get('update') is not None:
+            self._remember_update(op['update'])
+        if op['op'] == 'batch':
+            # В пачке записей у каждой свое обновление
+            for sub in op['ops']:
+                if sub.get('update') is not None:
+                    self._remember_update(sub['update'])
+        if op['op'] == 'reset':
+            # Замена состояния целиком: объект data остается тем же,
+            # чтобы ссылки из обработчиков не устаревали
+            fresh = self.decode(json.loads(json.dumps(op['data'])))
+            data.clear()
+            data.update(fresh)
+            return data
+        return apply_op(data, op)
+    
+    def apply(self, op):
+        """Применить операцию к состоянию и сохранить ее"""
+        update_id = getattr(self._context, 'update', None)
+        if update_id is not None and 'update' not in op:
+            op = dict(op, update=update_id)
+        with self.lock:
+            result = self._apply_op(self.data, op)
+            self.version += 1
+            self._persist(op)
+        applied = getattr(self._context, 'applied', None)
+        if applied is not None:
+            applied.append((op, result))
+        return result
+    
+    @contextmanager
+    def transaction(self):
+        """Выполнить команду целиком как одно изменение.
+        
+        Один процесс: команды и так идут по одной через CommandQueue, здесь
+        делать нечего. SqliteStore с shared=True блокирует базу для
+        остальных процессов.
+        """
+        yield
+    
+    def refresh(self):
+        """Подхватить изменения других процессов (у файла их нет)"""
+        return False
+    
+    @contextmanager
+    def recording(self):
+        """Список (операция, результат) изменений в этом блоке (в этом потоке)"""
+        previous = getattr(self._context, 'applied', None)
+        applied = self._context.applied = []
+        try:
+            yield applied
+        finally:
+            self._context.applied = previous
+    
+    # ===== ОБНОВЛЕНИЯ TELEGRAM =====
+    @contextmanager
+    def for_update(self, update_id):
+        """Операции в этом блоке (в этом потоке) - от обновления update_id"""
+        previous = getattr(self._context, 'update', None)
+        self._context.update = update_id
+        try:
+            yield
+        finally:
+            self._context.update = previous
+    
+    def has_update(self, update_id):
+        """Изменение от этого обновления уже применено"""
+        return update_id in self._updates
+    
+    @property
+    def durable_version(self):
+        """Версия состояния, которая уже на диске"""
+        return self.version if self.journal else self._saved_version
+    
+    def _remember_update(self, update_id):
+        self._updates[update_id] = None
+        while len(self._updates) > self.keep_updates:
+            self._updates.popitem(last=False)
+    
+    def _persist(self, op):
+        """Сохранить примененную операцию (вызывается под self.lock)"""
+        if self.journal:
+            self.journal.append(op)
+            self.writes += 1
+            self._compactor.notify(self.journal.pending)
+        else:
+            self.mark_dirty()
+    
+    def mark_dirty(self):
+        """Данные изменились - запись произойдет в фоне"""
+        if self.journal:
+            # В журнале этого изменения нет - нужен новый снимок
+            self._compactor.request()
+        else:
+            self._flusher.notify()
+    
+    def replace(self, data):
+        """Полностью заменить состояние (восстановление из копии).
+        
+        `data` - в формате файла (JSON).
+        """
+        data = dict(data)
+        data.pop(SNAPSHOT_SEQ_KEY, None)
+        data.pop(UPDATES_KEY, None)
+        self.apply({'op': 'reset', 'data': data})
+        return self.data
+    
+    # ===== ЗАПИСЬ =====
+    def _snapshot_payload(self):
+        snapshot = self.encode(self._data)
+        if self.journal:
+            snapshot[SNAPSHOT_SEQ_KEY] = self.journal.seq
+        if self._updates:
+            snapshot[UPDATES_KEY] = list(self._updates)
+        return json.dumps(snapshot, ensure_ascii=False, indent=2)
+    
+    def flush(self):
+        """Записать текущее состояние на диск прямо сейчас"""
+        if self.journal:
+            self.compact()
+            return
+        with self.lock:
+            if self._data is None:
+                return
+            version = self.version
+            payload = self._snapshot_payload()
+            try:
+                write_atomic(self.path, payload)
+                self._saved_version = version
+                self.writes += 1
+                logger.info(f"Данные сохранены в {self.path}")
+            except Exception as e:
+                logger.error(f"Ошибка сохранения: {e}")
+    
+    def compact(self):
+        """Свернуть журнал в снимок (атомарная замена файла)"""
+        with self._compact_lock:
+            with self.lock:
+                if self._data is None:
+                    return
+                payload = self._snapshot_payload()
+                self.journal.rotate()
+            try:
+                write_atomic(self.path, payload)
+                self.journal.drop_rotated()
+                logger.info(f"Журнал свернут в снимок {self.path}")
+            except Exception as e:
+                # Отложенный журнал остается на диске и будет прочитан при старте
+                logger.error(f"Ошибка свертки журнала: {e}")
+    
+    def start(self):
+        if self.journal:
+            self._compactor.start()
+        else:
+            self._flusher.start()
+    
+    def close(self):
+        """Остановить фоновую запись и гарантированно сохранить данные
+        (повторный вызов ничего не делает)"""
+        with self.lock:
+            if self._closed:
+                return
+            self._closed = True
+        if self.journal:
+            self._compactor.stop()
+        else:
+            self._flusher.stop()
+        self.flush()
+        if self.journal:
+            self.journal.close()
+
+
+class WriteBehindFlusher(threading.Thread):
+    """Фоновая запись состояния.
+    
+    Ждет, пока поток изменений затихнет на `flush_delay` секунд, но не
+    дольше `max_delay` с момента первого несохраненного изменения.
+    """
+    
+    def __init__(self, store, flush_delay, max_delay):
+        super().__init__(name='state-flusher', daemon=True)
+        self.store = store
+        self.flush_delay = flush_delay
+        self.max_delay = max(max_delay, flush_delay)
+        self._cond = threading.Condition()
+        self._first_dirty = None
+        self._last_dirty = None
+        self._stopped = False
+    
+    def notify(self):
+        now = time.monotonic()
+        with self._cond:
+            if self._first_dirty is None:
+                self._first_dirty = now
+            self._last_dirty = now
+            self._cond.notify()
+    
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self.is_alive():
+            self.join()
+    
+    def _deadline(self):
+        return min(self._last_dirty + self.flush_delay,
+                   self._first_dirty + self.max_delay)
+    
+    def run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    if self._first_dirty is None:
+                        self._cond.wait()
+                        continue
+                    remaining = self._deadline() - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._stopped:
+                    return
+                self._first_dirty = None
+                self._last_dirty = None
+            self.store.flush()
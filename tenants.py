@@ -0,0 +1,208 @@
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from commands import CommandQueue
+from journal import write_atomic
+from render_cache import RenderCache
+
+logger = logging.getLogger(__name__)
+
+# Лимиты тестового режима (как TEST_MODE у основного чата)
+TEST_LIMITS = (3, 2)
+
+DEFAULT_SETTINGS = {
+    'title': '',
+    'admins': [],
+    'max_main': 20,
+    'max_reserve': 10,
+    'test_mode': False,
+}
+
+
+class Tenant:
+    """Чат со своими тренировками, админами и лимитами.
+    
+    Все, что раньше было глобальным в боте, здесь свое: хранилище,
+    очереди команд, кэш текстов, выбранная админом тренировка.
+    У основного чата `chat_id` None - это прежние DATA_FILE и ADMIN_ID.
+    """
+    
+    def __init__(self, chat_id, settings, store, archive=None):
+        self.chat_id = chat_id
+        self.settings = dict(DEFAULT_SETTINGS, **settings)
+        self.store = store
+        self.archive = archive
+        self.training_queues = {}
+        self.trainings_queue = CommandQueue(f'trainings-{chat_id}')
+        self.render_cache = RenderCache(self._render_version)
+        # Какую тренировку админ сейчас редактирует
+        self.selected = {}
+        self.pins = 0
+    
+    @property
+    def is_default(self):
+        return self.chat_id is None
+    
+    def limits(self):
+        if self.settings['test_mode']:
+            return TEST_LIMITS
+        return self.settings['max_main'], self.settings['max_reserve']
+    
+    def _render_version(self):
+        # /limits и /testmode меняют тексты (лимиты, режим), но не версию
+        # хранилища - они тоже часть ключа кэша
+        return self.store.version, self.limits(), self.settings['test_mode']
+    
+    def queue(self, training_id):
+        queue = self.training_queues.get(training_id)
+        if queue is None:
+            queue = self.training_queues.setdefault(
+                training_id, CommandQueue(f'training-{self.chat_id}-{training_id}')
+            )
+        return queue
+    
+    def close(self):
+        self.store.close()
+        if self.archive:
+            self.archive.close()
+
+
+class TenantRegistry:
+    """Чаты-группы, у каждой свой каталог (шард) в `root`.
+    
+    Шард загружается при первом обращении и держится в LRU-кэше не
+    больше чем на `max_loaded` групп: память растет с числом активных
+    групп, а не всех зарегистрированных. Вытесненный шард сохраняется
+    и закрывается; используемый сейчас (use()) не вытесняется.
+    
+    * `open_shard(path)` - (хранилище, архив) шарда, хранилище загружено
+      и запущено;
+    * `default` - основной чат (не вытесняется, в кэше не лежит).
+    
+    Файлы шарда: settings.json (админы, лимиты, тестовый режим) и то,
+    что создает open_shard.
+    """
+    
+    def __init__(self, root, open_shard, default, max_loaded=100):
+        self.root = root
+        self.open_shard = open_shard
+        self.default = default
+        self.max_loaded = max_loaded
+        self.lock = threading.Lock()
+        self._loaded = OrderedDict()
+        # Вытесненные шарды, которые еще сохраняются: {chat_id: Event}
+        self._closing = {}
+        self._known = set()
+        self.loads = 0
+        self.evictions = 0
+    
+    # ===== ШАРДЫ =====
+    def path(self, chat_id):
+        return os.path.join(self.root, str(chat_id))
+    
+    def settings_path(self, chat_id):
+        return os.path.join(self.path(chat_id), 'settings.json')
+    
+    def exists(self, chat_id):
+        """Группа зарегистрирована (в том числе другим процессом)"""
+        if chat_id in self._known:
+            return True
+        if self.root and os.path.exists(self.settings_path(chat_id)):
+            self._known.add(chat_id)
+            return True
+        return False
+    
+    def create(self, chat_id, title, admin_id):
+        """Зарегистрировать группу, `admin_id` - ее первый админ"""
+        os.makedirs(self.path(chat_id), exist_ok=True)
+        settings = dict(DEFAULT_SETTINGS, title=title, admins=[admin_id])
+        write_atomic(self.settings_path(chat_id), json.dumps(settings, ensure_ascii=False))
+        self._known.add(chat_id)
+        logger.info(f"🏘 Зарегистрирована группа {chat_id} ({title})")
+    
+    def save_settings(self, tenant):
+        if tenant.is_default:
+            return
+        write_atomic(self.settings_path(tenant.chat_id),
+                     json.dumps(tenant.settings, ensure_ascii=False))
+    
+    def _load(self, chat_id):
+        with open(self.settings_path(chat_id), 'r', encoding='utf-8') as f:
+            settings = json.load(f)
+        store, archive = self.open_shard(self.path(chat_id))
+        self.loads += 1
+        return Tenant(chat_id, settings, store, archive)
+    
+    # ===== ДОСТУП =====
+    @contextmanager
+    def use(self, chat_id):
+        """Чат на время обработки: шард загружен и не будет вытеснен.
+        None или незарегистрированный чат - основной"""
+        if chat_id is None or not self.exists(chat_id):
+            yield self.default
+            return
+        tenant = self._acquire(chat_id)
+        try:
+            yield tenant
+        finally:
+            with self.lock:
+                tenant.pins -= 1
+            self._evict()
+    
+    def _acquire(self, chat_id):
+        # Загрузка под общей блокировкой: один шард не загрузится дважды,
+        # а чтение шарда - несколько миллисекунд
+        while True:
+            with self.lock:
+                closed = self._closing.get(chat_id)
+                if closed is None:
+                    tenant = self._loaded.get(chat_id)
+                    if tenant is None:
+                        tenant = self._loaded[chat_id] = self._load(chat_id)
+                    self._loaded.move_to_end(chat_id)
+                    tenant.pins += 1
+                    return tenant
+            # Вытесненный шард еще сохраняется - его файлы читать рано
+            closed.wait()
+    
+    def _unload(self, chat_id):
+        """Убрать шард из кэша (под self.lock); закрывает его _close"""
+        self._closing[chat_id] = threading.Event()
+        return self._loaded.pop(chat_id)
+    
+    def _close(self, tenant):
+        try:
+            tenant.close()
+        finally:
+            with self.lock:
+                self._closing.pop(tenant.chat_id).set()
+    
+    def _evict(self):
+        closing = []
+        with self.lock:
+            extra = len(self._loaded) - self.max_loaded
+            for chat_id, tenant in list(self._loaded.items()):
+                if extra <= 0:
+                    break
+                if tenant.pins:
+                    continue
+                closing.append(self._unload(chat_id))
+                extra -= 1
+        for tenant in closing:
+            self._close(tenant)
+            self.evictions += 1
+            logger.info(f"🏘 Группа {tenant.chat_id} выгружена из памяти")
+    
+    def __len__(self):
+        return len(self._loaded)
+    
+    def close(self):
+        """Сохранить и закрыть все загруженные шарды"""
+        with self.lock:
+            loaded = [self._unload(chat_id) for chat_id in list(self._loaded)]
+        for tenant in loaded:
+            self._close(tenant)
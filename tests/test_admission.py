@@ -0,0 +1,83 @@
+import pytest
+
+from admission import AdmissionQueue
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+    
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def make_queue(clock, dropped, **kwargs):
+    # Обновление в проверках - (пользователь, ключ чтения или None, имя)
+    return AdmissionQueue(lambda update: update[:2], clock=clock, on_drop=dropped.append, **kwargs)
+
+
+def drain(admission):
+    admission.put(None)
+    names = []
+    while True:
+        update = admission.get()
+        if update is None:
+            return names
+        names.append(update[2])
+
+
+def test_writes_go_before_reads(clock):
+    admission = make_queue(clock, [])
+    admission.put((1, 'list', 'read 1'))
+    admission.put((2, None, 'write 1'))
+    admission.put((3, 'list', 'read 2'))
+    admission.put((4, None, 'write 2'))
+    assert drain(admission) == ['write 1', 'write 2', 'read 1', 'read 2']
+
+
+def test_repeated_read_is_coalesced_while_waiting(clock):
+    dropped = []
+    admission = make_queue(clock, dropped)
+    admission.put((1, 'list', 'first'))
+    admission.put((1, 'list', 'again'))
+    # Другой запрос того же пользователя и тот же запрос другого - не склеиваются
+    admission.put((1, 'profile', 'profile'))
+    admission.put((2, 'list', 'other user'))
+    assert [update[2] for update in dropped] == ['again']
+    
+    assert admission.get()[2] == 'first'
+    # Первый уже взят в работу - повтор снова принимается
+    admission.put((1, 'list', 'later'))
+    assert drain(admission) == ['profile', 'other user', 'later']
+    assert admission.stats['coalesced'] == 1
+
+
+def test_reads_are_rate_limited_per_user(clock):
+    dropped = []
+    admission = make_queue(clock, dropped, rate=2.0, burst=2)
+    for i in range(3):
+        admission.put((1, f'read {i}', f'read {i}'))
+    # Изменения не ограничиваются
+    admission.put((1, None, 'write'))
+    assert [update[2] for update in dropped] == ['read 2']
+    
+    clock.now += 0.5
+    admission.put((1, 'read 3', 'read 3'))
+    assert drain(admission) == ['write', 'read 0', 'read 1', 'read 3']
+    assert admission.stats['limited'] == 1
+
+
+def test_read_lane_is_shed_when_full(clock):
+    dropped = []
+    admission = make_queue(clock, dropped, max_reads=2)
+    for user_id in range(4):
+        admission.put((user_id, 'list', f'read {user_id}'))
+    admission.put((9, None, 'write'))
+    assert [update[2] for update in dropped] == ['read 2', 'read 3']
+    assert drain(admission) == ['write', 'read 0', 'read 1']
+    assert admission.stats == {'writes': 1, 'reads': 2, 'coalesced': 0, 'limited': 0, 'shed': 2}
@@ -0,0 +1,62 @@
+import json
+import os
+
+from archive import Archive
+
+
+def training(date, main, reserve=()):
+    return {'kind': 'training', 'date': date, 'time': '20:45', 'occurrence': f'slot/{date}',
+            'main': [{'id': uid, 'display_name': f'Игрок {uid}'} for uid in main],
+            'reserve': [{'id': uid, 'display_name': f'Игрок {uid}'} for uid in reserve]}
+
+
+def test_append_writes_only_the_line(tmp_path):
+    path = str(tmp_path / 'archive.jsonl')
+    archive = Archive(path, checkpoint=3)
+    archive.open()
+    archive.append(training('2030-01-01', [1, 2], [3]))
+    archive.append({'kind': 'cancel', 'user': '1', 'name': 'Игрок 1', 'hours_left': 2})
+    assert not os.path.exists(archive.stats_path)
+    
+    # Раз в checkpoint событий агрегаты сохраняются
+    archive.append(training('2030-01-08', [1]))
+    with open(archive.stats_path, 'r', encoding='utf-8') as f:
+        assert json.load(f)['count'] == 3
+    archive.append(training('2030-01-15', [2]))
+    archive.close()
+    with open(archive.stats_path, 'r', encoding='utf-8') as f:
+        assert json.load(f)['offset'] == os.path.getsize(path)
+
+
+def test_stats_rebuilt_from_tail_after_crash(tmp_path):
+    path = str(tmp_path / 'archive.jsonl')
+    archive = Archive(path, checkpoint=2)
+    archive.open()
+    for week, main in enumerate(([1, 2], [1], [1, 3])):
+        archive.append(training(f'2030-01-0{week + 1}', main))
+    # Без close(): последнее событие в агрегатах на диске не учтено
+    
+    restored = Archive(path)
+    restored.open()
+    assert restored.count == 3
+    assert restored.stats.users == archive.stats.users
+    assert [key for key, _ in restored.stats.top(2)] == ['1', '2']
+    assert restored.has_occurrence('slot/2030-01-03')
+
+
+def test_append_after_torn_line(tmp_path):
+    path = str(tmp_path / 'archive.jsonl')
+    archive = Archive(path)
+    archive.open()
+    archive.append(training('2030-01-01', [1]))
+    # Процесс упал посреди записи строки
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"kind": "training", "date": "2030-01-')
+    
+    restored = Archive(path)
+    restored.open()
+    restored.append(training('2030-01-08', [1, 2]))
+    assert [record['date'] for record in Archive(path).records()] == ['2030-01-01', '2030-01-08']
+    again = Archive(path)
+    again.open()
+    assert again.count == restored.count == 2
@@ -0,0 +1,83 @@
+import json
+import os
+import sys
+import threading
+from datetime import datetime
+
+import audit
+from audit import AuditLog, op_events
+
+
+def write_events(path, days, chat=None):
+    with open(path, 'a', encoding='utf-8') as f:
+        for i, day in enumerate(days):
+            f.write(json.dumps({'event': 'join', 'chat': chat, 'name': f'Игрок {i}',
+                                'ts': f'{day}T20:00:00'}, ensure_ascii=False) + '\n')
+
+
+def make_log(tmp_path, **kwargs):
+    return AuditLog(str(tmp_path / 'audit-a'), now=lambda: datetime(2030, 1, 31, 12, 0),
+                    siblings=str(tmp_path / 'audit-*'), **kwargs)
+
+
+def test_oldest_days_are_evicted_when_read_out_of_order(tmp_path):
+    log = make_log(tmp_path, days=3)
+    write_events(str(tmp_path / 'audit-b'), ['2030-01-05', '2030-01-06', '2030-01-07'])
+    log.sync()
+    # Другой процесс отстал: его события раньше уже прочитанных
+    write_events(str(tmp_path / 'audit-c'), ['2030-01-01', '2030-01-08'])
+    log.sync()
+    assert sorted(log._by_day) == ['2030-01-06', '2030-01-07', '2030-01-08']
+    assert log.for_day(None, '2030-01-01') == []
+    assert len(log.for_day(None, '2030-01-08')) == 1
+
+
+def test_concurrent_sync_reads_each_line_once(tmp_path):
+    log = make_log(tmp_path)
+    for name in ('b', 'c', 'd'):
+        write_events(str(tmp_path / f'audit-{name}'), ['2030-01-30'] * 200)
+    start = threading.Barrier(8)
+    
+    def query():
+        start.wait()
+        log.sync()
+    
+    # Потоки переключаются чаще - гонка проявляется в каждом прогоне
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    try:
+        threads = [threading.Thread(target=query) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert log.events == 600
+
+
+def test_sync_survives_sibling_removed_during_rotation(tmp_path, monkeypatch):
+    log = make_log(tmp_path)
+    sibling = str(tmp_path / 'audit-b')
+    write_events(sibling, ['2030-01-30'] * 2)
+    log.sync()
+    
+    # Файл найден glob, но до getsize его уже переименовали
+    glob = audit.glob.glob
+    monkeypatch.setattr(audit.glob, 'glob', lambda pattern: glob(pattern) + [sibling + '-gone'])
+    os.rename(sibling, sibling + '.1')
+    write_events(sibling, ['2030-01-31'])
+    log.sync()
+    assert log.events == 3
+
+
+def test_join_keeps_time_of_sign_up():
+    user = {'id': 7, 'display_name': 'Иван', 'signed_at': '2030-01-30T20:00:00+03:00'}
+    op = {'op': 'batch', 'training': 1, 'ops': [
+        {'op': 'join', 'list': 'main', 'user': user},
+        {'op': 'join', 'list': 'reserve', 'user': {'id': 8, 'display_name': 'Петр'}},
+    ]}
+    events = list(op_events(op, ['main', 'reserve']))
+    # Пачка применена позже нажатия: в событии - время самой записи
+    assert [e['signed_at'] for e in events] == ['2030-01-30T20:00:00+03:00', None]
+    assert events[0]['user'] == 7 and events[1]['list'] == 'reserve'
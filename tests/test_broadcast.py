@@ -0,0 +1,61 @@
+import json
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from broadcast import Broadcaster
+
+
+class StubOutbox:
+    """Все сообщения доставляются сразу"""
+    
+    def __init__(self):
+        self.sent = []
+    
+    def submit(self, chat_id, method, /, *args, **kwargs):
+        self.sent.append((chat_id, args[-1]))
+        future = Future()
+        future.set_result(None)
+        return future
+
+
+def saved_job(job_id, pending):
+    return {'id': job_id, 'admin_chat': None, 'text': 'напоминание', 'markup': None,
+            'pending': pending, 'total': len(pending), 'delivered': 0, 'failed': 0}
+
+
+def test_submit_before_load_keeps_saved_jobs(tmp_path):
+    path = str(tmp_path / 'broadcasts.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'next_id': 3, 'jobs': [saved_job(2, [10, 11])]}, f)
+    
+    broadcaster = Broadcaster(StubOutbox(), path)
+    with pytest.raises(RuntimeError):
+        broadcaster.submit(None, [20], 'рано')
+    with open(path, 'r', encoding='utf-8') as f:
+        assert [job['id'] for job in json.load(f)['jobs']] == [2]
+    
+    broadcaster.load()
+    assert broadcaster.submit(None, [20, 20, None], 'вовремя') == 1
+    assert broadcaster.active() == [(2, 2, 2), (3, 1, 1)]
+
+
+def test_jobs_survive_restart_and_finish(tmp_path):
+    path = str(tmp_path / 'broadcasts.json')
+    first = Broadcaster(StubOutbox(), path)
+    first.load()
+    first.submit(None, [1, 2, 3], 'текст')
+    
+    outbox = StubOutbox()
+    second = Broadcaster(outbox, path, batch_size=2)
+    second.start()
+    try:
+        deadline = time.monotonic() + 5
+        while second.active() and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        second.stop()
+    assert outbox.sent == [(1, 'текст'), (2, 'текст'), (3, 'текст')]
+    with open(path, 'r', encoding='utf-8') as f:
+        assert json.load(f) == {'next_id': 2, 'jobs': []}
@@ -0,0 +1,65 @@
+import threading
+
+from burst import SignupBurst
+
+KEY = (None, 1)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+    
+    def __call__(self):
+        return self.now
+
+
+def make_burst(clock, batches, **kwargs):
+    applied = threading.Event()
+    
+    def apply(key, items):
+        batches.append((key, items))
+        applied.set()
+    burst = SignupBurst(apply, clock=clock, **kwargs)
+    return burst, applied
+
+
+def test_batch_is_sorted_by_send_time():
+    clock, batches = Clock(), []
+    burst, applied = make_burst(clock, batches, window=1.0, duration=60.0)
+    burst.open(KEY)
+    # Рабочие потоки отдают заявки не в порядке нажатий
+    for order, name in (((101, 7), 'c'), ((100, 9), 'b'), ((100, 3), 'a')):
+        assert burst.submit(KEY, order, name)
+    burst.start()
+    clock.now += 1.0
+    with burst._cond:
+        burst._cond.notify()
+    assert applied.wait(5)
+    burst.stop()
+    assert batches == [(KEY, ['a', 'b', 'c'])]
+    assert (burst.batches, burst.signups) == (1, 3)
+
+
+def test_window_counts_from_opening_in_another_process():
+    clock, batches = Clock(), []
+    burst, _ = make_burst(clock, batches, duration=60.0)
+    # Другой процесс открыл запись 70 секунд назад - окно уже закрыто
+    burst.open(KEY, ago=70.0)
+    assert not burst.submit(KEY, (1, 1), 'late')
+    
+    # Открыта 50 секунд назад: копим еще 10 секунд, повторный open не продлевает
+    burst.open(KEY, ago=50.0)
+    clock.now += 5
+    burst.open(KEY, ago=55.0)
+    assert burst.submit(KEY, (2, 2), 'early')
+    clock.now += 5
+    assert not burst.submit(KEY, (3, 3), 'after')
+    burst.stop()
+    assert batches == [(KEY, ['early'])]
+
+
+def test_disabled_without_duration():
+    clock, batches = Clock(), []
+    burst, _ = make_burst(clock, batches, duration=0)
+    burst.open(KEY)
+    assert not burst.submit(KEY, (1, 1), 'now')
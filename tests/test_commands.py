@@ -0,0 +1,182 @@
+import random
+import sys
+import threading
+from collections import Counter
+
+import pytest
+
+import commands
+from commands import CommandQueue
+from roster import state_from_json, state_to_json
+from sqlite_store import SqliteStore
+from state_store import StateStore
+
+MAX_MAIN, MAX_RESERVE = 20, 10
+TRAINING = 1
+
+
+def default_data():
+    return {'trainings': [{
+        'id': TRAINING, 'date': '2030-01-01', 'time': '20:45', 'place': 'Пехорка',
+        'registration_open': True, 'main': [], 'reserve': [], 'manual_entries': [],
+    }]}
+
+
+def user(user_id):
+    return {'id': user_id, 'display_name': f'Игрок {user_id}', 'username': '',
+            'time': '20:00', 'is_manual': False}
+
+
+class Instance:
+    """Процесс бота: хранилище и очередь команд тренировки"""
+    
+    def __init__(self, store):
+        self.store = store
+        self.queue = CommandQueue(f'training-{TRAINING}')
+    
+    def run(self, command, *args):
+        # Как in_transaction в боте: проверка и изменение - одна транзакция
+        def in_transaction():
+            with self.store.transaction():
+                return command(self.store, TRAINING, *args)
+        return self.queue.submit(in_transaction)
+
+
+@pytest.fixture(autouse=True)
+def frequent_switches():
+    """Потоки переключаются чаще - гонки проявляются в каждом прогоне"""
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    yield
+    sys.setswitchinterval(interval)
+
+
+@pytest.fixture(params=['snapshot', 'journal', 'sqlite-shared'])
+def instances(request, tmp_path):
+    """Одно хранилище - или два процесса с общей базой SQLite"""
+    kwargs = dict(default_factory=default_data, decode=state_from_json, encode=state_to_json)
+    if request.param == 'sqlite-shared':
+        db = str(tmp_path / 'data.db')
+        stores = [SqliteStore(db, shared=True, **kwargs) for _ in range(2)]
+    else:
+        journal = str(tmp_path / 'data.journal') if request.param == 'journal' else None
+        stores = [StateStore(str(tmp_path / 'data.json'), journal_path=journal, **kwargs)]
+    for store in stores:
+        store.load()
+        store.start()
+    yield [Instance(store) for store in stores]
+    for store in stores:
+        store.close()
+
+
+def in_parallel(calls):
+    """Выполнить вызовы одновременно; результаты в порядке calls"""
+    start = threading.Barrier(len(calls))
+    results = [None] * len(calls)
+    
+    def worker(i, call):
+        start.wait()
+        results[i] = call()
+    
+    threads = [threading.Thread(target=worker, args=(i, call)) for i, call in enumerate(calls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def roster_of(instance):
+    instance.store.refresh()
+    return instance.store.data['trainings'][TRAINING]['roster']
+
+
+def check_limits(roster):
+    ids = [p.id for p in roster]
+    assert len(ids) == len(set(ids)), "участник записан дважды"
+    assert roster.main_count <= MAX_MAIN
+    assert roster.reserve_count <= MAX_RESERVE
+    # Резерв не ждет, пока в основном списке есть место
+    assert not roster.reserve_count or roster.main_count == MAX_MAIN
+
+
+def test_concurrent_sign_ups_respect_limits(instances):
+    calls = [
+        (lambda uid=uid, inst=instances[uid % len(instances)]:
+            inst.run(commands.sign_up, user(uid), MAX_MAIN, MAX_RESERVE))
+        for uid in range(1, 301)
+    ]
+    # Каждый нажимает дважды
+    results = in_parallel(calls + calls)
+    
+    counts = Counter(results)
+    assert counts['main'] == MAX_MAIN
+    assert counts['reserve'] == MAX_RESERVE
+    assert counts['duplicate'] + counts['full'] == 600 - MAX_MAIN - MAX_RESERVE
+    for instance in instances:
+        roster = roster_of(instance)
+        check_limits(roster)
+        assert roster.main_count == MAX_MAIN and roster.reserve_count == MAX_RESERVE
+
+
+def test_promotion_from_reserve_is_fifo(instances):
+    first = instances[0]
+    for uid in range(1, MAX_MAIN + MAX_RESERVE + 1):
+        first.run(commands.sign_up, user(uid), MAX_MAIN, MAX_RESERVE)
+    reserve = [p.id for p in roster_of(first).reserve]
+    
+    leaving = random.Random(1).sample(range(1, MAX_MAIN + 1), 7)
+    results = in_parallel([
+        (lambda uid=uid, inst=instances[i % len(instances)]: inst.run(commands.cancel, uid))
+        for i, uid in enumerate(leaving)
+    ])
+    
+    promoted = {p.id for _, p in results if p is not None}
+    assert promoted == set(reserve[:7])
+    for instance in instances:
+        roster = roster_of(instance)
+        check_limits(roster)
+        # Переведенные дописаны в конец основного списка в порядке резерва
+        assert [p.id for p in roster.main][-7:] == reserve[:7]
+        assert [p.id for p in roster.reserve] == reserve[7:]
+
+
+def test_cancel_and_promotion_are_one_operation(instances, monkeypatch):
+    first = instances[0]
+    for uid in range(1, MAX_MAIN + 2):
+        first.run(commands.sign_up, user(uid), MAX_MAIN, MAX_RESERVE)
+    applied = []
+    apply = first.store.apply
+    monkeypatch.setattr(first.store, 'apply', lambda op: (applied.append(op), apply(op))[1])
+    
+    removed, promoted = first.run(commands.cancel, 1)
+    assert (removed.id, promoted.id) == (1, MAX_MAIN + 1)
+    assert [op['op'] for op in applied] == ['batch']
+    assert [op['op'] for op in applied[0]['ops']] == ['cancel', 'promote']
+    
+    # Из резерва некого переводить - обычная отмена
+    removed, promoted = first.run(commands.cancel, 2)
+    assert (removed.id, promoted) == (2, None)
+    assert applied[-1]['op'] == 'cancel'
+    for instance in instances:
+        assert [p.id for p in roster_of(instance).main][-1] == MAX_MAIN + 1
+
+
+def test_churn_keeps_lists_consistent(instances):
+    rng = random.Random(7)
+    actions = []
+    for i in range(400):
+        uid = rng.randint(1, 60)
+        instance = instances[i % len(instances)]
+        if rng.random() < 0.6:
+            actions.append(lambda uid=uid, inst=instance:
+                           inst.run(commands.sign_up, user(uid), MAX_MAIN, MAX_RESERVE))
+        else:
+            actions.append(lambda uid=uid, inst=instance: inst.run(commands.cancel, uid))
+    in_parallel(actions)
+    
+    rosters = [roster_of(instance) for instance in instances]
+    for roster in rosters:
+        check_limits(roster)
+    # Все процессы видят одно и то же
+    assert len({tuple(p.id for p in roster) for roster in rosters}) == 1
@@ -0,0 +1,45 @@
+import json
+import time
+
+import conversation
+from conversation import ConversationStore, JsonFileBackend
+
+
+def read_rows(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_json_backend_batches_writes(tmp_path, monkeypatch):
+    path = str(tmp_path / 'conversations.json')
+    writes = []
+    write_atomic = conversation.write_atomic
+    monkeypatch.setattr(conversation, 'write_atomic',
+                        lambda *args: (writes.append(args[0]), write_atomic(*args)))
+    
+    conversations = ConversationStore(JsonFileBackend(path, flush_delay=0.05, max_delay=1.0))
+    conversations.start()
+    try:
+        for user_id in range(50):
+            conversations.set(1, user_id, 'name', training=1)
+        conversations.pop(1, 0)
+        assert writes == []
+        time.sleep(0.3)
+        # Пачка изменений - одна запись файла
+        assert len(writes) == 1
+        assert len(read_rows(path)) == 49
+    finally:
+        conversations.close()
+
+
+def test_json_backend_close_saves_pending(tmp_path):
+    path = str(tmp_path / 'conversations.json')
+    conversations = ConversationStore(JsonFileBackend(path, flush_delay=60, max_delay=60))
+    conversations.start()
+    conversations.set(1, 2, 'admin_time', training=3)
+    conversations.close()
+    
+    restored = ConversationStore(JsonFileBackend(path))
+    restored.load()
+    item = restored.get(1, 2)
+    assert item.state == 'admin_time' and item.data == {'training': 3}
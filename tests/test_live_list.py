@@ -0,0 +1,116 @@
+import sys
+import threading
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+import pytest
+
+from live_list import LiveList
+
+CHAT, TRAINING = 100, 1
+
+
+class StubOutbox:
+    """Очередь без отправки: вызовы копятся, ответы задает тест"""
+    
+    def __init__(self):
+        self.calls = []
+    
+    def submit(self, chat_id, method, /, *args, **kwargs):
+        future = Future()
+        self.calls.append((method, args, kwargs, future))
+        return future
+    
+    def methods(self):
+        return [method for method, *_ in self.calls]
+    
+    def last(self, method):
+        return [call for call in self.calls if call[0] == method][-1]
+
+
+@pytest.fixture
+def outbox():
+    return StubOutbox()
+
+
+@pytest.fixture
+def live(outbox, tmp_path):
+    live_list = LiveList(outbox, render=lambda training_id: None,
+                         path=str(tmp_path / 'live.json'))
+    live_list.start()
+    yield live_list
+    live_list.stop()
+
+
+def test_first_show_does_not_wait_for_send(live, outbox):
+    live.show(CHAT, TRAINING, 'список 1')
+    # Обработчик вернулся, сообщение еще в очереди
+    assert outbox.methods() == ['send_message']
+    assert not live.has(CHAT, TRAINING)
+    
+    # Повторный показ до ответа не шлет второе сообщение
+    live.show(CHAT, TRAINING, 'список 2')
+    assert outbox.methods() == ['send_message']
+    
+    outbox.last('send_message')[3].set_result(SimpleNamespace(message_id=55))
+    assert live.has(CHAT, TRAINING)
+    assert outbox.methods() == ['send_message', 'pin_chat_message', 'edit_message_text']
+    assert outbox.last('pin_chat_message')[1] == (CHAT, 55)
+    method, args, kwargs, _ = outbox.last('edit_message_text')
+    assert args == ('список 2',) and kwargs['message_id'] == 55
+
+
+def test_show_with_pin_only_edits(live, outbox):
+    live.show(CHAT, TRAINING, 'список 1')
+    outbox.last('send_message')[3].set_result(SimpleNamespace(message_id=55))
+    sent = len(outbox.calls)
+    
+    live.show(CHAT, TRAINING, 'список 1')
+    # Текст не изменился - ничего не отправляем
+    assert len(outbox.calls) == sent
+    live.show(CHAT, TRAINING, 'список 2')
+    assert outbox.methods()[sent:] == ['edit_message_text']
+
+
+def test_failed_send_is_retried_on_next_show(live, outbox, tmp_path):
+    live.show(CHAT, TRAINING, 'список 1')
+    outbox.last('send_message')[3].set_exception(RuntimeError('chat not found'))
+    assert not live.has(CHAT, TRAINING)
+    
+    live.show(CHAT, TRAINING, 'список 1')
+    assert outbox.methods() == ['send_message', 'send_message']
+    outbox.last('send_message')[3].set_result(SimpleNamespace(message_id=7))
+    # Номер сообщения сохранен для перезапуска
+    assert (tmp_path / 'live.json').read_text() == f'[[{CHAT}, {TRAINING}, 7]]'
+
+
+def test_concurrent_refresh_edits_once(live, outbox):
+    live.show(CHAT, TRAINING, 'список 1')
+    outbox.last('send_message')[3].set_result(SimpleNamespace(message_id=55))
+    sent = len(outbox.calls)
+    start = threading.Barrier(8)
+    
+    def show():
+        start.wait()
+        for _ in range(50):
+            live.show(CHAT, TRAINING, 'список 2')
+    
+    # Потоки переключаются чаще - гонка проявляется в каждом прогоне
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    try:
+        threads = [threading.Thread(target=show) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert outbox.methods()[sent:] == ['edit_message_text']
+    
+    # Ошибка старой правки не сбрасывает текст, отправленный после нее
+    first = outbox.last('edit_message_text')[3]
+    live.show(CHAT, TRAINING, 'список 3')
+    first.set_exception(RuntimeError('timeout'))
+    live.show(CHAT, TRAINING, 'список 3')
+    assert outbox.methods()[sent:] == ['edit_message_text'] * 2
@@ -0,0 +1,205 @@
+import threading
+import time
+
+import pytest
+
+from outbox import BULK, PROMOTION, REPLY, Outbox, TokenBucket
+
+
+class ApiError(Exception):
+    """Как telebot.apihelper.ApiTelegramException: код и ответ Telegram"""
+    
+    def __init__(self, code, retry_after=None):
+        super().__init__(f"error {code}")
+        self.error_code = code
+        self.result_json = {'parameters': {'retry_after': retry_after}} if retry_after else {}
+
+
+class StubTransport:
+    """Заглушка бота: запоминает вызовы, ошибки берет из очереди `failures`"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent = []
+        self.attempts = {}
+        # {текст: [исключение или None, ...]} - по одному на попытку
+        self.failures = {}
+    
+    def send_message(self, chat_id, text):
+        with self.lock:
+            self.attempts[text] = self.attempts.get(text, 0) + 1
+            plan = self.failures.get(text)
+            error = plan.pop(0) if plan else None
+            if error is None:
+                self.sent.append((time.monotonic(), chat_id, text))
+        if error is not None:
+            raise error
+        return text
+    
+    def times(self, prefix=''):
+        with self.lock:
+            return [at for at, _, text in self.sent if text.startswith(prefix)]
+    
+    def order(self):
+        with self.lock:
+            return [text for _, _, text in self.sent]
+
+
+@pytest.fixture
+def transport():
+    return StubTransport()
+
+
+def make_outbox(transport, **kwargs):
+    params = dict(global_rate=1000.0, chat_rate=1000.0, chat_burst=1000, senders=1, backoff=0.01)
+    params.update(kwargs)
+    return Outbox(transport, **params)
+
+
+def send_all(outbox, jobs, timeout=10):
+    """Поставить [(чат, текст, приоритет)] до запуска и дождаться всех"""
+    futures = [outbox.submit(chat, 'send_message', chat, text, priority=priority)
+               for chat, text, priority in jobs]
+    started = time.monotonic()
+    outbox.start()
+    try:
+        for future in futures:
+            future.exception(timeout)
+    finally:
+        outbox.stop()
+    return started, futures
+
+
+# ===== ВЕДРО ТОКЕНОВ =====
+def test_token_bucket_refill_and_block():
+    bucket = TokenBucket(rate=2.0, capacity=3)
+    now = bucket.updated
+    for _ in range(3):
+        assert bucket.wait_time(now) == 0
+        bucket.take(now)
+    assert bucket.wait_time(now) == pytest.approx(0.5)
+    assert bucket.wait_time(now + 0.5) == 0
+    # Не больше capacity, сколько бы ни прошло
+    assert bucket.wait_time(now + 100) == 0 and bucket.tokens == 3
+    bucket.block(5, now + 100)
+    assert bucket.wait_time(now + 101) == pytest.approx(4)
+
+
+# ===== ПОРЯДОК И ЛИМИТЫ =====
+def test_priority_lanes(transport):
+    jobs = [(i, f'bulk {i}', BULK) for i in range(3)]
+    jobs += [(10 + i, f'reply {i}', REPLY) for i in range(3)]
+    jobs += [(20, 'promotion', PROMOTION)]
+    send_all(make_outbox(transport), jobs)
+    assert transport.order() == ['promotion', 'reply 0', 'reply 1', 'reply 2',
+                                 'bulk 0', 'bulk 1', 'bulk 2']
+
+
+def test_chat_bucket_limits_one_chat_only(transport):
+    outbox = make_outbox(transport, chat_rate=10.0, chat_burst=2)
+    jobs = [(1, f'a{i}', REPLY) for i in range(5)] + [(2, 'b', REPLY)]
+    started, _ = send_all(outbox, jobs)
+    
+    times = transport.times('a')
+    # Два сразу (запас), дальше - 10 в секунду
+    assert times[1] - started < 0.05
+    assert times[4] - started == pytest.approx(0.3, abs=0.08)
+    # Другой чат не ждет, пока первый упирается в свой лимит
+    assert transport.order().index('b') < transport.order().index('a2')
+
+
+def test_global_bucket_limits_all_chats(transport):
+    outbox = make_outbox(transport, global_rate=10.0)
+    started, _ = send_all(outbox, [(chat, f'm{chat}', REPLY) for chat in range(15)])
+    # Запас 10 сообщений, остальные 5 - по 0.1 сек
+    assert transport.times()[-1] - started == pytest.approx(0.5, abs=0.1)
+
+
+def test_group_chat_uses_group_rate(transport):
+    outbox = make_outbox(transport, chat_burst=1, group_rate=5.0)
+    started, _ = send_all(outbox, [(-100, f'g{i}', REPLY) for i in range(3)])
+    assert transport.times()[-1] - started == pytest.approx(0.4, abs=0.08)
+
+
+# ===== ОШИБКИ =====
+def test_429_pauses_chat_for_retry_after(transport):
+    transport.failures['first'] = [ApiError(429, retry_after=0.3)]
+    outbox = make_outbox(transport)
+    started, futures = send_all(outbox, [(1, 'first', REPLY), (2, 'other', REPLY)])
+    
+    assert futures[0].result() == 'first'
+    assert transport.attempts['first'] == 2
+    # Повтор - не раньше retry_after; другой чат при этом не ждал
+    assert transport.times('first')[0] - started >= 0.3
+    assert transport.times('other')[0] - started < 0.1
+    snapshot = outbox.metrics.snapshot()
+    assert snapshot['throttled'] == 1 and snapshot['retries'] == 0
+
+
+def test_long_429_pauses_whole_bot(transport):
+    transport.failures['first'] = [ApiError(429, retry_after=1.2)]
+    outbox = make_outbox(transport)
+    futures = [outbox.submit(1, 'send_message', 1, 'first')]
+    outbox.start()
+    try:
+        # Первый ответ получен - retry_after > 1 блокирует и остальные чаты
+        while not transport.attempts.get('first'):
+            time.sleep(0.01)
+        time.sleep(0.05)
+        blocked_at = time.monotonic()
+        futures.append(outbox.submit(2, 'send_message', 2, 'other'))
+        for future in futures:
+            future.result(10)
+    finally:
+        outbox.stop()
+    assert transport.times('other')[0] - blocked_at >= 1.0
+
+
+def test_retry_with_backoff_up_to_max_attempts(transport):
+    transport.failures['flaky'] = [ApiError(None), ApiError(502)]
+    transport.failures['down'] = [ApiError(None)] * 10
+    outbox = make_outbox(transport, max_attempts=3, backoff=0.05)
+    started, futures = send_all(outbox, [(1, 'flaky', REPLY), (2, 'down', REPLY)])
+    
+    assert futures[0].result() == 'flaky'
+    # Паузы 0.05 и 0.1 сек между попытками
+    assert transport.times('flaky')[0] - started >= 0.15
+    assert isinstance(futures[1].exception(), ApiError)
+    assert transport.attempts['down'] == 3
+    snapshot = outbox.metrics.snapshot()
+    assert snapshot['retries'] == 4 and snapshot['failed']['reply'] == 1
+
+
+def test_client_error_is_not_retried(transport):
+    transport.failures['blocked'] = [ApiError(403)]
+    _, futures = send_all(make_outbox(transport), [(1, 'blocked', REPLY)])
+    assert futures[0].exception().error_code == 403
+    assert transport.attempts['blocked'] == 1
+
+
+# ===== ОСТАНОВКА =====
+def test_stop_fails_messages_waiting_for_retry(transport):
+    transport.failures['late'] = [ApiError(429, retry_after=5)]
+    outbox = make_outbox(transport)
+    future = outbox.submit(1, 'send_message', 1, 'late')
+    outbox.start()
+    while not transport.attempts.get('late'):
+        time.sleep(0.01)
+    # Повтор ждет retry_after дольше, чем stop готов ждать
+    outbox.stop(timeout=0.2)
+    assert isinstance(future.exception(1), RuntimeError)
+    assert outbox.metrics.snapshot()['failed']['reply'] == 1
+
+
+def test_idle_chat_buckets_are_forgotten(transport):
+    outbox = make_outbox(transport)
+    outbox.MAX_CHAT_BUCKETS = 5
+    outbox.start()
+    try:
+        for chat in range(20):
+            outbox.submit(chat, 'send_message', chat, f'm{chat}').result(5)
+            time.sleep(0.005)
+    finally:
+        outbox.stop()
+    assert len(transport.sent) == 20
+    assert len(outbox._chat_buckets) <= 5
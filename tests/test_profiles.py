@@ -0,0 +1,12 @@
+from profiles import ProfileStore, SqliteBackend
+
+
+def test_shared_profiles_are_counted_in_backend(tmp_path):
+    db = str(tmp_path / 'profiles.db')
+    first = ProfileStore(SqliteBackend(db), shared=True)
+    second = ProfileStore(SqliteBackend(db), shared=True)
+    first.remember(1, 'Иван')
+    # То же имя у другого человека - не ошибка, занятость проверяет список
+    second.remember(2, 'иван')
+    assert len(first) == len(second) == 2
+    assert (second.get(1), first.get(2)) == ('Иван', 'иван')
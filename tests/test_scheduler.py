@@ -0,0 +1,169 @@
+from datetime import datetime
+
+import pytest
+from pytz import timezone
+
+from schedule import RecurringSchedule, Slot
+from scheduler import FakeClock, Scheduler
+
+MOSCOW = timezone('Europe/Moscow')
+
+
+def moscow(*args):
+    return MOSCOW.localize(datetime(*args)).timestamp()
+
+
+@pytest.fixture
+def clock():
+    return FakeClock(1000)
+
+
+@pytest.fixture
+def scheduler(clock):
+    return Scheduler(clock)
+
+
+# ===== ОЧЕРЕДЬ СОБЫТИЙ =====
+def test_events_run_in_time_order(scheduler, clock):
+    done = []
+    for when, name in ((1030, 'c'), (1010, 'a'), (1020, 'b1'), (1020, 'b2')):
+        scheduler.at(when, done.append, name)
+    assert scheduler.next_deadline() == 1010
+    
+    assert scheduler.run_pending() == 0
+    clock.advance(20)
+    assert scheduler.run_pending() == 3
+    # Одинаковый срок - в порядке добавления
+    assert done == ['a', 'b1', 'b2']
+    clock.advance(100)
+    scheduler.run_pending()
+    assert done == ['a', 'b1', 'b2', 'c']
+    assert len(scheduler) == 0 and scheduler.next_deadline() is None
+
+
+def test_cancel_and_reschedule_by_key(scheduler, clock):
+    done = []
+    scheduler.after(10, done.append, 'old', key='reminder')
+    scheduler.after(20, done.append, 'other', key='other')
+    # Тот же ключ заменяет событие
+    scheduler.after(30, done.append, 'new', key='reminder')
+    assert len(scheduler) == 2 and scheduler.when('reminder') == 1030
+    
+    assert scheduler.cancel('other')
+    assert not scheduler.cancel('other')
+    assert not scheduler.has('other')
+    # Отмененные записи в куче не мешают искать ближайший срок
+    assert scheduler.next_deadline() == 1030
+    
+    clock.advance(60)
+    assert scheduler.run_pending() == 1
+    assert done == ['new'] and not scheduler.has('reminder')
+
+
+def test_callback_can_schedule_and_fail(scheduler, clock):
+    done = []
+    
+    def chain():
+        done.append('chain')
+        # Срок уже наступил - выполнится в этом же вызове
+        scheduler.at(clock.now() - 1, done.append, 'late')
+    
+    def broken():
+        raise RuntimeError('сбой')
+    
+    scheduler.after(1, broken)
+    scheduler.after(2, chain)
+    clock.advance(5)
+    assert scheduler.run_pending() == 3
+    assert done == ['chain', 'late']
+    assert scheduler.executed == 3
+
+
+# ===== РАСПИСАНИЕ =====
+class Trainings:
+    """Тренировки в памяти для RecurringSchedule"""
+    
+    def __init__(self):
+        self.items = {}
+        self.archived_occurrences = set()
+        self.log = []
+    
+    def find(self, occurrence):
+        for training_id, item in self.items.items():
+            if item['occurrence'] == occurrence:
+                return training_id
+        return None
+    
+    def archived(self, occurrence):
+        return occurrence in self.archived_occurrences
+    
+    def create(self, slot, start, occurrence, registration_open):
+        training_id = len(self.items) + len(self.archived_occurrences) + 1
+        self.items[training_id] = {'occurrence': occurrence, 'open': registration_open}
+        self.log.append(('create', occurrence, registration_open))
+    
+    def set_open(self, training_id, value):
+        self.items[training_id]['open'] = value
+        self.log.append(('open', self.items[training_id]['occurrence'], value))
+    
+    def archive(self, training_id):
+        occurrence = self.items.pop(training_id)['occurrence']
+        self.archived_occurrences.add(occurrence)
+        self.log.append(('archive', occurrence))
+
+
+def recurring(scheduler, trainings, slots):
+    return RecurringSchedule(slots, scheduler, MOSCOW, trainings.find, trainings.archived,
+                             trainings.create, trainings.set_open, trainings.archive)
+
+
+def run_until(scheduler, clock, when):
+    """Двигать часы от события к событию до `when`"""
+    while True:
+        deadline = scheduler.next_deadline()
+        if deadline is None or deadline > when:
+            break
+        clock.set(deadline)
+        scheduler.run_pending()
+    clock.set(when)
+
+
+def test_recurring_slot_across_week_boundary(scheduler, clock):
+    # Пятница, 20:00 МСК; слот - понедельник 20:45, запись за 72 часа
+    clock.set(moscow(2030, 1, 4, 20, 0))
+    trainings = Trainings()
+    slot = Slot('Понедельник', '20:45', 'Пехорка', open_before=72, close_before=1)
+    recurring(scheduler, trainings, [slot]).start()
+    assert scheduler.when('0-20:45/2030-01-07:create') == moscow(2030, 1, 4, 20, 45)
+    
+    run_until(scheduler, clock, moscow(2030, 1, 14, 23, 0))
+    assert trainings.log == [
+        ('create', '0-20:45/2030-01-07', True),
+        ('open', '0-20:45/2030-01-07', False),
+        ('archive', '0-20:45/2030-01-07'),
+        # Через границу недели - снова пятница 20:45 (в Москве нет перехода
+        # на летнее время, сдвига на час нет)
+        ('create', '0-20:45/2030-01-14', True),
+        ('open', '0-20:45/2030-01-14', False),
+    ]
+    assert scheduler.when('0-20:45/2030-01-21:create') == moscow(2030, 1, 18, 20, 45)
+    assert scheduler.when('0-20:45/2030-01-14:archive') == moscow(2030, 1, 14, 23, 45)
+
+
+def test_recurring_restart_catches_up_once(clock):
+    slot = Slot('Воскресенье', '10:00', 'Пехорка', open_before=48, close_before=2)
+    trainings = Trainings()
+    clock.set(moscow(2030, 1, 4, 12, 0))
+    first = Scheduler(clock)
+    recurring(first, trainings, [slot]).start()
+    run_until(first, clock, moscow(2030, 1, 5, 12, 0))
+    assert trainings.log == [('create', '6-10:00/2030-01-06', True)]
+    
+    # Бот лежал с субботы до воскресенья 11:00 - после перезапуска
+    # пропущенное закрытие выполняется сразу, тренировка не дублируется
+    clock.set(moscow(2030, 1, 6, 11, 0))
+    second = Scheduler(clock)
+    recurring(second, trainings, [slot]).start()
+    second.run_pending()
+    assert trainings.log[1:] == [('open', '6-10:00/2030-01-06', False)]
+    assert len(trainings.items) == 1
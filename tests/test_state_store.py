@@ -0,0 +1,113 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+import state_store
+from journal import write_atomic
+from roster import state_from_json, state_to_json
+from sqlite_store import SqliteStore
+from state_store import StateStore
+
+
+def wait_for(check, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if check():
+            return True
+        time.sleep(0.02)
+    return check()
+
+
+def read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def test_mark_dirty_in_journal_mode_writes_snapshot(tmp_path):
+    path = str(tmp_path / 'data.json')
+    store = StateStore(path, lambda: {'n': 0}, journal_path=str(tmp_path / 'data.journal'),
+                       compact_interval=60.0)
+    store.load()
+    store.start()
+    store.compact()
+    try:
+        # Изменение мимо apply: в журнале его нет, записей для свертки тоже
+        store.data['n'] = 5
+        assert store.journal.pending == 0
+        store.mark_dirty()
+        assert wait_for(lambda: (read_json(path) or {}).get('n') == 5)
+    finally:
+        store.close()
+
+
+def test_journal_replay_after_restart(tmp_path):
+    path = str(tmp_path / 'data.json')
+    journal = str(tmp_path / 'data.journal')
+    store = StateStore(path, lambda: {'n': 0}, journal_path=journal)
+    store.load()
+    store.apply({'op': 'reset', 'data': {'n': 7}, 'update': 42})
+    # Без close: снимок не записан, состояние восстанавливается из журнала
+    store.journal.close()
+    
+    again = StateStore(path, lambda: {'n': 0}, journal_path=journal)
+    assert again.load() == {'n': 7}
+    assert again.has_update(42)
+    again.close()
+
+
+@pytest.mark.parametrize('mode', ['snapshot', 'journal', 'sqlite'])
+def test_close_twice_is_safe(tmp_path, mode):
+    kwargs = dict(default_factory=lambda: {'trainings': []},
+                  decode=state_from_json, encode=state_to_json)
+    if mode == 'sqlite':
+        store = SqliteStore(str(tmp_path / 'data.db'), **kwargs)
+    else:
+        journal = str(tmp_path / 'data.journal') if mode == 'journal' else None
+        store = StateStore(str(tmp_path / 'data.json'), journal_path=journal, **kwargs)
+    store.load()
+    store.start()
+    store.close()
+    # Второй путь остановки (atexit, выгрузка шарда) не падает
+    store.close()
+
+
+def test_concurrent_flush_keeps_latest_state(tmp_path, monkeypatch):
+    path = str(tmp_path / 'data.json')
+    journal = str(tmp_path / 'data.journal')
+    store = StateStore(path, lambda: {'n': 0}, journal_path=journal)
+    store.load()
+    
+    # Первая свертка застревает на записи снимка, пока не пройдет вторая
+    # (или полсекунды, если вторая ждет первую)
+    second_done = threading.Event()
+    calls = []
+    
+    def slow_write(target, payload):
+        calls.append(target)
+        if len(calls) == 1:
+            second_done.wait(0.5)
+        write_atomic(target, payload)
+    monkeypatch.setattr(state_store, 'write_atomic', slow_write)
+    
+    store.apply({'op': 'reset', 'data': {'n': 1}})
+    first = threading.Thread(target=store.flush)
+    first.start()
+    assert wait_for(lambda: calls)
+    # /restore в другом потоке: новое состояние и своя свертка
+    store.apply({'op': 'reset', 'data': {'n': 2}})
+    second = threading.Thread(target=lambda: (store.flush(), second_done.set()))
+    second.start()
+    first.join()
+    second.join()
+    store.journal.close()
+    
+    again = StateStore(path, lambda: {'n': 0}, journal_path=journal)
+    assert again.load()['n'] == 2
+    again.close()
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
@@ -0,0 +1,70 @@
+import threading
+import time
+from types import SimpleNamespace
+
+from tenants import TEST_LIMITS, Tenant, TenantRegistry
+
+
+def test_render_cache_follows_limits_and_test_mode():
+    store = SimpleNamespace(version=1)
+    chat = Tenant(None, {'admins': [1], 'max_main': 20, 'max_reserve': 10}, store)
+    
+    def render():
+        max_main, max_reserve = chat.limits()
+        return f"{max_main}/{max_reserve} test={chat.settings['test_mode']}"
+    
+    assert chat.render_cache.get('list', render) == '20/10 test=False'
+    # /limits: версия хранилища та же, текст - новый
+    chat.settings['max_main'] = 18
+    assert chat.render_cache.get('list', render) == '18/10 test=False'
+    chat.settings['test_mode'] = True
+    assert chat.render_cache.get('list', render) == f'{TEST_LIMITS[0]}/{TEST_LIMITS[1]} test=True'
+    assert chat.render_cache.get('list', render) == f'{TEST_LIMITS[0]}/{TEST_LIMITS[1]} test=True'
+    assert (chat.render_cache.hits, chat.render_cache.misses) == (1, 3)
+
+
+class Shard:
+    """Хранилище шарда: close сохраняет данные, пока не разрешат"""
+    
+    def __init__(self, path, events, release):
+        self.path = path
+        self.events = events
+        self.release = release
+        self.version = 0
+    
+    def close(self):
+        self.events.append(('closing', self.path))
+        self.release.wait(5)
+        self.events.append(('closed', self.path))
+
+
+def test_shard_is_not_reloaded_while_closing(tmp_path):
+    events, release = [], threading.Event()
+    
+    def open_shard(path):
+        events.append(('open', path))
+        return Shard(path, events, release), None
+    registry = TenantRegistry(str(tmp_path), open_shard, default=None, max_loaded=1)
+    for chat_id in (1, 2):
+        registry.create(chat_id, f'Группа {chat_id}', admin_id=1)
+    
+    def use(chat_id):
+        with registry.use(chat_id):
+            pass
+    use(1)
+    # Группа 2 вытесняет группу 1, ее сохранение затягивается
+    evicting = threading.Thread(target=use, args=(2,))
+    evicting.start()
+    first = registry.path(1)
+    while ('closing', first) not in events:
+        time.sleep(0.01)
+    reloading = threading.Thread(target=use, args=(1,))
+    reloading.start()
+    time.sleep(0.1)
+    assert events.count(('open', first)) == 1
+    release.set()
+    evicting.join(5)
+    reloading.join(5)
+    # Шард перечитан только после того, как его сохранили
+    opened = [i for i, event in enumerate(events) if event == ('open', first)]
+    assert len(opened) == 2 and opened[1] > events.index(('closed', first))
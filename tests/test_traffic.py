@@ -0,0 +1,59 @@
+from traffic import Redactor, TrafficRecorder, read
+
+
+def test_redactor_is_stable_and_keeps_shape():
+    redact = Redactor(b'secret')
+    assert redact.id(12345) == redact.id(12345) != 12345
+    assert redact.id(-100123) < 0
+    # Имена сравниваются как в списках
+    assert redact.name('Иван Петров') == redact.name(' иван петров ')
+    assert Redactor(b'other').name('Иван Петров') != redact.name('Иван Петров')
+    
+    assert redact.text('👥 Список', keep={'👥 Список'}) == '👥 Список'
+    assert redact.text('20:45') == '20:45'
+    assert redact.text('/start ref') == f"/start {redact.name('ref')}"
+    assert redact.text('Иван\n3, 5') == f"{redact.name('Иван')}\n3, 5"
+
+
+def test_update_drops_personal_data():
+    redact = Redactor(b'secret')
+    update = {'update_id': 7, 'message': {
+        'message_id': 1, 'date': 100, 'text': 'Иван',
+        'from': {'id': 42, 'first_name': 'Иван', 'username': 'ivan'},
+        'chat': {'id': 42, 'type': 'private'},
+        'contact': {'phone_number': '+70000000000'},
+    }}
+    message = redact.update(update)['message']
+    assert 'contact' not in message
+    assert message['from'] == {'id': redact.id(42), 'first_name': redact.name('Иван'),
+                               'username': redact.name('ivan')}
+    assert message['chat']['id'] == message['from']['id']
+    assert message['text'] == redact.name('Иван')
+    assert (message['message_id'], message['date']) == (1, 100)
+
+
+def test_recorder_round_trip(tmp_path):
+    path = str(tmp_path / 'traffic.jsonl')
+    now = [10.0]
+    redact = Redactor(b'secret')
+    state = {'trainings': [{'id': 1, 'main': [{'id': 42, 'display_name': 'Иван'}]}]}
+    
+    recorder = TrafficRecorder(path, redact, clock=lambda: now[0])
+    recorder.start(1, state, profiles=[(42, 'Иван')])
+    now[0] = 10.5
+    recorder.inbound({'update_id': 1, 'message': {'text': '👥 Список'}})
+    recorder.outbound('send_message', 42, 0.01, True)
+    recorder.stop(state)
+    recorder.inbound({'update_id': 2})
+    # Недописанная строка после сбоя и следующий запуск бота
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"t": 1, "in"\n{"traffic": 1}\n')
+    
+    header, events, end = read(path)
+    assert header['admin'] == redact.id(1)
+    assert header['profiles'] == [[redact.id(42), redact.name('Иван')]]
+    assert [event.get('in', {}).get('update_id') for event in events] == [1, None]
+    assert events[0]['t'] == 0.5
+    assert events[1] == {'t': 0.5, 'out': 'send_message', 'chat': redact.id(42),
+                         's': 0.01, 'ok': 1}
+    assert end['trainings'][0]['main'] == [{'id': redact.id(42), 'display_name': redact.name('Иван')}]
@@ -0,0 +1,82 @@
+import threading
+import time
+from types import SimpleNamespace
+
+from updates import UpdateLog, UpdatePoller
+
+
+class FakeBot:
+    """getUpdates как у Telegram: все, что раньше offset, подтверждено и
+    удаляется, возвращается не больше limit"""
+    
+    def __init__(self, count):
+        self.pending = [SimpleNamespace(update_id=i) for i in range(1, count + 1)]
+        self.offsets = []
+    
+    def get_updates(self, offset, limit, timeout, long_polling_timeout):
+        self.offsets.append(offset)
+        self.pending = [u for u in self.pending if u.update_id >= offset]
+        if not self.pending:
+            time.sleep(0.01)
+        return self.pending[:limit]
+
+
+class Store:
+    version = durable_version = 0
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_poller_waits_instead_of_confirming_unfinished(tmp_path):
+    bot = FakeBot(250)
+    log = UpdateLog(str(tmp_path / 'updates.json'))
+    release = threading.Event()
+    handled = []
+    
+    def dispatch(update):
+        # Первое обновление обрабатывается долго
+        if update.update_id == 1:
+            release.wait()
+        handled.append(update.update_id)
+    
+    poller = UpdatePoller(bot, log, dispatch, workers=4, timeout=0)
+    server = threading.Thread(target=poller.serve_forever)
+    server.start()
+    try:
+        # Получено limit=100 от незавершенного 1 - дальше опрос ждет
+        assert wait_for(lambda: len(handled) == 99)
+        calls = len(bot.offsets)
+        time.sleep(0.3)
+        assert len(bot.offsets) == calls
+        # Offset не уходил дальше незавершенного: Telegram его хранит
+        assert max(bot.offsets) <= log.offset == 1
+        assert bot.pending[0].update_id == 1
+        release.set()
+        assert wait_for(lambda: log.offset == 251)
+    finally:
+        release.set()
+        poller.stop()
+        poller.join(10)
+    assert sorted(handled) == list(range(1, 251))
+    assert poller.stats['received'] == 250
+
+
+def test_restart_skips_handled_updates(tmp_path):
+    path = str(tmp_path / 'updates.json')
+    log = UpdateLog(path)
+    for update_id in (1, 2, 4):
+        log.begin(update_id)
+        log.done(update_id, Store())
+    log.begin(3)
+    log.save()
+    
+    restored = UpdateLog(path)
+    restored.load()
+    # Незавершенное 3 придет снова, уже обработанное 4 - пропускается
+    assert restored.offset == 3
+    assert restored.begin(3) and not restored.begin(4)
@@ -0,0 +1,235 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from roster import LISTS, name_key
+
+logger = logging.getLogger(__name__)
+
+# Строки, которые не бывают именами: время, дата, номера из списка
+PLAIN = re.compile(r'^[\d\s:.,\-–/]*$')
+
+# Поля Telegram с именами пользователей и чатов
+NAME_FIELDS = ('first_name', 'last_name', 'username', 'title')
+# Вложенные объекты, у которых 'id' - пользователь или чат
+PEOPLE = ('from', 'chat', 'user', 'sender_chat')
+# Поля, которые в запись не попадают совсем
+DROPPED = ('contact', 'location', 'photo', 'document', 'voice', 'entities')
+
+
+class Redactor:
+    """Замена id и имен псевдонимами.
+    
+    Псевдоним - HMAC от `secret`: один и тот же человек в записи всегда
+    под одним id и одним именем (повторы и "имя уже занято" сохраняются),
+    а восстановить настоящие без секрета нельзя. Имена сравниваются как в
+    списках (name_key), знак id сохраняется (группы - отрицательные).
+    """
+    
+    def __init__(self, secret=None):
+        self.secret = secret or os.urandom(16)
+    
+    def _digest(self, value):
+        return hmac.new(self.secret, str(value).encode('utf-8'), hashlib.sha256).hexdigest()
+    
+    def id(self, value):
+        if not isinstance(value, int):
+            return value
+        pseudo = 10 ** 9 + int(self._digest(abs(value))[:8], 16) % 10 ** 9
+        return -pseudo if value < 0 else pseudo
+    
+    def name(self, value):
+        if not value:
+            return value
+        return f"Игрок-{self._digest(name_key(value))[:6]}"
+    
+    def text(self, value, keep=()):
+        """Текст сообщения: кнопки и команды остаются, остальное - по
+        строкам псевдонимами (в ответах на вопросы бота - имена)"""
+        if not value or value in keep:
+            return value
+        if value.startswith('/'):
+            command, _, rest = value.partition(' ')
+            return f"{command} {self.text(rest, keep)}" if rest else command
+        return '\n'.join(line if PLAIN.match(line) else self.name(line)
+                         for line in value.split('\n'))
+    
+    def update(self, update, keep=()):
+        """Копия обновления Telegram (JSON) без настоящих id и имен"""
+        if isinstance(update, list):
+            return [self.update(item, keep) for item in update]
+        if not isinstance(update, dict):
+            return update
+        result = {}
+        for key, value in update.items():
+            if key in DROPPED:
+                continue
+            if key in PEOPLE and isinstance(value, dict):
+                value = dict(value, id=self.id(value.get('id')))
+                result[key] = {k: self.name(v) if k in NAME_FIELDS else v for k, v in value.items()}
+            elif key in ('text', 'caption'):
+                result[key] = self.text(value, keep)
+            else:
+                result[key] = self.update(value, keep)
+        return result
+    
+    def state(self, state):
+        """Копия состояния (state_to_json) с псевдонимами участников"""
+        trainings = []
+        for training in state['trainings']:
+            training = dict(training)
+            for list_name in LISTS:
+                training[list_name] = [self._participant(user) for user in training.get(list_name, [])]
+            trainings.append(training)
+        return dict(state, trainings=trainings)
+    
+    def _participant(self, user):
+        user = dict(user, display_name=self.name(user['display_name']))
+        for key, redact in (('id', self.id), ('username', self.name)):
+            if key in user:
+                user[key] = redact(user[key])
+        return user
+
+
+def raw_update(update):
+    """JSON обновления: из вебхука - как есть, объект telebot - по json
+    вложенных объектов (у самого Update его нет)"""
+    if isinstance(update, dict):
+        return update
+    raw = {'update_id': update.update_id}
+    for kind in ('message', 'edited_message', 'callback_query', 'my_chat_member'):
+        value = getattr(update, kind, None)
+        if value is not None:
+            raw[kind] = value.json
+    return raw
+
+
+class TrafficRecorder:
+    """Запись трафика бота для воспроизведения (replay.py).
+    
+    Файл `path` дописывается построчно (JSON, без пробелов):
+    * заголовок - псевдоним ADMIN_ID, состояние и профили на начало;
+    * {"t": сек от начала, "in": обновление} - входящее, в порядке
+      получения (до очереди обработки, в том числе то, что будет
+      отброшено);
+    * {"t", "out": метод, "chat", "s": длительность, "ok"} - вызов
+      Telegram API (тексты ответов не пишутся);
+    * {"t", "end": состояние} - при остановке.
+    
+    Id и имена заменяются псевдонимами (Redactor), `keep` - тексты
+    кнопок, которые остаются как есть.
+    """
+    
+    def __init__(self, path, redactor, keep=(), clock=time.monotonic):
+        self.path = path
+        self.redactor = redactor
+        self.keep = frozenset(keep)
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.events = 0
+        self._file = None
+        self._started = 0.0
+    
+    def _write(self, entry):
+        line = json.dumps(entry, ensure_ascii=False, separators=(',', ':'))
+        with self.lock:
+            if self._file is None:
+                return
+            self._file.write(line + '\n')
+            self.events += 1
+    
+    def _since(self):
+        return round(self.clock() - self._started, 3)
+    
+    def start(self, admin_id, state, profiles=()):
+        """Открыть файл и записать заголовок (состояние - state_to_json,
+        профили - [(id, имя)])"""
+        # Построчная буферизация: после сбоя в файле все, кроме последней строки
+        self._file = open(self.path, 'a', encoding='utf-8', buffering=1)
+        self._started = self.clock()
+        redact = self.redactor
+        self._write({
+            'traffic': 1,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'admin': redact.id(admin_id),
+            'state': redact.state(state),
+            'profiles': [[redact.id(user_id), redact.name(name)] for user_id, name in profiles],
+        })
+        logger.info(f"🎙 Запись трафика: {self.path}")
+    
+    def inbound(self, update):
+        self._write({'t': self._since(), 'in': self.redactor.update(raw_update(update), self.keep)})
+    
+    def outbound(self, method, chat_id, seconds, ok):
+        self._write({'t': self._since(), 'out': method, 'chat': self.redactor.id(chat_id),
+                     's': round(seconds, 4), 'ok': int(ok)})
+    
+    def stop(self, state):
+        if self._file is None:
+            return
+        self._write({'t': self._since(), 'end': self.redactor.state(state)})
+        with self.lock:
+            self._file.close()
+            self._file = None
+    
+    # ===== ПОДКЛЮЧЕНИЕ К БОТУ =====
+    def wrap(self, obj, attr):
+        """Записывать каждый вызов метода объекта как входящее обновление"""
+        func = getattr(obj, attr)
+        
+        def recorded(update, *args, **kwargs):
+            if update is not None:
+                try:
+                    self.inbound(update)
+                except Exception as e:
+                    logger.warning(f"Не удалось записать обновление: {e}")
+            return func(update, *args, **kwargs)
+        setattr(obj, attr, recorded)
+    
+    def wrap_api(self, bot, methods):
+        """Записывать вызовы Telegram API (чат - chat_id или первый аргумент)"""
+        for method in methods:
+            func = getattr(bot, method)
+            
+            def recorded(*args, func=func, method=method, **kwargs):
+                started = time.perf_counter()
+                ok = False
+                try:
+                    result = func(*args, **kwargs)
+                    ok = True
+                    return result
+                finally:
+                    chat_id = kwargs.get('chat_id', args[0] if args else None)
+                    self.outbound(method, chat_id, time.perf_counter() - started, ok)
+            setattr(bot, method, recorded)
+
+
+def read(path):
+    """(заголовок, события, конечное состояние или None) из файла записи"""
+    header, events, end = None, [], None
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Недописанная строка при сбое
+                continue
+            if 'traffic' in entry:
+                if header is None:
+                    header = entry
+                else:
+                    # Файл дописывается: следующий запуск бота - новая запись
+                    logger.warning(f"В {path} несколько записей - берем первую")
+                    break
+            elif 'end' in entry:
+                end = entry['end']
+            else:
+                events.append(entry)
+    if header is None:
+        raise ValueError(f"{path}: нет заголовка записи трафика")
+    return header, events, end
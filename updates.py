@@ -0,0 +1,249 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+from journal import write_atomic
+
+logger = logging.getLogger(__name__)
+
+# dispatch вернул DEFERRED: обновление еще не обработано (ждет пачки),
+# UpdateLog.done для него вызовет тот, кто его обработает
+DEFERRED = object()
+
+
+class UpdateLog:
+    """Какие обновления Telegram уже обработаны.
+    
+    * `offset` - с какого update_id продолжать: все, что раньше, уже
+      обработано. Обновления обрабатываются параллельно и завершаются не
+      по порядку, поэтому это нижняя граница незавершенных, а не
+      максимальный id;
+    * недавние id (не больше `recent`) - повторная доставка того же
+      обновления пропускается.
+    
+    Файл `path` (None - только в памяти) перезаписывается не чаще раза в
+    `save_interval` секунд. Если последние секунды не успели сохраниться,
+    после перезапуска эти обновления придут снова: изменения списков они
+    не повторят - id обновления сохраняется в хранилище вместе с
+    изменением (StateStore.has_update), а просмотр списка безвреден.
+    """
+    
+    def __init__(self, path, recent=1000, save_interval=1.0, clock=time.monotonic):
+        self.path = path
+        self.recent = recent
+        self.save_interval = save_interval
+        self.clock = clock
+        self._cond = threading.Condition()
+        self._done = OrderedDict()
+        self._in_flight = set()
+        # Обработаны, но изменения еще не на диске: {id: (хранилище, версия)}
+        self._unsaved = {}
+        self._next = 0
+        # Самый большой полученный id (см. backlog)
+        self._last = -1
+        self._saved_at = 0.0
+        # Пропущено повторно полученных: повторная доставка или обновления
+        # после еще не подтвержденного (offset отстает)
+        self.skipped = 0
+    
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Не удалось прочитать {self.path}: {e}")
+            return
+        with self._cond:
+            self._next = saved.get('offset', 0)
+            self._last = self._next - 1
+            for update_id in saved.get('recent', []):
+                self._done[update_id] = None
+        logger.info(f"📨 Продолжаем с обновления {self._next}")
+    
+    @property
+    def offset(self):
+        """Первый id, который нужно (еще раз) получить у Telegram"""
+        with self._cond:
+            return min(self._in_flight | self._not_durable(), default=self._next)
+    
+    def _not_durable(self):
+        for update_id, (store, version) in list(self._unsaved.items()):
+            if store.durable_version >= version:
+                del self._unsaved[update_id]
+        return set(self._unsaved)
+    
+    # ===== ОБРАБОТКА =====
+    def begin(self, update_id):
+        """Взять обновление в работу; False - уже обработано или в работе"""
+        with self._cond:
+            if update_id in self._done or update_id in self._in_flight:
+                self.skipped += 1
+                return False
+            self._in_flight.add(update_id)
+            self._last = max(self._last, update_id)
+            return True
+    
+    def done(self, update_id, store=None):
+        """Обновление обработано. `store` - хранилище, которое оно могло
+        изменить: пока изменения не записаны на диск (отложенная запись
+        снимка), offset не сдвигается дальше этого обновления"""
+        with self._cond:
+            self._in_flight.discard(update_id)
+            if store is not None and store.durable_version < store.version:
+                self._unsaved[update_id] = (store, store.version)
+            self._done[update_id] = None
+            while len(self._done) > self.recent:
+                self._done.popitem(last=False)
+            self._next = max(self._next, update_id + 1)
+            self._last = max(self._last, update_id)
+            self._cond.notify_all()
+            due = self.clock() - self._saved_at >= self.save_interval
+        if due:
+            self.save()
+    
+    def backlog(self):
+        """Сколько id от offset до самого большого полученного: столько
+        уже полученных getUpdates вернет раньше новых"""
+        with self._cond:
+            offset = min(self._in_flight | self._not_durable(), default=self._next)
+            return max(0, self._last + 1 - offset)
+    
+    def wait(self, timeout):
+        """Подождать, пока сдвинется offset: завершится обновление в
+        работе или изменения обработанных будут записаны на диск"""
+        with self._cond:
+            if self._in_flight or self._not_durable():
+                self._cond.wait(timeout)
+    
+    def save(self):
+        if not self.path:
+            return
+        with self._cond:
+            self._saved_at = self.clock()
+            pending = self._in_flight | self._not_durable()
+            payload = json.dumps({
+                'offset': min(pending, default=self._next),
+                'recent': [update_id for update_id in self._done if update_id not in pending],
+            })
+        try:
+            write_atomic(self.path, payload)
+        except OSError as e:
+            logger.error(f"Не удалось сохранить {self.path}: {e}")
+
+
+class UpdatePoller:
+    """Получение обновлений через getUpdates вместо bot.polling.
+    
+    bot.polling подтверждает обновления (сдвигает offset) сразу при
+    получении, еще до обработки: при перезапуске полученное, но не
+    обработанное терялось. Здесь Telegram получает offset из UpdateLog -
+    пока обновление не обработано (или его изменения не на диске), оно
+    остается неподтвержденным и после перезапуска придет снова.
+    
+    getUpdates с этим offset возвращает и уже полученные обновления - они
+    пропускаются по недавним id UpdateLog. Если от offset получено уже
+    `limit` обновлений, новых в ответе не будет: опрос ждет, пока offset
+    сдвинется, а не запрашивает одно и то же.
+    
+    Обработчики вызываются в рабочих потоках (`workers`), как у
+    WebhookServer; очередь ограничена, при заполнении опрос ждет.
+    `dispatch(update)` возвращает хранилище, которое обновление могло
+    изменить (см. UpdateLog.done), None или DEFERRED. `inbox` - своя очередь
+    вместо queue.Queue (например, admission.AdmissionQueue).
+    """
+    
+    def __init__(self, bot, log, dispatch, workers=4, timeout=30, limit=100, queue_size=1000,
+                 inbox=None):
+        self.bot = bot
+        self.log = log
+        self.dispatch = dispatch
+        self.timeout = timeout
+        self.limit = limit
+        self.queue = inbox if inbox is not None else queue.Queue(maxsize=queue_size)
+        self.stats = {'received': 0, 'failed': 0}
+        self._stopped = threading.Event()
+        self._finished = threading.Event()
+        self._workers = [
+            threading.Thread(target=self._work, name=f'update-worker-{i}', daemon=True)
+            for i in range(workers)
+        ]
+    
+    def _poll(self):
+        # Пауза после ошибки растет 1, 2, 4 ... 30 сек
+        delay = 1
+        while not self._stopped.is_set():
+            if self.log.backlog() >= self.limit:
+                # Ответ целиком из уже полученных - ждем обработки
+                self.log.wait(0.1)
+                continue
+            try:
+                updates = self.bot.get_updates(
+                    offset=self.log.offset, limit=self.limit,
+                    timeout=self.timeout + 10, long_polling_timeout=self.timeout
+                )
+            except Exception as e:
+                logger.error(f"Ошибка getUpdates: {e}")
+                self._stopped.wait(delay)
+                delay = min(delay * 2, 30)
+                continue
+            delay = 1
+            fresh = [update for update in updates if self.log.begin(update.update_id)]
+            for update in fresh:
+                if self._stopped.is_set():
+                    # Остается "в работе": сохраненный offset не уйдет дальше
+                    # него, после перезапуска обновление придет снова
+                    break
+                self.queue.put(update)
+            self.stats['received'] += len(fresh)
+            if updates and not fresh:
+                # Пришли только уже полученные обновления (offset ждет
+                # обработки или записи на диск) - не опрашиваем Telegram
+                # вхолостую, но и новые надолго не задерживаем
+                self.log.wait(0.1)
+    
+    def _work(self):
+        while True:
+            update = self.queue.get()
+            if update is None:
+                return
+            store = None
+            try:
+                store = self.dispatch(update)
+            except Exception as e:
+                self.stats['failed'] += 1
+                logger.error(f"Ошибка обработки обновления {update.update_id}: {e}")
+            if store is not DEFERRED:
+                self.log.done(update.update_id, store)
+    
+    def serve_forever(self):
+        """Опрашивать Telegram до вызова stop (в текущем потоке ждем)"""
+        for worker in self._workers:
+            worker.start()
+        # Долгий запрос getUpdates не задерживает остановку: поток опроса
+        # бросаем, а то, что он успел получить, не подтверждено
+        threading.Thread(target=self._poll, name='update-poller', daemon=True).start()
+        try:
+            while not self._stopped.wait(1):
+                pass
+        finally:
+            # Дорабатываем то, что уже в очереди
+            for _ in self._workers:
+                self.queue.put(None)
+            for worker in self._workers:
+                worker.join()
+            self.log.save()
+            self._finished.set()
+    
+    def stop(self):
+        """Остановить опрос (serve_forever доработает очередь и вернется)"""
+        self._stopped.set()
+    
+    def join(self, timeout=None):
+        """Дождаться, пока serve_forever завершится (из другого потока)"""
+        return self._finished.wait(timeout)
@@ -0,0 +1,164 @@
+import asyncio
+import hmac
+import json
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    403: 'Forbidden',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    503: 'Service Unavailable',
+}
+
+# Обновление Telegram редко больше нескольких килобайт
+MAX_BODY = 1024 * 1024
+READ_TIMEOUT = 10
+
+
+class WebhookServer:
+    """Прием обновлений Telegram по вебхуку (asyncio, без зависимостей).
+    
+    HTTP-сервер только проверяет запрос, кладет обновление в ограниченную
+    очередь и сразу отвечает 200. Обработчики бота вызываются в отдельных
+    рабочих потоках (`workers`), поэтому медленный обработчик не задерживает
+    ответ Telegram. Если очередь заполнена, сервер отвечает 503 и Telegram
+    повторит доставку позже. `inbox` - своя очередь вместо queue.Queue
+    (например, admission.AdmissionQueue).
+    
+    Проверка без Telegram - отправить записанное обновление на localhost:
+        
+        curl -X POST http://localhost:8080/telegram \\
+             -H 'X-Telegram-Bot-Api-Secret-Token: <WEBHOOK_SECRET>' \\
+             -d @update.json
+    """
+    
+    def __init__(self, dispatch, path='/telegram', secret=None,
+                 host='0.0.0.0', port=8080, workers=4, queue_size=1000, inbox=None):
+        self.dispatch = dispatch
+        self.path = path
+        self.secret = secret
+        self.host = host
+        self.port = port
+        self.queue = inbox if inbox is not None else queue.Queue(maxsize=queue_size)
+        self.stats = {'accepted': 0, 'rejected': 0, 'overflow': 0, 'failed': 0}
+        self._workers = [
+            threading.Thread(target=self._work, name=f'webhook-worker-{i}', daemon=True)
+            for i in range(workers)
+        ]
+        self._loop = None
+        self._stopped = None
+        self.ready = threading.Event()
+    
+    # ===== HTTP =====
+    async def _handle(self, reader, writer):
+        try:
+            status = await asyncio.wait_for(self._read_request(reader), READ_TIMEOUT)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+            status = 400
+        if status != 200:
+            self.stats['rejected'] += 1
+        try:
+            writer.write(
+                f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                f"Content-Length: 0\r\n"
+                f"Connection: close\r\n\r\n".encode('ascii')
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+    
+    async def _read_request(self, reader):
+        request_line = await reader.readline()
+        method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        
+        length = int(headers.get('content-length', 0))
+        if length > MAX_BODY:
+            return 413
+        body = await reader.readexactly(length) if length else b''
+        return self._route(method, target, headers, body)
+    
+    def _route(self, method, target, headers, body):
+        if method == 'GET' and target == '/healthz':
+            return 200
+        if target != self.path:
+            return 404
+        if method != 'POST':
+            return 405
+        
+        # Telegram присылает секрет, заданный в setWebhook(secret_token=...)
+        if self.secret:
+            token = headers.get('x-telegram-bot-api-secret-token', '')
+            if not hmac.compare_digest(token.encode(), self.secret.encode()):
+                return 403
+        
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return 400
+        if not isinstance(update, dict) or 'update_id' not in update:
+            return 400
+        
+        try:
+            self.queue.put_nowait(update)
+        except queue.Full:
+            self.stats['overflow'] += 1
+            return 503
+        self.stats['accepted'] += 1
+        return 200
+    
+    # ===== ОБРАБОТКА =====
+    def _work(self):
+        while True:
+            update = self.queue.get()
+            if update is None:
+                return
+            try:
+                self.dispatch(update)
+            except Exception as e:
+                self.stats['failed'] += 1
+                logger.error(f"Ошибка обработки обновления {update.get('update_id')}: {e}")
+    
+    # ===== ЗАПУСК / ОСТАНОВКА =====
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = server.sockets[0].getsockname()[1]
+        logger.info(f"🌐 Вебхук слушает {self.host}:{self.port}{self.path}")
+        self.ready.set()
+        async with server:
+            await self._stopped.wait()
+    
+    def serve_forever(self):
+        """Запустить сервер в текущем потоке (до вызова stop)"""
+        for worker in self._workers:
+            worker.start()
+        try:
+            asyncio.run(self._serve())
+        finally:
+            # Дорабатываем то, что уже принято, и останавливаем потоки
+            for _ in self._workers:
+                self.queue.put(None)
+            for worker in self._workers:
+                worker.join()
+    
+    def stop(self):
+        if self._loop and self._stopped:
+            self._loop.call_soon_threadsafe(self._stopped.set)